@@ -37,6 +37,11 @@ from tensorflow.keras import layers
 from tensorflow.keras.models import load_model
 
 import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# Grad-CAM vectorisé, partagé avec l'application Streamlit
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'streamlit_app'))
+from utils.gradcam_utils import get_explainer, make_heatmap
 
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.applications.vgg16 import VGG16, preprocess_input, decode_predictions
@@ -99,47 +104,15 @@ def get_img_array(img_path, height, width):
 
     return img_array
 
-def make_heatmap(img_array, model, last_conv_layer, class_index):
-    """
-    Calcule la CAM (Class Activation Map) correspondant au label d'indice "class_index" pour l'image "img_array"
-    model : un modèle déjà entraîné, dont on désactive la fonction d'activation en sortie (fait dans grandcam())
-    last_conv_layer : dernière couche de convolution du modèle. Trouvée automatiquement par la fonction gradcam()
-    class_index : renseigné dans l'appel de gradcam() ou trouvé automatiquement par gradcam()
-    """
-    
-    grad_model = tf.keras.models.Model([model.inputs], [last_conv_layer.output, model.output])
-  
-    with tf.GradientTape() as tape:
-        last_conv_layer_output, preds = grad_model(img_array)
-        class_channel = preds[:, class_index]
-
-    grads = tape.gradient(class_channel, last_conv_layer_output)
-    pooled_grads = tf.reduce_mean(grads, axis = (0, 1, 2))
-
-    heatmap_tmp = last_conv_layer_output[0].numpy()
-
-    # Multiplie chaque carte d'activation par le gradient, puis moyenne
-    for i in range(last_conv_layer_output.shape[3]):
-        heatmap_tmp[:,:,i] *= pooled_grads[i]
-    heatmap = np.mean(heatmap_tmp, axis=-1)
-
-    return heatmap
-
-
 def gradcam(model, TF, img_path, height, width, class_index = None, alpha = 0.5, plot = True):
 
     # Chargement + preprocessing de l'image:
     #img_array = get_img_array(img_path, height, width)
     img_array = get_img_array_2(img_path, TF, height, width)
 
-    # Désactive softmax sur la dernière couche :
-    model.layers[-1].activation = None
-
-    # Détecte la dernière couche de convolution du modèle :
-    for layer in reversed(model.layers):
-        if 'conv' in layer.name:
-            last_conv_layer = model.get_layer(layer.name)
-            break        
+    # Dernière couche de convolution, détectée une fois par modèle (le
+    # modèle n'est plus modifié : l'explainer calcule les logits lui-même)
+    last_conv_layer = get_explainer(model).last_conv_layer
 
     
     if class_index == None :
@@ -149,10 +122,27 @@ def gradcam(model, TF, img_path, height, width, class_index = None, alpha = 0.5,
 
     # Calcul de la CAM : resize pour superposition avec l'image finale
     heatmap = make_heatmap(img_array, model, last_conv_layer, class_index)
-    big_heatmap = heatmap
+    big_heatmap, superimposed_img = superimpose_gradcam(heatmap, img_path, alpha)
+
+    if plot == True:
+    # 7/ Affichage des résultats
+        fig = plt.figure(figsize = (8,8))
+        fig.add_subplot(1,2,1)
+        plt.imshow(big_heatmap)
+
+        fig.add_subplot(1,2,2)
+        plt.imshow(superimposed_img)
+        plt.title("Chosen class : "+str(list(label_map.keys())[class_index]))
+
+    return big_heatmap, superimposed_img
 
-      # Réactive softmax :
-    model.layers[-1].activation = tf.keras.activations.softmax
+
+def superimpose_gradcam(heatmap, img_path, alpha = 0.5):
+    """
+    Traitement de la heatmap et superposition à l'image d'origine "img_path"
+    Retourne la heatmap (0-255) et l'image superposée
+    """
+    big_heatmap = heatmap
 
       ## Traitement de la Heatmap
       # Applique ReLu (élimine les valeurs négatives de la heatmap)
@@ -180,22 +170,12 @@ def gradcam(model, TF, img_path, height, width, class_index = None, alpha = 0.5,
     superimposed_img = jet_heatmap*alpha + img
     superimposed_img = tf.keras.preprocessing.image.array_to_img(superimposed_img)
 
-    if plot == True:
-    # 7/ Affichage des résultats
-        fig = plt.figure(figsize = (8,8))
-        fig.add_subplot(1,2,1)
-        plt.imshow(big_heatmap)
-
-        fig.add_subplot(1,2,2)
-        plt.imshow(superimposed_img)
-        plt.title("Chosen class : "+str(list(label_map.keys())[class_index]))
-
     return big_heatmap, superimposed_img
 
 
 ##################################################################################################################
 ### Création de la fonction grad_cam_viz: qui superpose le grad-cam aux images préprocessées pour les 10 catégories de cellules
-def grad_cam_viz(df, model, TF, numcat, height, width, height_crop, width_crop, label_map):
+def grad_cam_viz(df, model, TF, numcat, height, width, height_crop, width_crop, label_map, batch_size = 32, n_jobs = 8):
     
     '''
     Args:
@@ -208,94 +188,66 @@ def grad_cam_viz(df, model, TF, numcat, height, width, height_crop, width_crop,
     - height_crop: image height after cropping
     - width_crop: image height after cropping
     - label_map: labels of the cells categories
+    - batch_size: number of images explained at once
+    - n_jobs: number of threads loading the images and superimposing the heatmaps
+    Les prédictions du data frame ("label_pred") sont réutilisées : les CAM de 
+    toutes les images sélectionnées sont calculées par lots, sans nouvelle 
+    prédiction.
     '''
     num_cat = numcat
-    #img_size = (height, width)
-    TF= TF
-    
-    #data_preprocessing = tf.keras.Sequential(
-    #    [
-    #    layers.Resizing(height=height, width=width, interpolation='nearest',crop_to_aspect_ratio=False), # redimensionne un lot d'images à une taille cible.
-    #    layers.CenterCrop(height=height_crop, width = width_crop), #retourne une culture centrale d'un lot d'images
-    #    layers.Rescaling(scale=1./255), # remet à l' échelle et les décalages des valeurs d'un lot d'images 
-    #    ]
-    #)
-
-    # pour les images bien classées
-    fig = plt.figure(figsize = (30, 20))
-    plt.suptitle("Grad-Cam for Well-classified PBC",fontsize=50)
-    i = 0
-   
-    for blood_cell in range(num_cat):
-        df_temp =  df[(df["label"] == blood_cell) & (df["good_class"] == True)]
-        if len(df_temp.index) == 0:
-            continue
-        id = np.random.choice(df_temp.index, size = 1, replace = False)
-        img_path = df_temp.loc[id[0],"img_path"]
-  
-        #img_array = get_img_array(img_path, height, width)
-        
-        # Application du préprocessing prédéfinie pour chaque image
-        #img_array = data_preprocessing(img_array)
-        
-        #heatmap1 = make_gradcam_heatmap(img_array, model, last_conv_layer_name)
-        #heatmap, superimposed_img = save_and_display_gradcam(img_path, heatmap1)
-
-        big_heatmap, superimposed_img = gradcam(model, TF, img_path, height, width,
-                                          class_index = None, alpha = 0.8, plot = False)
-        
-        fig.add_subplot(4,6,i+1)
-        plt.imshow(plt.imread(img_path))
-        plt.title("Original " + list(label_map.keys())[blood_cell], fontsize = 30)
-        plt.grid(None)
-        plt.axis('off')
-
-        lp = df_temp.loc[id[0],"label_pred"]
-        fig.add_subplot(4,6,i+2)
-        plt.imshow(superimposed_img) 
-        plt.title("Grad-CAM " + list(label_map.keys())[lp], fontsize = 30) 
-        plt.grid(None)
-        plt.axis('off')
-
-        i += 2
-        
-        
-    # pour les images mal classées
-    fig = plt.figure(figsize = (30, 20))
-    plt.suptitle("Grad-Cam for Misclassified PBC",fontsize=50)
-    i = 0
-   
-    for blood_cell in range(num_cat):
-        df_temp =  df[(df["label"] == blood_cell) & (df["good_class"] == False)]
-        if len(df_temp.index) == 0:
-            continue
-        id = np.random.choice(df_temp.index, size = 1, replace = False)
-        img_path = df_temp.loc[id[0],"img_path"]
-  
-        #img_array = get_img_array(img_path, size=img_size)
-        
-        # Application du préprocessing prédéfinie pour chaque image
-        #img_array = data_preprocessing(img_array)
-        
-        #heatmap1 = make_gradcam_heatmap(img_array, model, last_conv_layer_name)
-        #heatmap, superimposed_img = save_and_display_gradcam(img_path, heatmap1)
-
-        big_heatmap, superimposed_img = gradcam(model, TF, img_path, height, width,
-                                          class_index = None, alpha = 0.8, plot = False)
-        
-        fig.add_subplot(4,6,i+1)
-        plt.imshow(plt.imread(img_path))
-        plt.title("Original " + list(label_map.keys())[blood_cell], fontsize = 30)
-        plt.grid(None)
-        plt.axis('off')
-
-        lp = df_temp.loc[id[0],"label_pred"]
-        fig.add_subplot(4,6,i+2)
-        plt.imshow(superimposed_img) 
-        plt.title("Grad-CAM " + list(label_map.keys())[lp], fontsize = 30) 
-        plt.grid(None)
-        plt.axis('off')
-
-        i += 2
+    labels = list(label_map.keys())
+
+    # Sélectionne une image bien classée et une image mal classée par catégorie
+    selection = {}
+    for good_class in [True, False]:
+        selection[good_class] = []
+        for blood_cell in range(num_cat):
+            df_temp =  df[(df["label"] == blood_cell) & (df["good_class"] == good_class)]
+            if len(df_temp.index) == 0:
+                continue
+            id = np.random.choice(df_temp.index, size = 1, replace = False)
+            selection[good_class].append((blood_cell, df_temp.loc[id[0],"img_path"], df_temp.loc[id[0],"label_pred"]))
+
+    selected = selection[True] + selection[False]
+    img_paths = [img_path for _, img_path, _ in selected]
+    labels_pred = [int(lp) for _, _, lp in selected]
+
+    explainer = get_explainer(model)
+
+    with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+        # Chargement + preprocessing des images
+        img_arrays = list(executor.map(lambda img_path: get_img_array_2(img_path, TF, height, width), img_paths))
+
+        # CAM de la classe prédite, par lots
+        heatmaps = []
+        for start in range(0, len(selected), batch_size):
+            batch = np.concatenate(img_arrays[start:start+batch_size], axis = 0)
+            heatmaps.extend(explainer.explain_images(batch, labels_pred[start:start+batch_size]))
+
+        # Superposition des heatmaps aux images d'origine
+        superimposed_imgs = list(executor.map(lambda args: superimpose_gradcam(*args, alpha = 0.8)[1], zip(heatmaps, img_paths)))
+
+    # Images bien classées, puis mal classées
+    n_good = len(selection[True])
+    superimposed = {True: superimposed_imgs[:n_good], False: superimposed_imgs[n_good:]}
+
+    for good_class, title in [(True, "Grad-Cam for Well-classified PBC"), (False, "Grad-Cam for Misclassified PBC")]:
+        fig = plt.figure(figsize = (30, 20))
+        plt.suptitle(title,fontsize=50)
+        i = 0
+
+        for (blood_cell, img_path, lp), superimposed_img in zip(selection[good_class], superimposed[good_class]):
+            fig.add_subplot(4,6,i+1)
+            plt.imshow(plt.imread(img_path))
+            plt.title("Original " + labels[blood_cell], fontsize = 30)
+            plt.grid(None)
+            plt.axis('off')
+
+            fig.add_subplot(4,6,i+2)
+            plt.imshow(superimposed_img) 
+            plt.title("Grad-CAM " + labels[lp], fontsize = 30) 
+            plt.grid(None)
+            plt.axis('off')
+
+            i += 2
     return
-
@@ -23,7 +23,7 @@
 # | script: bcc_utilities.py                   |
 # | author: Thomas DUMAZERT                    |
 # | creation: 02/13/2023                       |
-# | last modified: 03/21/2023                  |
+# | last modified: 10/18/2026                  |
 # ----------------------------------------------
 
 # This module is intended to provided utility functions to analyze and handle
@@ -36,6 +36,9 @@ import numpy as np
 import pandas as pd
 import cv2
 import os
+import io
+import hashlib
+import sqlite3
 from pathlib import Path
 from PIL import Image
 import re
@@ -47,6 +50,8 @@ from matplotlib.lines import Line2D
 import seaborn as sns
 import time
 import copy
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -155,6 +160,25 @@ IMG_EXTS = ['.jpeg', '.jpg', '.png', '.gif', '.tiff', '.tif',
 
 SOURCES = ['barcelone', 'kaggle', 'munich', 'raabin']
 
+# Pixels distributions extracted from the images, in their storage order
+DISTRIBUTION_COLUMNS = ['gray_distribution', 'red_distribution', 'green_distribution', 'blue_distribution']
+
+# Offsets of the blue, green and red channels bins when extracting the 
+# distributions in a single count
+DISTRIBUTION_OFFSETS = np.array([3*256, 2*256, 1*256], dtype=np.uint16)
+
+# Sets of the datasets
+SPLITS = ['train', 'val', 'test']
+
+# Parameters of the augmentations used to balance the categories
+AUGMENTATION_PARAMS = {
+    'rotation': 360,
+    'hflip': True,
+    'vflip': True,
+    'contrast': (0.5, 2.0),
+    'brightness': (0, 50),
+}
+
 # Dictionnary linking sources with their transform dictionnary
 TRANSFORMS = {
     'barcelone': BR,
@@ -221,6 +245,9 @@ class ImageAugmentation:
         # Choose a random angle
         angle = self.random_generator.choice(self.rotation) * 90
 
+        # Square images are rotated by 90 degrees steps without interpolation
+        if h == w: return np.ascontiguousarray(np.rot90(image, k=(angle // 90) % 4))
+
         # Rotation matrix
         M = cv2.getRotationMatrix2D((w/2,h/2), angle, 1.0)
 
@@ -286,27 +313,192 @@ class ImageAugmentation:
 
         return image
 
-    def image_augment(self, save_path, num_augments=1):
+    def augment(self, num_augments=1):
         """
-        Create new images with image augmentations.
+        Create new images with image augmentations, in memory.
         Parameter:
-            - 'save_path': string. The path to store the new image ;
             - 'num_augments': optionnal, int. The number of augmentation to 
                               proceed. Default to 1.
-        Return: the path to tthe new image
+        Return: a list of (img_name, image) tuples.
         """
 
         img_aug = cv2.imread(f'{self.path}/{self.name}')
         augs = self.random_generator.sample(self.augmentations, k=self.random_generator.randint(1, len(self.augmentations)))
 
+        new_images = []
+
         for i in range(num_augments):
             for aug in augs:
                 img_aug = aug(img_aug)
             img_name = f'{self.name.split(".")[0]}_aug_{i+1:03d}.jpg'
+            new_images.append((img_name, img_aug))
+
+        return new_images
+
+    def image_augment(self, save_path, num_augments=1):
+        """
+        Create new images with image augmentations.
+        Parameter:
+            - 'save_path': string. The path to store the new image ;
+            - 'num_augments': optionnal, int. The number of augmentation to 
+                              proceed. Default to 1.
+        Return: the path to tthe new image
+        """
+
+        for img_name, img_aug in self.augment(num_augments):
             cv2.imwrite(f'{save_path}/{img_name}', img_aug)
 
         return save_path
 
+class BatchAugmentation:
+    def __init__(self, rotation=None, hflip=False, vflip=False, contrast=None, brightness=None, random_state=None, random_generator=None):
+        """
+        Initailize instance. The augmentations are applied to batches of 
+        images, with random parameters drawn for each image.
+        Parameters:
+            - 'rotation': int or array-like of ints. Number of 90 degrees 
+                          rotation to choose from. Default to None ;
+            - 'hflip': boolean. Flag to authorize horizontal flip. Default to 
+                       None ;
+            - 'vflip': boolean. Flag to authorize vertical flip. Default to 
+                       None ;
+            - 'contrast': float or array-like of floats. Boundaries of the 
+                          contrast modification. Default to None ;
+            - 'brightness': int or array-like of ints. Boundaries of the 
+                            brightness modification. Default to None ;
+            - 'random_state': optionnal, int. A random seed to initialize a 
+                              pseudo-random sequence of numbers. Default to 
+                              None ;
+            - 'random_generator': optionnal, numpy.random.Generator object. 
+                                  Use to continue a pseudo-random sequence 
+                                  already initialized. Default to None.
+        Return: None
+        """
+
+        if isinstance(rotation, int): self.rotation = np.arange(rotation+1)
+        elif rotation is None: self.rotation = None
+        else: self.rotation = np.asarray(rotation)
+        self.hflip = hflip
+        self.vflip = vflip
+        self.contrast = contrast
+        self.brightness = brightness
+
+        # Initialize a pseudo-random sequence
+        if not random_generator: self.random_generator = np.random.default_rng(random_state)
+        else: self.random_generator = random_generator
+
+    def rotate(self, images):
+        """
+        Randomly rotate each image of the batch by steps of 90 degrees. 
+        Rotations by 90 or 270 degrees are only applied to square images.
+        Parameter: 
+            - 'images': numpy array of shape (N, H, W, C). The images to be 
+                        processed.
+        Return: the processed images.
+        """
+
+        if self.rotation is None or len(self.rotation) == 0: return images
+
+        n, h, w = images.shape[:3]
+
+        steps = self.random_generator.choice(self.rotation, size=n) % 4
+        if h != w: steps = steps - steps % 2
+
+        for k in np.unique(steps):
+            if k == 0: continue
+            idx = np.flatnonzero(steps == k)
+            images[idx] = np.rot90(images[idx], k=k, axes=(1, 2))
+
+        return images
+
+    def flip(self, images):
+        """
+        Randomly flip each image of the batch.
+        Parameter: 
+            - 'images': numpy array of shape (N, H, W, C). The images to be 
+                        processed.
+        Return: the processed images.
+        """
+
+        n = images.shape[0]
+
+        if self.hflip:
+            idx = np.flatnonzero(self.random_generator.integers(0, 2, size=n))
+            images[idx] = images[idx, :, ::-1]
+        if self.vflip:
+            idx = np.flatnonzero(self.random_generator.integers(0, 2, size=n))
+            images[idx] = images[idx, ::-1, :]
+
+        return images
+
+    def change_colors(self, images):
+        """
+        Randomly change the contrast and the brightness of each image of the 
+        batch, as cv2.convertScaleAbs does.
+        Parameter: 
+            - 'images': numpy array of shape (N, H, W, C). The images to be 
+                        processed.
+        Return: the processed images.
+        """
+
+        if not self.contrast and not self.brightness: return images
+
+        n = images.shape[0]
+        shape = (n,) + (1,) * (images.ndim - 1)
+
+        # Contrast and brightness parameters
+        alpha = np.ones(shape, dtype=np.float32)
+        beta = np.zeros(shape, dtype=np.float32)
+
+        if self.contrast:
+            low_contrast, high_contrast = 0.0, 0.0
+            try:
+                low_contrast, high_contrast = self.contrast
+            except:
+                high_contrast = self.contrast
+
+            # Bound alpha parameter to 3.0
+            alpha[:] = np.minimum(self.random_generator.uniform(low_contrast, high_contrast+0.00001, size=n), 3.0).reshape(shape)
+
+        if self.brightness:
+            low_brightness, high_brightness = 0, 0
+            try:
+                low_brightness, high_brightness = self.brightness
+            except:
+                high_brightness = self.brightness
+
+            beta[:] = self.random_generator.integers(low_brightness, high_brightness, size=n, endpoint=True).reshape(shape)
+
+        # Apply parameters
+        scaled = images * alpha
+        scaled += beta
+        np.abs(scaled, out=scaled)
+        np.rint(scaled, out=scaled)
+        np.clip(scaled, 0, 255, out=scaled)
+        images[...] = scaled
+
+        return images
+
+    def augment(self, images, inplace=False):
+        """
+        Apply the random rotations, flips and colors changes to a batch of 
+        images.
+        Parameters:
+            - 'images': numpy array of shape (N, H, W, C) and of type uint8. 
+                        The images to be processed ;
+            - 'inplace': optionnal, boolean. Whether to modify the images 
+                         array or a copy of it. Default to False.
+        Return: the processed images.
+        """
+
+        if not inplace: images = images.copy()
+
+        images = self.rotate(images)
+        images = self.flip(images)
+        images = self.change_colors(images)
+
+        return images
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Functions
 
@@ -395,55 +587,101 @@ def count_image(root):
 
     return img_count
 
-def organize_data(source, target, transforms_dict=TRANSFORMS, adjust_size=False, target_size=None, size_adjust_dir=None, resize=None, exclude=None):
+def load_manifest(path):
     """
-    Sort and rename the files from the source directory and put them into the
-    target directory.
+    Load the ingestion manifest stored in a SQLite database, creating it if 
+    needed.
+    Parameter:
+        - 'path': a string or pathlib.Path object. The path to the SQLite 
+                  database file.
+    Return: a dictionnary mapping the source path of each image with its 
+            manifest record, and a dictionnary of the settings used during 
+            the last ingestion.
+    """
+
+    with sqlite3.connect(path) as con:
+        con.execute(
+            'CREATE TABLE IF NOT EXISTS images (source_path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+            'hash TEXT, label TEXT, img_name TEXT, output_path TEXT, crop INTEGER, corrupted INTEGER)'
+        )
+        con.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+
+        con.row_factory = sqlite3.Row
+        rows = {row['source_path']: dict(row) for row in con.execute('SELECT * FROM images')}
+        settings = {row['key']: row['value'] for row in con.execute('SELECT * FROM settings')}
+
+    return rows, settings
+
+def save_manifest(path, records, removed, settings):
+    """
+    Update the ingestion manifest stored in a SQLite database.
+    Parameters:
+        - 'path': a string or pathlib.Path object. The path to the SQLite 
+                  database file ;
+        - 'records': a list of dictionnaries. The records to insert or 
+                     replace ;
+        - 'removed': a list of strings. The source paths of the records to 
+                     delete ;
+        - 'settings': a dictionnary. The settings used during the ingestion.
+    Return: None.
+    """
+
+    columns = ['source_path', 'size', 'mtime', 'hash', 'label', 'img_name', 'output_path', 'crop', 'corrupted']
+
+    with sqlite3.connect(path) as con:
+        con.executemany(
+            f'INSERT OR REPLACE INTO images ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+            [tuple(record[col] for col in columns) for record in records]
+        )
+        con.executemany('DELETE FROM images WHERE source_path = ?', [(p,) for p in removed])
+        con.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', settings.items())
+
+def plan_ingestion(source, transforms_dict=TRANSFORMS, exclude=None, chunk_size=256, known=None):
+    """
+    Walk the source directory and split the images to organize into work 
+    units. The images names are assigned during the walk, so they don't depend 
+    on the order in which the work units are processed.
     Parameters:
         - 'source': a string containing the path (relative or absolute) of the 
                     source directory ;
-        - 'target': a string containing the path (relative or absolute) of the 
-                    target directory ;
         - 'transforms_dict': a dictionnary mapping the sources of the datasets 
                              with their transform dictionnary ;
-        - 'adjust_size': a boolean flagging the need to adjusts images size ;
-        - 'target_size': an int or a tuple containing the targeted (height, 
-                         width) of the adjusted images. Should be provided if 
-                         'adjust_size' is set to True. If int width = height ;
-        - 'size_adjust_dir': string. The path where to store the resized 
-                             images. If None, the resized images are stored in 
-                             the target directory instead of the original 
-                             ones. If a path is indicated both original images 
-                             and resized images are stored in their respective 
-                             directories ;
-        - 'resize': a dictionnary containing the image to resize instead of crop.
-                    Maps the sources with a list of encoded blood cell to crop ;
-        - 'exclude': a list containing the categories to exclude from the 
-                     dataset.
-    Return: the number of images treated.
+        - 'exclude': optionnal. A list containing the categories to exclude 
+                     from the dataset. Default to None ;
+        - 'chunk_size': optionnal, int. The maximum number of images per work 
+                        unit. Default to 256 ;
+        - 'known': optionnal, dictionnary. The manifest records of the images 
+                   already organized, as returned by 'load_manifest'. Known 
+                   images keep their name, and are not planned again if their 
+                   size and modification time didn't change. New images are 
+                   numbered after the known ones. Default to None.
+    Return: the list of the work units, the next value of the images counter 
+            and the set of the source paths of all the images found. Each 
+            work unit is a tuple (source, images) where 'images' is a list of 
+            (origin_file, encoded_blood_cell, img_name, known_hash) tuples.
     """
 
-    if not Path(target).exists(): os.mkdir(target)
-    
-    target_base = f'{target}/base'
-    if not Path(target_base).exists(): os.mkdir(target_base)
-
-    if adjust_size and not target_size:
-        raise AttributeError("'adjust_size' set to true without providing 'target_size'")
+    if exclude is None: exclude = []
+    if known is None: known = {}
 
-    if type(target_size) == int: target_size = (target_size, target_size)
+    units = []
+    sources = set()
 
     img_counter = 1
-    
+    if len(known) > 0:
+        img_counter += max(int(row['img_name'].split('.')[0].split('_')[-1]) for row in known.values())
+
     for current_dir, _, files_list in os.walk(source):
         ds_source = get_source(current_dir)
-        
+
         patient_search = re.search(r'Patient_\d+', current_dir)
         if patient_search:
             patient_num = f'{int(patient_search.group(0).split("_")[-1]):03d}'
         else:
             patient_num = 'xxx'
-        
+
+        dir_images = []
+
         for file in files_list:
             blood_cell = split_path(current_dir)[-1].lower()
 
@@ -458,58 +696,255 @@ def organize_data(source, target, transforms_dict=TRANSFORMS, adjust_size=False,
                 if encoded_blood_cell not in exclude:
                     if ds_source == 'kaggle' and current_dir.find('Unsigned slides') == -1:
                         encoded_blood_cell = encoded_blood_cell.upper()
-                
-                    img_name = f'{encoded_blood_cell}_{ds_source[:3]}_{patient_num}_{img_counter:06d}.jpg'
-                    img_counter += 1
-                    
-                    path = f'{current_dir}/{file}'
-                    
-                    corrupted = False
-                    try:
-                        Image.open(path).load()
-                    except Exception as e:
-                        corrupted = True
-
-                    if not corrupted:
-                        cell_dir = 'unlabeled' if encoded_blood_cell.lower() == 'xxx' else encoded_blood_cell.lower()
-                        
-                        target_dir = f'{target_base}/{cell_dir}'
-
-                        if not Path(target_dir).exists(): os.mkdir(target_dir)
-
-                        # Create adjusted images directory if needed
-                        
-                        if size_adjust_dir:
-                            if not Path(size_adjust_dir).exists(): os.mkdir(size_adjust_dir)
-
-                            adjust_base_dir = f'{size_adjust_dir}/base'
-                            if not Path(adjust_base_dir).exists(): os.mkdir(adjust_base_dir)
-
-                            adjust_target_dir = f'{adjust_base_dir}/{cell_dir}'
-                            if not Path(adjust_target_dir).exists(): os.mkdir(adjust_target_dir)
-
-                        target_file = f'{target_dir}/{img_name}'
-                        origin_file = f'{current_dir}/{file}'
-                        
-                        if adjust_size:
-                            img = cv2.imread(str(origin_file), cv2.IMREAD_COLOR)
-                            crop = resize and (ds_source[:3] in resize.keys()) and (encoded_blood_cell in resize[ds_source[:3]])
-                            img = adapt_size(img, target_size, crop=crop)
-
-                            if size_adjust_dir:
-                                adjust_target_file = f'{adjust_target_dir}/{img_name}'
-
-                                cv2.imwrite(adjust_target_file, img)
-
-                                if not Path(target_file).exists():
-                                    shutil.copy2(origin_file, target_file)
-                            else:
-                                cv2.imwrite(target_file, img)
-                        else:
-                            if not target_file.exists():
-                                shutil.copy2(origin_file, target_file)
-                    
-                    print(img_name)
+
+                    origin_file = f'{current_dir}/{file}'
+                    sources.add(origin_file)
+
+                    row = known.get(origin_file)
+
+                    if row is not None and row['label'] == encoded_blood_cell:
+                        # Skip the images unchanged since the last ingestion
+                        stat = os.stat(origin_file)
+                        if row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+                            continue
+                        img_name, known_hash = row['img_name'], row['hash']
+                    else:
+                        img_name = f'{encoded_blood_cell}_{ds_source[:3]}_{patient_num}_{img_counter:06d}.jpg'
+                        img_counter += 1
+                        known_hash = None
+
+                    dir_images.append((origin_file, encoded_blood_cell, img_name, known_hash))
+
+        # Split large directories to balance the work between the workers
+        for i in range(0, len(dir_images), chunk_size):
+            units.append((ds_source, dir_images[i:i+chunk_size]))
+
+    return units, img_counter, sources
+
+def ingest_unit(unit, target, adjust_size=False, target_size=None, size_adjust_dir=None, resize=None):
+    """
+    Check, adjust and write the images of a work unit created by 
+    'plan_ingestion'. Each image is read and decoded only once. The images 
+    whose content hash is the known one and whose output exists are not 
+    processed again.
+    Parameters:
+        - 'unit': a tuple (source, images). The work unit to process ;
+        - 'target': a string containing the path (relative or absolute) of the 
+                    target directory ;
+        - 'adjust_size': a boolean flagging the need to adjusts images size ;
+        - 'target_size': a tuple containing the targeted (height, width) of 
+                         the adjusted images ;
+        - 'size_adjust_dir': string. The path where to store the resized 
+                             images. See 'organize_data' ;
+        - 'resize': a dictionnary containing the image to resize instead of 
+                    crop. Maps the sources with a list of encoded blood cell 
+                    to crop.
+    Return: a list of dictionnaries describing, for each image of the unit, 
+            its origin file, size, modification time, content hash, label, 
+            name, output file, wether it was cropped, wether it is corrupted 
+            and wether it was left unchanged.
+    """
+
+    ds_source, images = unit
+    target_base = f'{target}/base'
+
+    results = []
+
+    for origin_file, encoded_blood_cell, img_name, known_hash in images:
+        record = {
+            'source_path': origin_file,
+            'size': None,
+            'mtime': None,
+            'hash': None,
+            'label': encoded_blood_cell,
+            'img_name': img_name,
+            'output_path': None,
+            'crop': None,
+            'corrupted': False,
+            'unchanged': False,
+        }
+        results.append(record)
+
+        cell_dir = 'unlabeled' if encoded_blood_cell.lower() == 'xxx' else encoded_blood_cell.lower()
+
+        target_dir = f'{target_base}/{cell_dir}'
+        target_file = f'{target_dir}/{img_name}'
+        if size_adjust_dir:
+            adjust_target_dir = f'{size_adjust_dir}/base/{cell_dir}'
+            output_file = f'{adjust_target_dir}/{img_name}'
+        else:
+            output_file = target_file
+
+        try:
+            stat = os.stat(origin_file)
+            with open(origin_file, 'rb') as f:
+                data = f.read()
+        except OSError:
+            record['corrupted'] = True
+            continue
+
+        record['size'], record['mtime'] = stat.st_size, stat.st_mtime
+        record['hash'] = hashlib.sha1(data).hexdigest()
+
+        # Only the modification time changed
+        if known_hash == record['hash'] and Path(output_file).exists():
+            record['unchanged'] = True
+            continue
+
+        # Decode the image once, both to check it and to adjust its size
+        try:
+            with Image.open(io.BytesIO(data)) as pil_img:
+                pil_img.load()
+                if adjust_size:
+                    img = cv2.cvtColor(np.asarray(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+        except Exception:
+            record['corrupted'] = True
+            continue
+
+        os.makedirs(target_dir, exist_ok=True)
+
+        # Create adjusted images directory if needed
+        if size_adjust_dir:
+            os.makedirs(adjust_target_dir, exist_ok=True)
+
+        record['output_path'] = output_file
+
+        if adjust_size:
+            crop = bool(resize and (ds_source[:3] in resize.keys()) and (encoded_blood_cell in resize[ds_source[:3]]))
+            img = adapt_size(img, target_size, crop=crop)
+            record['crop'] = crop
+
+            cv2.imwrite(output_file, img)
+
+            # Keep the original image, refreshed if its content changed
+            if size_adjust_dir:
+                if known_hash != record['hash'] or not Path(target_file).exists():
+                    shutil.copy2(origin_file, target_file)
+        else:
+            if known_hash != record['hash'] or not Path(target_file).exists():
+                shutil.copy2(origin_file, target_file)
+
+    return results
+
+def organize_data(source, target, transforms_dict=TRANSFORMS, adjust_size=False, target_size=None, size_adjust_dir=None, resize=None, exclude=None, n_jobs=1, chunk_size=256, manifest=None):
+    """
+    Sort and rename the files from the source directory and put them into the
+    target directory.
+    Parameters:
+        - 'source': a string containing the path (relative or absolute) of the 
+                    source directory ;
+        - 'target': a string containing the path (relative or absolute) of the 
+                    target directory ;
+        - 'transforms_dict': a dictionnary mapping the sources of the datasets 
+                             with their transform dictionnary ;
+        - 'adjust_size': a boolean flagging the need to adjusts images size ;
+        - 'target_size': an int or a tuple containing the targeted (height, 
+                         width) of the adjusted images. Should be provided if 
+                         'adjust_size' is set to True. If int width = height ;
+        - 'size_adjust_dir': string. The path where to store the resized 
+                             images. If None, the resized images are stored in 
+                             the target directory instead of the original 
+                             ones. If a path is indicated both original images 
+                             and resized images are stored in their respective 
+                             directories ;
+        - 'resize': a dictionnary containing the image to resize instead of crop.
+                    Maps the sources with a list of encoded blood cell to crop ;
+        - 'exclude': a list containing the categories to exclude from the 
+                     dataset ;
+        - 'n_jobs': optionnal, int. The number of processes used to organize 
+                    the images. If None, use all the available CPUs. Default 
+                    to 1 ;
+        - 'chunk_size': optionnal, int. The maximum number of images processed 
+                        by a process at once. Default to 256 ;
+        - 'manifest': optionnal, a string or pathlib.Path object. The path to 
+                      a SQLite manifest recording the images already 
+                      organized. If provided, only new or modified images are 
+                      processed, and the outputs of the images removed from 
+                      the source directory are deleted. Default to None.
+    Return: the number of images treated.
+    """
+
+    if adjust_size and not target_size:
+        raise AttributeError("'adjust_size' set to true without providing 'target_size'")
+
+    if type(target_size) == int: target_size = (target_size, target_size)
+
+    os.makedirs(f'{target}/base', exist_ok=True)
+    if size_adjust_dir: os.makedirs(f'{size_adjust_dir}/base', exist_ok=True)
+
+    known = {}
+    if manifest is not None:
+        known, last_settings = load_manifest(manifest)
+        settings = {
+            'target': str(target),
+            'adjust_size': str(adjust_size),
+            'target_size': str(target_size),
+            'size_adjust_dir': str(size_adjust_dir),
+            'resize': str(resize),
+        }
+        # Outputs must be created again if the settings changed, but the 
+        # images keep their names
+        if len(last_settings) > 0 and last_settings != settings:
+            known = {p: {**row, 'size': None, 'mtime': None, 'hash': None} for p, row in known.items()}
+
+    # The images names are set before processing the images, so they are the 
+    # same whatever the number of processes
+    units, img_counter, sources = plan_ingestion(source, transforms_dict, exclude, chunk_size, known)
+
+    ingest = partial(
+        ingest_unit,
+        target = target,
+        adjust_size = adjust_size,
+        target_size = target_size,
+        size_adjust_dir = size_adjust_dir,
+        resize = resize
+    )
+
+    n_images, n_corrupted = 0, 0
+    records = []
+    since = time.time()
+
+    executor = None if n_jobs == 1 else ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        units_results = map(ingest, units) if executor is None else executor.map(ingest, units)
+
+        for unit_results in units_results:
+            for record in unit_results:
+                if record['unchanged']:
+                    record = {**known[record['source_path']], 'size': record['size'], 'mtime': record['mtime']}
+                else:
+                    n_images += 1
+                    n_corrupted += record['corrupted']
+                records.append(record)
+    finally:
+        # Stop the workers even if a work unit failed
+        if executor is not None: executor.shutdown(cancel_futures=True)
+
+    if manifest is not None:
+        # Delete the outputs of the images removed from the source directory
+        removed = [p for p in known.keys() if p not in sources]
+        stale = []
+        for p in removed:
+            row = known[p]
+            stale += [row['output_path'], get_img_path(f'{target}/base', row['img_name'])]
+
+        # Delete the former outputs of the images renamed after a label change
+        for record in records:
+            row = known.get(record['source_path'])
+            if row is None: continue
+            old_files = {row['output_path'], get_img_path(f'{target}/base', row['img_name'])}
+            new_files = {record['output_path'], get_img_path(f'{target}/base', record['img_name'])}
+            stale += list(old_files - new_files)
+
+        for f in stale:
+            if f is not None and Path(f).exists(): os.remove(f)
+
+        save_manifest(manifest, records, removed, settings)
+        print(f'{len(removed)} removed images')
+
+    time_elapsed = time.time() - since
+    throughput = n_images / time_elapsed if time_elapsed > 0 else 0.0
+    print(f'{n_images} images organized ({n_corrupted} corrupted) in {time_elapsed:.1f}s: {throughput:.1f} images/s')
 
     return img_counter
 
@@ -564,28 +999,79 @@ def get_hist(src, hist_size=256, hist_range=(0, 256), accumulate=False):
     else:
         return get_gray_hist(src, hist_size, hist_range, accumulate)
 
-def analyze_pixel_distribution(root):
+def get_distributions(img_color):
+    """
+    Extracts gray, red, green and blue pixels distributions from a color image 
+    in a single pass. The grayscale image is derived from the color one.
+    Parameter:
+        - 'img_color': a numpy array of shape (h, w, 3) containing a BGR image.
+    Return: a numpy array of shape (4, 256) containing the gray, red, green 
+            and blue pixels values distributions.
+    """
+
+    img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY)
+
+    # Shift the values of each channel to their own range of 256 bins, so a 
+    # single count gives the four distributions
+    packed = np.empty((img_gray.size, 4), dtype=np.uint16)
+    packed[:, 0] = img_gray.reshape(-1)
+    np.add(img_color.reshape(-1, 3), DISTRIBUTION_OFFSETS, out=packed[:, 1:], dtype=np.uint16)
+
+    return np.bincount(packed.reshape(-1), minlength=4*256).reshape((4, 256)).astype(np.float32)
+
+def extract_distributions(path_list):
+    """
+    Extracts gray, red, green and blue pixels distributions from images.
+    Parameter:
+        - 'path_list': a list of path pointing to the images to analyze.
+    Return: a numpy array of shape (N, 4, 256) containing the gray, red, green 
+            and blue pixels values distributions of each image. The 
+            distributions of the images which can't be read are null.
+    """
+
+    distributions = np.zeros((len(path_list), 4, 256), dtype=np.float32)
+
+    for i, path in enumerate(path_list):
+        img_color = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if img_color is not None:
+            distributions[i] = get_distributions(img_color)
+
+    return distributions
+
+def analyze_pixel_distribution(root, n_jobs=1, chunk_size=256, as_arrays=False, save_dir=None):
     """
     Extracts pixels values grayscale and BGR distributions from images in the 
     root directory and its sub directories.
-    Parameter:
+    Parameters:
         - 'root': a string containing the path (relative or absolute) to the 
-                  root directory to analyze.
+                  root directory to analyze ;
+        - 'n_jobs': optionnal, int. The number of processes used to analyze 
+                    the images. If None, use all the available CPUs. Default 
+                    to 1 ;
+        - 'chunk_size': optionnal, int. The maximum number of images analyzed 
+                        by a process at once. Default to 256 ;
+        - 'as_arrays': optionnal, boolean. Whether to return the 
+                       distributions as a single array and a metadata 
+                       DataFrame rather than a dictionnary. Default to False ;
+        - 'save_dir': optionnal, a string or pathlib.Path object. The 
+                      directory where to save the distributions in binary 
+                      format, to be loaded with 'load_distributions'. If None, 
+                      the distributions are not saved. Default to None.
     Return: a dictionnary containing, for each image found in the root 
             directory and its sub directories, the gray, red, green and blue 
-            pixels values distributions.
+            pixels values distributions. If 'as_arrays' is True, a numpy array 
+            of shape (N, 4, 256) containing the gray, red, green and blue 
+            distributions, and a DataFrame containing the 'img_id', 
+            'blood_cell', 'source' and 'healthy' of each image.
     """
 
-    distributions = {
+    metadata = {
         'img_id': [],
         'blood_cell': [],
         'source': [],
         'healthy': [],
-        'gray_distribution': [],
-        'red_distribution': [],
-        'green_distribution': [],
-        'blue_distribution': [],
     }
+    path_list = []
 
     dir_list = os.listdir(root)
 
@@ -597,26 +1083,114 @@ def analyze_pixel_distribution(root):
                 if file_is_a(file, IMG_EXTS):
                     img_id = file
                     blood_cell, source, _, _ = img_id.split('_')
-                    healthy = blood_cell.isupper()
-                    blood_cell = blood_cell.lower()
-
-                    file_path = f'{root}/{dir}/{file}'
-                    img_color = cv2.imread(file_path, cv2.IMREAD_COLOR)
-                    img_gray = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
-
-                    color_hist = get_hist([img_color])
-                    gray_hist = get_hist([img_gray])
-
-                    distributions['img_id'].append(img_id)
-                    distributions['blood_cell'].append(blood_cell)
-                    distributions['source'].append(source)
-                    distributions['healthy'].append(healthy)
-                    distributions['gray_distribution'].append(gray_hist)
-                    distributions['red_distribution'].append(color_hist[2, :])
-                    distributions['green_distribution'].append(color_hist[1, :])
-                    distributions['blue_distribution'].append(color_hist[0, :])
-    
-    return distributions
+
+                    metadata['img_id'].append(img_id)
+                    metadata['blood_cell'].append(blood_cell.lower())
+                    metadata['source'].append(source)
+                    metadata['healthy'].append(blood_cell.isupper())
+                    path_list.append(f'{root}/{dir}/{file}')
+
+    distributions = np.empty((len(path_list), 4, 256), dtype=np.float32)
+
+    chunks = [path_list[i:i+chunk_size] for i in range(0, len(path_list), chunk_size)]
+
+    executor = None if n_jobs == 1 else ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        chunks_distributions = map(extract_distributions, chunks) if executor is None else executor.map(extract_distributions, chunks)
+
+        for i, chunk_distributions in enumerate(chunks_distributions):
+            distributions[i*chunk_size:i*chunk_size+len(chunk_distributions)] = chunk_distributions
+    finally:
+        if executor is not None: executor.shutdown(cancel_futures=True)
+
+    if as_arrays or save_dir is not None:
+        df_metadata = pd.DataFrame(metadata).astype({'blood_cell': 'category', 'source': 'category'})
+
+    if save_dir is not None:
+        save_distributions(save_dir, distributions, df_metadata)
+
+    if as_arrays:
+        return distributions, df_metadata
+
+    for i, col in enumerate(DISTRIBUTION_COLUMNS):
+        metadata[col] = list(distributions[:, i])
+
+    return metadata
+
+def save_distributions(save_dir, distributions, metadata):
+    """
+    Save pixels values distributions in binary format: a numpy file 
+    containing the distributions and a csv file containing their metadata.
+    Parameters:
+        - 'save_dir': a string or pathlib.Path object. The directory where to 
+                      save the distributions ;
+        - 'distributions': a numpy array of shape (N, 4, 256). The gray, red, 
+                           green and blue distributions ;
+        - 'metadata': a DataFrame of N rows. The metadata of the 
+                      distributions.
+    Return: the path to the directory containing the distributions.
+    """
+
+    os.makedirs(save_dir, exist_ok=True)
+
+    np.save(Path(save_dir, 'distributions.npy'), distributions)
+    metadata.to_csv(Path(save_dir, 'metadata.csv'), index=False)
+
+    return save_dir
+
+def load_distributions(save_dir, mmap_mode='r'):
+    """
+    Load pixels values distributions saved with 'save_distributions'.
+    Parameters:
+        - 'save_dir': a string or pathlib.Path object. The directory where the 
+                      distributions are saved ;
+        - 'mmap_mode': optionnal, string. The memory-map mode used to open the 
+                       distributions, or None to load them in memory. See 
+                       numpy.load. Default to 'r'.
+    Return: a numpy array of shape (N, 4, 256) containing the gray, red, green 
+            and blue distributions, and a DataFrame containing their metadata.
+    """
+
+    distributions = np.load(Path(save_dir, 'distributions.npy'), mmap_mode=mmap_mode)
+
+    metadata = pd.read_csv(Path(save_dir, 'metadata.csv'))
+    for col in ['blood_cell', 'source']:
+        if col in metadata.columns: metadata[col] = metadata[col].astype('category')
+
+    return distributions, metadata
+
+def convert_distributions_csv(csv_path, save_dir=None):
+    """
+    Convert a csv file where the pixels values distributions are stored as 
+    printed arrays (such as 'pix_dis_summary.csv') to arrays.
+    Parameters:
+        - 'csv_path': a string or pathlib.Path object. The path to the csv 
+                      file ;
+        - 'save_dir': optionnal, a string or pathlib.Path object. The 
+                      directory where to save the distributions in binary 
+                      format. If None, the distributions are not saved. 
+                      Default to None.
+    Return: a numpy array of shape (N, 4, 256) containing the gray, red, green 
+            and blue distributions, and a DataFrame containing the other 
+            columns of the csv file.
+    """
+
+    df = pd.read_csv(csv_path)
+    df = df.drop(columns=[col for col in df.columns if col.startswith('Unnamed')])
+
+    distributions = np.empty((df.shape[0], 4, 256), dtype=np.float32)
+
+    # Parse each column as a whole instead of each array separately
+    for i, col in enumerate(DISTRIBUTION_COLUMNS):
+        values = ' '.join(df[col]).replace('[', ' ').replace(']', ' ').split()
+        distributions[:, i, :] = np.array(values, dtype=np.float32).reshape((df.shape[0], 256))
+
+    metadata = df.drop(columns=DISTRIBUTION_COLUMNS)
+
+    if save_dir is not None:
+        save_distributions(save_dir, distributions, metadata)
+
+    return distributions, metadata
 
 def get_img_path(root, img_name):
     """
@@ -634,74 +1208,69 @@ def get_img_path(root, img_name):
     if img_dir == 'xxx': img_dir = 'unlabeled'
     return f'{root}/{img_dir}/{img_name}'
 
-def adapt_gray_size(img, target_size, crop=True, centered=True, resize_center=None):
+def get_size_adjustment(img_size, target_size):
     """
-    Adjust the size of a grayscale image to the targeted size and targeted 
-    location.
+    Compute the centered crop and padding needed to adjust the size of an 
+    image to the targeted size.
     Parameters:
-        - 'img': an array containing the pixels values of the image ;
+        - 'img_size': a tuple containing the (height, width) of the image ;
         - 'target_size': a tuple containing the targeted (height, width) of the 
-                         image after the size adjustment ;
-        - 'crop': optionnal. A boolean indicating if the size adjustment must be
-                  done through cropping or resizing. Default to True ;
-        - 'centered': optionnal. A boolean indicating if the size adjustement 
-                      must be centered on the center of the image or not. 
+                         image after the size adjustment.
+    Return: a tuple (y_start, y_end, x_start, x_end) delimiting the area of 
+            the image to keep, and a tuple (top, bottom, left, right) of the 
+            padding to add around this area.
+    """
+
+    img_h, img_w = img_size
+    tgt_h, tgt_w = target_size
+
+    if img_h >= tgt_h:
+        y_start = (img_h - tgt_h + 1) // 2
+        y_end = y_start + tgt_h
+        top, bottom = 0, 0
+    else:
+        y_start, y_end = 0, img_h
+        top = (tgt_h - img_h + 1) // 2
+        bottom = tgt_h - img_h - top
+
+    if img_w >= tgt_w:
+        x_start = (img_w - tgt_w + 1) // 2
+        x_end = x_start + tgt_w
+        left, right = 0, 0
+    else:
+        x_start, x_end = 0, img_w
+        left = (tgt_w - img_w + 1) // 2
+        right = tgt_w - img_w - left
+
+    return (y_start, y_end, x_start, x_end), (top, bottom, left, right)
+
+def adapt_gray_size(img, target_size, crop=True, centered=True, resize_center=None, out=None):
+    """
+    Adjust the size of a grayscale image to the targeted size and targeted 
+    location.
+    Parameters:
+        - 'img': an array containing the pixels values of the image ;
+        - 'target_size': a tuple containing the targeted (height, width) of the 
+                         image after the size adjustment ;
+        - 'crop': optionnal. A boolean indicating if the size adjustment must be
+                  done through cropping or resizing. Default to True ;
+        - 'centered': optionnal. A boolean indicating if the size adjustement 
+                      must be centered on the center of the image or not. 
                       'resize_center' must be provided if set to False. Default 
                       to True ;
         - 'resize_center': optionnal. A tuple containing the target (x, y) 
                            coordinates of the non centerd size adjustment. 
                            Must be provided if 'centered' is set to False.
-                           Default to None.
+                           Default to None ;
+        - 'out': optionnal. An array of shape 'target_size' (and channels) and 
+                 of the same data type as 'img' in which to write the adjusted 
+                 image. Default to None.
     Return: an array of shape 'target_size' containing the adjusted image.
     """
 
-    if not centered and not resize_center:
-        raise AttributeError(
-            "'centered' set to False without providind 'resize_center' coordinates"
-        )
-    
-    adjusted_img = None
-
-    img_h, img_w = img.shape
-    tgt_h, tgt_w = target_size
-
-    if crop:
-        if centered:
-            if img_h >= tgt_h:
-                y_start = int(np.ceil((img_h - tgt_h) / 2))
-                y_end = y_start + tgt_h
-
-                adjusted_img = img[y_start:y_end, :]
-            else:
-                y_start = int(np.ceil((tgt_h - img_h) / 2))
-                y_end = y_start + img_h
-
-                adjusted_img = np.ones((tgt_h, img_w)) * 255
-                adjusted_img[y_start:y_end, :] = img
-
-            if img_w >= tgt_w:
-                x_start = int(np.ceil((img_w - tgt_w) / 2))
-                x_end = x_start + tgt_w
-
-                adjusted_img = adjusted_img[:, x_start:x_end]
-            else:
-                x_start = int(np.ceil((tgt_w - img_w) / 2))
-                x_end = x_start + img_w
-
-                buffer_img = np.ones((adjusted_img.shape[0], tgt_w)) * 255
-                buffer_img[:, x_start:x_end] = adjusted_img
-
-                adjusted_img = buffer_img
-        else:
-            raise NotImplementedError(
-                "Non centered size modification is not yet implemented"
-            )
-    else:
-        adjusted_img = cv2.resize(img, target_size)
-    
-    return adjusted_img
+    return adapt_size(img, target_size, crop, centered, resize_center, out)
 
-def adapt_color_size(img, target_size, crop=True, centered=True, resize_center=None):
+def adapt_color_size(img, target_size, crop=True, centered=True, resize_center=None, out=None):
     """
     Adjust the size of a color image to the targeted size and targeted 
     location.
@@ -718,60 +1287,21 @@ def adapt_color_size(img, target_size, crop=True, centered=True, resize_center=N
         - 'resize_center': optionnal. A tuple containing the target (x, y) 
                            coordinates of the non centerd size adjustment. 
                            Must be provided if 'centered' is set to False.
-                           Default to None.
+                           Default to None ;
+        - 'out': optionnal. An array of shape 'target_size' (and channels) and 
+                 of the same data type as 'img' in which to write the adjusted 
+                 image. Default to None.
     Return: an array of shape 'target_size' containing the adjusted image.
     """
 
-    if not centered and not resize_center:
-        raise AttributeError(
-            "'centered' set to false without providind 'resize_center' coordinates"
-        )
-
-    adjusted_img = None
-
-    img_h, img_w = img.shape[:2]
-    tgt_h, tgt_w = target_size
-
-    if crop:
-        if centered:
-            if img_h >= tgt_h:
-                y_start = int(np.ceil((img_h - tgt_h) / 2))
-                y_end = y_start + tgt_h
-
-                adjusted_img = img[y_start:y_end, :, :]
-            else:
-                y_start = int(np.ceil((tgt_h - img_h) / 2))
-                y_end = y_start + img_h
-
-                adjusted_img = np.ones((tgt_h, img_w, 3)) * 255
-                adjusted_img[y_start:y_end, :, :] = img
-
-            if img_w >= tgt_w:
-                x_start = int(np.ceil((img_w - tgt_w) / 2))
-                x_end = x_start + tgt_w
-
-                adjusted_img = adjusted_img[:, x_start:x_end, :]
-            else:
-                x_start = int(np.ceil((tgt_w - img_w) / 2))
-                x_end = x_start + img_w
-
-                buffer_img = np.ones((adjusted_img.shape[0], tgt_w, 3)) * 255
-                buffer_img[:, x_start:x_end, :] = adjusted_img
-
-                adjusted_img = buffer_img
-        else:
-            raise NotImplementedError(
-                "Non centered size modification is not yet implemented"
-            )
-    else:
-        adjusted_img = cv2.resize(img, target_size)
-    
-    return adjusted_img.astype(np.int16)
+    return adapt_size(img, target_size, crop, centered, resize_center, out)
 
-def adapt_size(img, target_size, crop=True, centered=True, resize_center=None):
+def adapt_size(img, target_size, crop=True, centered=True, resize_center=None, out=None):
     """
     Adjust the size of an image to the targeted size and targeted 
-    location.
+    location. The image keeps its data type and is padded with white pixels. 
+    If the image only needs to be cropped and 'out' is None, a view of the 
+    original image is returned.
     Parameters:
         - 'img': an array containing the pixels values of the image ;
         - 'target_size': a tuple containing the targeted (height, width) of the 
@@ -785,7 +1315,10 @@ def adapt_size(img, target_size, crop=True, centered=True, resize_center=None):
         - 'resize_center': optionnal. A tuple containing the target (x, y) 
                            coordinates of the non centerd size adjustment. 
                            Must be provided if 'centered' is set to False.
-                           Default to None.
+                           Default to None ;
+        - 'out': optionnal. An array of shape 'target_size' (and channels) and 
+                 of the same data type as 'img' in which to write the adjusted 
+                 image. Default to None.
     Return: an array of shape 'target_size' containing the adjusted image.
     """
 
@@ -794,36 +1327,152 @@ def adapt_size(img, target_size, crop=True, centered=True, resize_center=None):
             "'centered' set to false without providind 'resize_center' coordinates"
         )
 
-    if len(img.shape) == 3: return adapt_color_size(img, target_size, crop, centered, resize_center)
-    else: return adapt_gray_size(img, target_size, crop, centered, resize_center)
+    if not crop:
+        # cv2 expects the size as (width, height)
+        return cv2.resize(img, (target_size[1], target_size[0]), dst=out)
+
+    if not centered:
+        raise NotImplementedError(
+            "Non centered size modification is not yet implemented"
+        )
+
+    (y_start, y_end, x_start, x_end), (top, bottom, left, right) = get_size_adjustment(img.shape[:2], target_size)
 
-def mean_image(path_list):
+    adjusted_img = img[y_start:y_end, x_start:x_end]
+    padded = (top + bottom + left + right) > 0
+
+    if out is not None:
+        if padded: out.fill(255)
+        out[top:top+adjusted_img.shape[0], left:left+adjusted_img.shape[1]] = adjusted_img
+        return out
+
+    if padded:
+        adjusted_img = cv2.copyMakeBorder(adjusted_img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(255, 255, 255, 255))
+
+    return adjusted_img
+
+def adapt_size_batch(imgs, target_size, out=None, crop=True):
     """
-    Satcks images and compute the average pixels values.
+    Adjust the size of several images to the targeted size, in a single 
+    contiguous array.
+    Parameters:
+        - 'imgs': a list of arrays containing the pixels values of the images. 
+                  All the images must have the same number of channels and 
+                  data type ;
+        - 'target_size': a tuple containing the targeted (height, width) of the 
+                         images after the size adjustment ;
+        - 'out': optionnal. An array of shape (N, height, width, channels), or 
+                 (N, height, width) for grayscale images, in which to write the 
+                 adjusted images. Default to None ;
+        - 'crop': optionnal. A boolean indicating if the size adjustment must be
+                  done through cropping or resizing. Default to True.
+    Return: an array of shape (N, height, width, channels), or (N, height, 
+            width) for grayscale images, containing the adjusted images.
+    """
+
+    if out is None:
+        out = np.empty((len(imgs), *target_size, *imgs[0].shape[2:]), dtype=imgs[0].dtype)
+
+    for i, img in enumerate(imgs):
+        # cv2 may not write into 'out', the adjusted image is copied if needed
+        out[i] = adapt_size(img, target_size, crop=crop, out=out[i])
+
+    return out
+
+def get_image_size(path):
+    """
+    Read the size of an image from its header, without decoding its pixels.
     Parameter:
-        - 'path_list': a list of path pointing to the images to average.
-    Return: an array containing the mean values of the pixels of the images
-            from the 'path_list'.
+        - 'path': a string or pathlib.Path object. The path to the image.
+    Return: a tuple containing the (width, height) of the image, or None if 
+            the image can't be read.
     """
 
-    max_width = 0
-    max_height = 0
-    
-    for path in path_list:
+    try:
         with Image.open(path) as img:
-            width, height = img.size
-        if width > max_width: max_width = width
-        if height > max_height: max_height = height
-    
-    if max_width > max_height: max_height = max_width
-    else: max_width = max_height
-    
-    mean_image = adapt_size(cv2.imread(path_list[0], cv2.IMREAD_GRAYSCALE), (max_width, max_height)).astype(np.int64)
+            return img.size
+    except OSError:
+        return None
 
-    for i in range(1, len(path_list)):
-        mean_image += adapt_size(cv2.imread(path_list[i], cv2.IMREAD_GRAYSCALE), (max_width, max_height)).astype(np.int64)
+def accumulate_images(path_list, target_size):
+    """
+    Sum the pixels values, and their squares, of grayscale images adjusted to 
+    the targeted size.
+    Parameters:
+        - 'path_list': a list of path pointing to the images to accumulate ;
+        - 'target_size': a tuple containing the (height, width) to which to 
+                         adjust the images.
+    Return: an array containing the sum of the pixels values, an array 
+            containing the sum of their squares, and the number of images 
+            accumulated. Images which can't be read are skipped.
+    """
+
+    total = np.zeros(target_size, dtype=np.int64)
+    total_sq = np.zeros(target_size, dtype=np.int64)
+    count = 0
+
+    # Buffers reused for every image
+    adjusted_img = np.empty(target_size, dtype=np.uint8)
+    squares = np.empty(target_size, dtype=np.int64)
+
+    for path in path_list:
+        img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if img is None: continue
+
+        adapt_size(img, target_size, out=adjusted_img)
+        total += adjusted_img
+        np.multiply(adjusted_img, adjusted_img, out=squares, dtype=np.int64)
+        total_sq += squares
+        count += 1
+
+    return total, total_sq, count
+
+def mean_image(path_list, n_jobs=None, return_stats=False):
+    """
+    Satcks images and compute the average pixels values.
+    The images are decoded once, by several threads each accumulating a part 
+    of the images.
+    Parameters:
+        - 'path_list': a list of path pointing to the images to average ;
+        - 'n_jobs': optionnal, int. The number of threads used to read the 
+                    images. If None, use as many threads as available CPUs. 
+                    Default to None ;
+        - 'return_stats': optionnal, boolean. Whether to also return the 
+                          standard deviation of the pixels values and the 
+                          number of images averaged. Default to False.
+    Return: an array containing the mean values of the pixels of the images
+            from the 'path_list'. If 'return_stats' is True, also an array 
+            containing the standard deviation of the pixels values, and the 
+            number of images averaged.
+    """
+
+    if n_jobs is None: n_jobs = os.cpu_count()
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        # Images sizes are read from the headers only, images which can't be 
+        # read are skipped
+        sizes = [size for size in executor.map(get_image_size, path_list) if size is not None]
+        if len(sizes) == 0: raise ValueError("None of the images of 'path_list' can be read")
+
+        max_size = max(max(size) for size in sizes)
+        target_size = (max_size, max_size)
+
+        chunks = [path_list[i::n_jobs] for i in range(n_jobs)]
+        results = list(executor.map(partial(accumulate_images, target_size=target_size), chunks))
+
+    total = sum(r[0] for r in results)
+    total_sq = sum(r[1] for r in results)
+    count = sum(r[2] for r in results)
+    if count == 0: raise ValueError("None of the images of 'path_list' can be decoded")
 
-    return np.round(mean_image / len(path_list)).astype(np.int16)
+    mean = total / count
+    mean_image = np.round(mean).astype(np.int16)
+
+    if not return_stats: return mean_image
+
+    std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+
+    return mean_image, std, count
 
 def str_to_list(array_string, dtype=float):
     """
@@ -881,9 +1530,64 @@ def bbox(img):
 
     return ymin, ymax, xmin, xmax
 
-def image_data_augmentation(source_dir, target_dir, num_images_per_cat=1500, random_state=None, random_generator=None):
+def get_num_augmentations(num_images, num_images_per_cat):
+    """
+    Compute the number of augmentations to apply to each image to exceed the 
+    targeted number of images.
+    Parameters:
+        - 'num_images': int. The number of images available ;
+        - 'num_images_per_cat': int. The targeted number of images.
+    Return: the number of augmentations per image, at least one.
+    """
+
+    n_augmentation = int(np.ceil((num_images_per_cat - num_images) / num_images))
+
+    # Add one to ensure a the application of at least one augmentation.
+    n_augmentation += 1 if n_augmentation == 0 else 0
+
+    return n_augmentation
+
+def augment_images(images, source_dir, target_dir, num_augments):
+    """
+    Copy images and create their augmentations. Each image has its own 
+    pseudo-random sequence, so the result doesn't depend on the process which 
+    augments it.
+    Parameters:
+        - 'images': a list of (img, seed) tuples. The images file names and 
+                    the random seeds of their augmentations ;
+        - 'source_dir': string. The directory to select images from ;
+        - 'target_dir': string. The directory to save the new images ;
+        - 'num_augments': int. The number of augmentations per image.
+    Return: the number of images created, copies included.
+    """
+
+    new_images = []
+
+    for img, seed in images:
+        shutil.copy2(Path(f'{source_dir}/{img}'), Path(f'{target_dir}/{img}'))
+
+        aug_img = ImageAugmentation(
+            path = source_dir,
+            file_name = img,
+            random_state = seed,
+            **AUGMENTATION_PARAMS
+        )
+
+        new_images += aug_img.augment(num_augments)
+
+    # Write the augmented images once they are all created
+    for img_name, img_aug in new_images:
+        _, buffer = cv2.imencode('.jpg', img_aug)
+        buffer.tofile(f'{target_dir}/{img_name}')
+
+    return len(images) + len(new_images)
+
+def image_data_augmentation(source_dir, target_dir, num_images_per_cat=1500, random_state=None, random_generator=None, n_jobs=1, chunk_size=64):
     """
     Apply data auggmentations to exceed to targeted number of images.
+    The augmentations of each image are seeded from the main pseudo-random 
+    sequence, so the new images are the same whatever the number of 
+    processes.
     Parameters:
         - 'source_dir': string. The directory to select images from ;
         - 'target_dir': string. The directory to save the new images ;
@@ -894,7 +1598,12 @@ def image_data_augmentation(source_dir, target_dir, num_images_per_cat=1500, ran
                           pseudo-random sequence of numbers. Default to None0 ;
         - 'random_generator': optionnal, pseudo-random number generator 
                               object. Use to continue a pseudo-random sequence 
-                              already initialized. Default to None.
+                              already initialized. Default to None ;
+        - 'n_jobs': optionnal, int. The number of processes used to augment 
+                    the images. If None, use all the available CPUs. Default 
+                    to 1 ;
+        - 'chunk_size': optionnal, int. The maximum number of images augmented 
+                        by a process at once. Default to 64.
     Return: the path to the augmented images directory.
     """
 
@@ -905,37 +1614,417 @@ def image_data_augmentation(source_dir, target_dir, num_images_per_cat=1500, ran
 
     num_images = len(img_list)
 
-    # Compute number of augmentation to apply
-    n_augmentation = int(np.ceil((num_images_per_cat - num_images) / num_images))
-
-    # Add one to ensure a the application of at least one augmentation.
-    n_augmentation += 1 if n_augmentation == 0 else 0
+    n_augmentation = get_num_augmentations(num_images, num_images_per_cat)
 
     # Initialize a pseudo-random sequence
     if not random_generator:
         random_generator = random.Random(random_state)
 
-    for img in img_list:
-        target_file = Path(f'{target_dir}/{img}')
-        origin_file = Path(f'{source_dir}/{img}')
-        shutil.copy2(origin_file, target_file)
+    # Draw a seed per image
+    images = [(img, random_generator.getrandbits(64)) for img in img_list]
+    chunks = [images[i:i+chunk_size] for i in range(0, num_images, chunk_size)]
 
-        aug_img = ImageAugmentation(
-            path = source_dir,
-            file_name = img,
-            rotation = 360,
-            hflip = True,
-            vflip = True,
-            contrast = (0.5, 2.0),
-            brightness = (0, 50),
-            random_generator = random_generator
-        )
+    augment = partial(augment_images, source_dir=source_dir, target_dir=target_dir, num_augments=n_augmentation)
+
+    since = time.time()
+
+    executor = None if n_jobs == 1 else ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        n_created = sum(map(augment, chunks) if executor is None else executor.map(augment, chunks))
+    finally:
+        if executor is not None: executor.shutdown(cancel_futures=True)
 
-        aug_img.image_augment(target_dir, num_augments=n_augmentation)
+    time_elapsed = time.time() - since
+    throughput = n_created / time_elapsed if time_elapsed > 0 else 0.0
+    print(f'augmented = {n_created} ({throughput:.1f} images/s)', end='\t')
 
     return target_dir
 
-def select_random_sample(source_dir, target_dir, cat, num_images_per_cat, test_size=0.1, val_size=0.2, random_state=None, random_generator=None):
+def parse_img_name(img_name):
+    """
+    Extracts the information encoded in the name of an image by 
+    'organize_data'.
+    Parameter:
+        - 'img_name': a string containing the name of the image.
+    Return: the encoded blood cell, the source and the patient number of the 
+            image.
+    """
+
+    blood_cell, source, patient = img_name.split('_')[:3]
+    return blood_cell, source, patient
+
+def share_largest_remainders(total, weights, caps=None):
+    """
+    Share a number of items in proportion of weights, with the largest 
+    remainders method, so that the shares sum up to the total.
+    Parameters:
+        - 'total': int. The number of items to share ;
+        - 'weights': array-like. The weight of each share ;
+        - 'caps': optionnal, array-like. The maximum value of each share. 
+                  Default to None.
+    Return: a numpy array containing the shares.
+    """
+
+    weights = np.asarray(weights, dtype=np.float64)
+    quotas = total * weights / weights.sum() if weights.sum() > 0 else np.zeros_like(weights)
+
+    shares = np.floor(quotas).astype(np.int64)
+    if caps is not None: shares = np.minimum(shares, caps)
+
+    # The largest remainders first, the shares reaching their cap are skipped
+    order = np.argsort(shares - quotas, kind='stable')
+    remainder = total - shares.sum()
+    while remainder > 0:
+        open_shares = [i for i in order if caps is None or shares[i] < caps[i]][:remainder]
+        if len(open_shares) == 0: break
+        shares[open_shares] += 1
+        remainder -= len(open_shares)
+
+    return shares
+
+def split_indices(num_images, num_selected, test_size=0.1, val_size=0.2, random_generator=None, num_test=None, num_val=None):
+    """
+    Randomly select images and assign them to the train, validation and test 
+    sets.
+    Parameters:
+        - 'num_images': int. The number of images to select from ;
+        - 'num_selected': int. The number of images to select ;
+        - 'test_size': float. Strictly between 0.0 and 1.0. The size of the 
+                       test set to create. Default to 0.1  ;
+        - 'val_size': float. Strictly between 0.0 and 1.0. The size of the 
+                      validation set to create. Default to 0.2  ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None ;
+        - 'num_test': optionnal, int. The number of images of the test set, 
+                      instead of 'test_size'. Default to None ;
+        - 'num_val': optionnal, int. The number of images of the validation 
+                     set, instead of 'val_size'. Default to None.
+    Return: a numpy array of shape (num_images,) containing, for each image, 
+            the index in SPLITS of its set, or -1 if it is not selected.
+    """
+
+    if not random_generator:
+        random_generator = random.Random()
+
+    splits = np.full(num_images, -1, dtype=np.int8)
+
+    selection = np.array(random_generator.sample(range(num_images), num_selected), dtype=np.int64)
+
+    if num_test is None: num_test = int(np.floor(num_selected * test_size))
+    if num_val is None: num_val = int(np.floor(num_selected * val_size))
+
+    # Create the test selection
+    is_test = np.zeros(num_images, dtype=bool)
+    if num_test > 0: is_test[random_generator.sample(selection.tolist(), num_test)] = True
+
+    # Remove images selected to be in the test set from the initial selection
+    selection = selection[~is_test[selection]]
+
+    # Create the validation selection
+    is_val = np.zeros(num_images, dtype=bool)
+    if num_val > 0: is_val[random_generator.sample(selection.tolist(), num_val)] = True
+
+    splits[selection] = SPLITS.index('train')
+    splits[is_val] = SPLITS.index('val')
+    splits[is_test] = SPLITS.index('test')
+
+    return splits
+
+def stratified_split_indices(strata, num_selected, test_size=0.1, val_size=0.2, random_generator=None):
+    """
+    Randomly select images and assign them to the train, validation and test 
+    sets, in the same proportions within each stratum. The sizes of the sets 
+    are computed on the whole selection, then shared between the strata, so 
+    that small strata don't make the sets smaller than requested.
+    Parameters:
+        - 'strata': array-like. The stratum of each image ;
+        - 'num_selected': int. The number of images to select. Each stratum 
+                          contributes in proportion of its size ;
+        - 'test_size': float. Strictly between 0.0 and 1.0. The size of the 
+                       test set to create. Default to 0.1  ;
+        - 'val_size': float. Strictly between 0.0 and 1.0. The size of the 
+                      validation set to create. Default to 0.2  ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None.
+    Return: a numpy array of shape (len(strata),) containing, for each image, 
+            the index in SPLITS of its set, or -1 if it is not selected.
+    """
+
+    _, inverse, counts = np.unique(np.asarray(strata), return_inverse=True, return_counts=True)
+    num_images = len(inverse)
+
+    # Share the selection, then the test and validation sets, between the 
+    # strata
+    num_per_stratum = share_largest_remainders(num_selected, counts)
+    test_per_stratum = share_largest_remainders(int(np.floor(num_selected * test_size)), num_per_stratum, num_per_stratum)
+    val_per_stratum = share_largest_remainders(int(np.floor(num_selected * val_size)), num_per_stratum, num_per_stratum - test_per_stratum)
+
+    splits = np.full(num_images, -1, dtype=np.int8)
+
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+
+    for i in range(len(counts)):
+        idx = order[bounds[i]:bounds[i+1]]
+        splits[idx] = split_indices(len(idx), num_per_stratum[i], test_size, val_size, random_generator, test_per_stratum[i], val_per_stratum[i])
+
+    return splits
+
+def group_split_indices(strata, groups, test_size=0.1, val_size=0.2, random_generator=None):
+    """
+    Randomly assign groups of images to the train, validation and test sets, 
+    so that the images of a group are all in the same set, while keeping the 
+    proportions of each stratum in each set as close as possible to the 
+    targeted ones.
+    Groups are assigned one by one, the largest first, to the set which most 
+    lacks the strata of the group.
+    Parameters:
+        - 'strata': array-like. The stratum of each image ;
+        - 'groups': array-like. The group of each image ;
+        - 'test_size': float. Between 0.0 and 1.0. The size of the test set to 
+                       create. Default to 0.1  ;
+        - 'val_size': float. Between 0.0 and 1.0. The size of the validation 
+                      set to create. Default to 0.2  ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None.
+    Return: a numpy array containing, for each image, the index in SPLITS of 
+            its set.
+    """
+
+    if not random_generator:
+        random_generator = random.Random()
+
+    _, strata_idx = np.unique(np.asarray(strata), return_inverse=True)
+    _, groups_idx = np.unique(np.asarray(groups), return_inverse=True)
+
+    # Number of images of each stratum in each group
+    group_counts = np.zeros((groups_idx.max()+1, strata_idx.max()+1), dtype=np.int64)
+    np.add.at(group_counts, (groups_idx, strata_idx), 1)
+    group_sizes = group_counts.sum(axis=1)
+
+    # Number of images of each stratum still needed by each set
+    fractions = np.array([1.0 - test_size - val_size, val_size, test_size])
+    needs = fractions[:, np.newaxis] * group_counts.sum(axis=0)[np.newaxis, :]
+    closed = fractions <= 0.0
+
+    # Shuffle the groups, then sort them by decreasing size, the sort being 
+    # stable
+    order = list(range(len(group_sizes)))
+    random_generator.shuffle(order)
+    order.sort(key=lambda g: -group_sizes[g])
+
+    group_splits = np.empty(len(group_sizes), dtype=np.int8)
+
+    for g in order:
+        scores = needs @ group_counts[g]
+        scores[closed] = -np.inf
+        split = int(np.argmax(scores))
+        group_splits[g] = split
+        needs[split] -= group_counts[g]
+
+    return group_splits[groups_idx]
+
+def create_split_manifest(root_dir, save_path=None, test_size=0.1, val_size=0.2, stratify_source=True, random_state=None, random_generator=None):
+    """
+    Split the images of the base directory into train, validation and test 
+    sets, keeping all the images of a patient in the same set, and save the 
+    split as a manifest instead of copying the images.
+    Images without patient number are split independently.
+    Parameters:
+        - 'root_dir': string. The directory that store the 'base' directory 
+                      where to find the images ;
+        - 'save_path': optionnal, a string or pathlib.Path object. The path of 
+                       the csv file where to save the manifest. If None, the 
+                       manifest is saved as 'splits.csv' in 'root_dir'. 
+                       Default to None ;
+        - 'test_size': float. Between 0.0 and 1.0. The size of the test set to 
+                       create. Default to 0.1  ;
+        - 'val_size': float. Between 0.0 and 1.0. The size of the validation 
+                      set to create. Default to 0.2  ;
+        - 'stratify_source': optionnal, boolean. Whether to keep the 
+                             proportions of each source within each category, 
+                             or only the proportions of each category. Default 
+                             to True ;
+        - 'random_state': optionnal, int. A random seed to initialize a 
+                          pseudo-random sequence of numbers. Default to None ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None.
+    Return: a DataFrame containing the 'path' (relative to 'root_dir'), 
+            'label', 'source', 'patient' and 'split' of each image.
+    """
+
+    source_dir = f'{root_dir}/base'
+
+    if not Path(source_dir).exists():
+        raise FileNotFoundError(f'{source_dir} not found')
+
+    if save_path is None: save_path = f'{root_dir}/splits.csv'
+
+    # Initialize a pseudo-random sequence
+    if not random_generator:
+        random_generator = random.Random(random_state)
+
+    manifest = {
+        'path': [],
+        'label': [],
+        'source': [],
+        'patient': [],
+    }
+
+    for cat in sorted(os.listdir(source_dir)):
+        if not os.path.isdir(f'{source_dir}/{cat}'): continue
+
+        for img_name in sorted(os.listdir(f'{source_dir}/{cat}')):
+            if file_is_a(img_name, IMG_EXTS):
+                _, source, patient = parse_img_name(img_name)
+
+                manifest['path'].append(f'base/{cat}/{img_name}')
+                manifest['label'].append(cat)
+                manifest['source'].append(source)
+                manifest['patient'].append(patient)
+
+    df_manifest = pd.DataFrame(manifest)
+
+    # Each image without patient number is its own group
+    groups = np.where(
+        df_manifest['patient'] == 'xxx',
+        df_manifest['path'],
+        df_manifest['source'] + '_' + df_manifest['patient']
+    )
+    strata = df_manifest['label'] + '_' + df_manifest['source'] if stratify_source else df_manifest['label']
+
+    splits = group_split_indices(strata, groups, test_size, val_size, random_generator)
+    df_manifest['split'] = np.array(SPLITS)[splits]
+
+    df_manifest.to_csv(save_path, index=False)
+
+    print(pd.crosstab(df_manifest['label'], df_manifest['split'])[[split for split in SPLITS if split in df_manifest['split'].values]])
+
+    return df_manifest
+
+def sample_split_indices(img_list, num_selected, test_size=0.1, val_size=0.2, random_generator=None, stratify=None):
+    """
+    Randomly select images and assign them to the train, validation and test 
+    sets, and print the size of each set.
+    Parameters:
+        - 'img_list': list of strings. The names of the images to select 
+                      from ;
+        - 'num_selected': int. The number of images to select ;
+        - 'test_size': float. Strictly between 0.0 and 1.0. The size of the 
+                       test set to create. Default to 0.1  ;
+        - 'val_size': float. Strictly between 0.0 and 1.0. The size of the 
+                      validation set to create. Default to 0.2  ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None ;
+        - 'stratify': optionnal, string. 'source' to split the images of 
+                      each source in the same proportions, or 'patient' to 
+                      also keep all the selected images of a patient in the 
+                      same set. If None, the images are split regardless of 
+                      their origin. Default to None.
+    Return: a numpy array containing, for each image, the index in SPLITS of 
+            its set, or -1 if it is not selected.
+    """
+
+    if stratify is None:
+        splits = split_indices(len(img_list), num_selected, test_size, val_size, random_generator)
+    elif stratify == 'source':
+        strata = [parse_img_name(img_name)[1] for img_name in img_list]
+        splits = stratified_split_indices(strata, num_selected, test_size, val_size, random_generator)
+    elif stratify == 'patient':
+        if not random_generator:
+            random_generator = random.Random()
+
+        selection = np.sort(np.array(random_generator.sample(range(len(img_list)), num_selected), dtype=np.int64))
+        fields = [parse_img_name(img_list[i]) for i in selection]
+
+        # Each image without patient number is its own group
+        strata = [source for _, source, _ in fields]
+        groups = [img_list[i] if patient == 'xxx' else f'{source}_{patient}' for i, (_, source, patient) in zip(selection, fields)]
+
+        splits = np.full(len(img_list), -1, dtype=np.int8)
+        if num_selected > 0: splits[selection] = group_split_indices(strata, groups, test_size, val_size, random_generator)
+    else:
+        raise AttributeError(f"'stratify' must be None, 'source' or 'patient', here {stratify}")
+
+    num_train, num_val, num_test = np.bincount(splits[splits >= 0], minlength=len(SPLITS))
+
+    print(f'train = {num_train}', f'val = {num_val}', f'test = {num_test}', sep='\t', end='\t')
+
+    return splits
+
+def select_random_manifest(source_dir, rel_dir, cat, num_images_per_cat, test_size=0.1, val_size=0.2, random_state=None, random_generator=None, stratify=None, augment=False):
+    """
+    Select a random sample from the source directory, like 
+    'select_random_sample', but describe the sets in a manifest instead of 
+    copying the images.
+    The augmented images are not created: each one is described by the seed 
+    and the index of its augmentation, from which 'ImageAugmentation' 
+    recreates it on the fly.
+    Parameters:
+        - 'source_dir': string. The directory to selecting images from ;
+        - 'rel_dir': string. The path of the source directory, relative to 
+                     the directory of the manifest ;
+        - 'cat': string. The name of the category ;
+        - 'num_images_per_cat': int. The targeted number of images per 
+                                category. If zero or lower, split every 
+                                images in the source directory ;
+        - 'test_size': float. Strictly between 0.0 and 1.0. The size of the 
+                       test set to create. Default to 0.1  ;
+        - 'val_size': float. Strictly between 0.0 and 1.0. The size of the 
+                      validation set to create. Default to 0.2  ;
+        - 'random_state': optionnal, int. A random seed to initialize a 
+                          pseudo-random sequence of numbers. Default to None ;
+        - 'random_generator': optionnal, pseudo-random number generator 
+                              object. Use to continue a pseudo-random sequence 
+                              already initialized. Default to None ;
+        - 'stratify': optionnal, string. 'source' to split the images of 
+                      each source in the same proportions, or 'patient' to 
+                      also keep all the selected images of a patient in the 
+                      same set. If None, the images are split regardless of 
+                      their origin. Default to None ;
+        - 'augment': optionnal, boolean. Whether to add augmentations of the 
+                     images to exceed the targeted number of images. Default 
+                     to False.
+    Return: a DataFrame containing the 'path', 'label', 'split', 'aug_seed' 
+            and 'aug_index' of each selected image. An 'aug_index' of 0 
+            stands for the original image.
+    """
+
+    img_list = sorted(img for img in os.listdir(source_dir) if file_is_a(img, IMG_EXTS))
+
+    # Initialize a pseudo-random sequence
+    if not random_generator:
+        random_generator = random.Random(random_state)
+
+    # Each original image is followed by its augmentations
+    num_augments = get_num_augmentations(len(img_list), num_images_per_cat) if augment else 0
+    seeds = [random_generator.getrandbits(64) if augment else 0 for _ in img_list]
+
+    pool = pd.DataFrame({
+        'path': np.repeat([f'{rel_dir}/{img}' for img in img_list], num_augments+1),
+        'label': cat,
+        'aug_seed': np.repeat(np.array(seeds, dtype=np.uint64), num_augments+1),
+        'aug_index': np.tile(np.arange(num_augments+1, dtype=np.int16), len(img_list)),
+    })
+
+    num_images = len(pool)
+    if num_images_per_cat <= 0: num_images_per_cat = num_images
+
+    print(f'sampling pop = {num_images}', f'sampled pop = {num_images_per_cat}', sep='\t', end='\t')
+
+    img_names = np.repeat(img_list, num_augments+1)
+    splits = sample_split_indices(img_names, num_images_per_cat, test_size, val_size, random_generator, stratify)
+
+    pool.insert(2, 'split', np.array(SPLITS + [''])[splits])
+
+    return pool[splits >= 0].reset_index(drop=True)
+
+def select_random_sample(source_dir, target_dir, cat, num_images_per_cat, test_size=0.1, val_size=0.2, random_state=None, random_generator=None, stratify=None):
     """
     Select a random sample from the source directory and copy the images to 
     the targeted directory.
@@ -956,19 +2045,21 @@ def select_random_sample(source_dir, target_dir, cat, num_images_per_cat, test_s
                           pseudo-random sequence of numbers. Default to None0 ;
         - 'random_generator': optionnal, pseudo-random number generator 
                               object. Use to continue a pseudo-random sequence 
-                              already initialized. Default to None.
+                              already initialized. Default to None ;
+        - 'stratify': optionnal, string. 'source' to split the images of 
+                      each source in the same proportions, or 'patient' to 
+                      also keep all the selected images of a patient in the 
+                      same set. If None, the images are split regardless of 
+                      their origin. Default to None.
     Return: the path to the selected images directory.
     """
 
     # Create the folder to store the sets
-    train_dir = Path(f'{target_dir}/train/{cat}')
-    test_dir = Path(f'{target_dir}/test/{cat}')
-    val_dir = Path(f'{target_dir}/val/{cat}')
+    split_dirs = [Path(f'{target_dir}/{split}/{cat}') for split in SPLITS]
 
     # Check whether the directories exist or not and create if needed
-    if not train_dir.exists(): os.mkdir(train_dir)
-    if not test_dir.exists(): os.mkdir(test_dir)
-    if not val_dir.exists(): os.mkdir(val_dir)
+    for split_dir in split_dirs:
+        if not split_dir.exists(): os.mkdir(split_dir)
 
     img_list = os.listdir(source_dir)
 
@@ -982,43 +2073,18 @@ def select_random_sample(source_dir, target_dir, cat, num_images_per_cat, test_s
     
     print(f'sampling pop = {num_images}', f'sampled pop = {num_images_per_cat}', sep='\t', end='\t')
 
-    selection = random_generator.sample(range(num_images), num_images_per_cat)
-
-    num_test = int(np.floor(num_images_per_cat * test_size))
-    num_val = int(np.floor(num_images_per_cat * val_size))
-    num_train = num_images_per_cat - (num_test + num_val)
-
-    print(f'train = {num_train}', f'val = {num_val}', f'test = {num_test}', sep='\t', end='\t')
-
-    # Create the test selection
-    if test_size > 0.0: test_selection = random_generator.sample(selection, num_test)
-    else: test_selection = []
-
-    # Remove images selected to be in the test set from the initial selection
-    selection = [idx for idx in selection if idx not in test_selection]
+    splits = sample_split_indices(img_list, num_images_per_cat, test_size, val_size, random_generator, stratify)
 
-    # Create the validation selection
-    if val_size > 0.0: val_selection = random_generator.sample(selection, num_val)
-    else: val_selection = []
-
-    # Remove images selected to be in the validation set from the initial selection
-    train_selection = [idx for idx in selection if idx not in val_selection]
-
-    for idx, img_name in enumerate(img_list):
+    for img_name, split in zip(img_list, splits):
         origin_file = Path(f'{source_dir}/{img_name}')
-        
+
         if source_dir == target_dir:
-            if idx in train_selection: shutil.move(origin_file, Path(f'{train_dir}/{img_name}'))
-            elif idx in test_selection: shutil.move(origin_file, Path(f'{test_dir}/{img_name}'))
-            elif idx in val_selection: shutil.move(origin_file, Path(f'{val_dir}/{img_name}'))
+            if split >= 0: shutil.move(origin_file, Path(f'{split_dirs[split]}/{img_name}'))
             else: os.remove(origin_file)
         else:
-            if idx in train_selection: shutil.copy2(origin_file, Path(f'{train_dir}/{img_name}'))
-            elif idx in test_selection: shutil.copy2(origin_file, Path(f'{test_dir}/{img_name}'))
-            elif idx in val_selection: shutil.copy2(origin_file, Path(f'{val_dir}/{img_name}'))
+            if split >= 0: shutil.copy2(origin_file, Path(f'{split_dirs[split]}/{img_name}'))
 
-
-def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.2, random_state=None, random_generator=None):
+def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.2, random_state=None, random_generator=None, n_jobs=1, stratify=None, manifest=False):
     """
     Create a dataset by augmented (if needed) and selecting the images from 
     categories. The new directory will have the same organization as the 
@@ -1043,8 +2109,19 @@ def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.
                           pseudo-random sequence of numbers. Default to None0 ;
         - 'random_generator': optionnal, pseudo-random number generator 
                               object. Use to continue a pseudo-random sequence 
-                              already initialized. Default to None.
-    Return: the path to the balanced dataset directory.
+                              already initialized. Default to None ;
+        - 'n_jobs': optionnal, int. The number of processes used to augment 
+                    the images. If None, use all the available CPUs. Default 
+                    to 1 ;
+        - 'stratify': optionnal, string. 'source' to split the images of 
+                      each category in the same proportions for each source, 
+                      or 'patient' to also keep all the selected images of a 
+                      patient in the same set. Default to None ;
+        - 'manifest': optionnal, boolean. Whether to describe the sets in a 
+                      csv manifest instead of copying the images. The 
+                      augmented images are then described by their 
+                      augmentation recipe. Default to False.
+    Return: the path to the balanced dataset directory, or to its manifest.
     """
 
     balanced = num_images_per_cat > 0
@@ -1055,8 +2132,47 @@ def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.
     if not Path(source_dir).exists():
         raise FileNotFoundError(f'{source_dir} not found')
 
-    # Create directories to store the sets
     target_dir = f'{root_dir}/balanced' if balanced else f'{root_dir}/unbalanced'
+
+    if manifest:
+        # Initialize a pseudo-random sequence
+        if not random_generator:
+            random_generator = random.Random(random_state)
+
+        manifests = []
+
+        for cat in sorted(os.listdir(source_dir)):
+            current_dir = f'{source_dir}/{cat}'
+            if not os.path.isdir(current_dir): continue
+
+            num_images = len(os.listdir(current_dir))
+            if num_images == 0: continue
+
+            print(f'{cat}:', end='\t')
+            print(f'init pop = {num_images}', end='\t')
+
+            num_subset = num_images_per_cat if balanced else num_images
+
+            manifests.append(select_random_manifest(
+                source_dir = current_dir,
+                rel_dir = f'base/{cat}',
+                cat = cat,
+                num_images_per_cat = num_subset,
+                test_size = test_size,
+                val_size = val_size,
+                random_generator = random_generator,
+                stratify = stratify,
+                augment = balanced and num_images < num_subset
+            ))
+
+            print('done')
+
+        manifest_path = f'{target_dir}.csv'
+        pd.concat(manifests, ignore_index=True).to_csv(manifest_path, index=False)
+
+        return manifest_path
+
+    # Create directories to store the sets
     train_dir = f'{target_dir}/train'
     test_dir = f'{target_dir}/test'
     val_dir = f'{target_dir}/val'
@@ -1092,7 +2208,7 @@ def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.
                 # Create the target directory
                 aug_dir = Path(f'{aug_dir}/{cat}')
                 if not aug_dir.exists(): os.mkdir(aug_dir)
-                image_data_augmentation(current_dir, aug_dir, num_subset, random_generator=random_generator)
+                image_data_augmentation(current_dir, aug_dir, num_subset, random_generator=random_generator, n_jobs=n_jobs)
 
                 select_random_sample(
                     source_dir = aug_dir, 
@@ -1101,7 +2217,8 @@ def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.
                     num_images_per_cat = num_subset, 
                     test_size = test_size, 
                     val_size = val_size, 
-                    random_generator = random_generator
+                    random_generator = random_generator,
+                    stratify = stratify
                 )
             else:
                 select_random_sample(
@@ -1111,7 +2228,8 @@ def create_dataset(root_dir, num_images_per_cat=1500, test_size=0.1, val_size=0.
                     num_images_per_cat = num_subset, 
                     test_size = test_size, 
                     val_size = val_size, 
-                    random_generator = random_generator
+                    random_generator = random_generator,
+                    stratify = stratify
                 )
             
             print('done')
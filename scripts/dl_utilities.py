@@ -23,7 +23,7 @@
 # | script: dl_utilities.py                    |
 # | author: Thomas DUMAZERT                    |
 # | creation: 03/23/2023                       |
-# | last modified: 03/23/2023                  |
+# | last modified: 10/18/2026                  |
 # ----------------------------------------------
 
 # This module is intended to provided utility functions to train Deep Learning 
@@ -43,6 +43,10 @@ from matplotlib.lines import Line2D
 import seaborn as sns
 import time
 import copy
+import hashlib
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -53,6 +57,11 @@ from sklearn.metrics import classification_report, confusion_matrix
 from pytorch_grad_cam import GradCAM
 from pytorch_grad_cam.utils.image import show_cam_on_image
 
+# Import custom scripts
+import sys
+sys.path.append("..")
+from scripts.bcc_utilities import ImageAugmentation, AUGMENTATION_PARAMS, SPLITS, split_path
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Constants
 
@@ -65,11 +74,238 @@ MODELS_SAVE_DIR = f'{DATA_DIR}/models'
 REPORTS_DIR = f'{DATA_DIR}/models_results'
 CLASS_REPORTS_DIR = f'{REPORTS_DIR}/classification_reports'
 GRADCAM_DIR = f'{REPORTS_DIR}/gradCAMs'
+FEATURES_DIR = f'{DATA_DIR}/features'
 
 # Number of metrics registered during models training
 # [train_loss, val_loss, train_accuracy, val_accuracy]
 N_METRICS = 4
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Class
+
+class ManifestDataset(torch.utils.data.Dataset):
+    def __init__(self, manifest, split, data_transforms=None, root_dir=None):
+        """
+        Initialize instance. A dataset reading the images of a set described 
+        by a manifest created by 'create_dataset', so that a new split 
+        doesn't require to copy the images. Augmented images are recreated 
+        on the fly from their augmentation recipe.
+        As with datasets.ImageFolder, the classes are indexed in alphabetical 
+        order, and the 'classes', 'class_to_idx', 'imgs' and 'targets' 
+        attributes are available.
+        Parameters:
+            - 'manifest': a string, pathlib.Path object or DataFrame. The 
+                          manifest, or the path to its csv file ;
+            - 'split': string. The set to read, 'train', 'val' or 'test' ;
+            - 'data_transforms': optional, a torchvision.transform, or 
+                                 torchvision.tansforms.Compose object. The 
+                                 transformations to apply. Default to None ;
+            - 'root_dir': optional, a string or pathlib.Path object. The 
+                          directory the paths of the manifest are relative 
+                          to. If None, the directory of the manifest file. 
+                          Default to None.
+        Return: None
+        """
+
+        if isinstance(manifest, pd.DataFrame):
+            df_manifest = manifest
+            if root_dir is None: raise AttributeError('root_dir must be given when the manifest is a DataFrame')
+        else:
+            df_manifest = pd.read_csv(manifest, dtype={'aug_seed': np.uint64})
+            if root_dir is None: root_dir = Path(manifest).parent
+
+        if split not in SPLITS:
+            raise AttributeError(f"'split' must be one of {SPLITS}, here {split}")
+
+        # Classes are indexed over the whole manifest, so that every sets 
+        # share the same indexes
+        self.classes = sorted(df_manifest['label'].unique())
+        self.class_to_idx = {cat: i for i, cat in enumerate(self.classes)}
+
+        df_split = df_manifest[df_manifest['split'] == split]
+
+        self.root_dir = root_dir
+        self.transform = data_transforms
+        self.paths = [f'{root_dir}/{path}' for path in df_split['path']]
+        self.targets = [self.class_to_idx[cat] for cat in df_split['label']]
+        self.imgs = list(zip(self.paths, self.targets))
+
+        if 'aug_index' in df_split.columns:
+            self.aug_seeds = df_split['aug_seed'].to_numpy(dtype=np.uint64)
+            self.aug_indexes = df_split['aug_index'].to_numpy(dtype=np.int64)
+        else:
+            self.aug_seeds = np.zeros(len(df_split), dtype=np.uint64)
+            self.aug_indexes = np.zeros(len(df_split), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.imgs)
+
+    def load_image(self, index):
+        """
+        Load an image of the set, applying its augmentation if needed.
+        Parameter:
+            - 'index': int. The index of the image in the set.
+        Return: the RGB PIL image.
+        """
+
+        aug_index = int(self.aug_indexes[index])
+
+        if aug_index == 0:
+            return Image.open(self.paths[index]).convert('RGB')
+
+        path, file_name = os.path.split(self.paths[index])
+
+        aug_img = ImageAugmentation(
+            path = path,
+            file_name = file_name,
+            random_state = int(self.aug_seeds[index]),
+            **AUGMENTATION_PARAMS
+        )
+
+        # Augmentations are cumulative, the last one is the targeted image
+        _, img = aug_img.augment(aug_index)[-1]
+
+        return Image.fromarray(np.ascontiguousarray(img[:, :, ::-1]))
+
+    def __getitem__(self, index):
+        img = self.load_image(index)
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        return img, self.targets[index]
+
+class TensorStoreDataset(torch.utils.data.Dataset):
+    def __init__(self, store_dir, split, data_transforms=None):
+        """
+        Initialize instance. A dataset reading the images of a set from the 
+        shards created by 'create_tensor_store', without decoding them. The 
+        images are returned as uint8 tensors of shape (3, H, W), sharing 
+        their memory with the memory-mapped shards. The images of a set may 
+        have different sizes.
+        As with datasets.ImageFolder, the classes are indexed in alphabetical 
+        order, and the 'classes', 'class_to_idx', 'imgs' and 'targets' 
+        attributes are available.
+        Parameters:
+            - 'store_dir': a string or pathlib.Path object. The directory of 
+                           the store ;
+            - 'split': string. The set to read, 'train', 'val' or 'test' ;
+            - 'data_transforms': optional, a torchvision.transform, or 
+                                 torchvision.tansforms.Compose object. The 
+                                 transformations to apply. They must accept 
+                                 uint8 tensors. Default to None.
+        Return: None
+        """
+
+        if split not in SPLITS:
+            raise AttributeError(f"'split' must be one of {SPLITS}, here {split}")
+
+        df_index = pd.read_csv(f'{store_dir}/index.csv')
+
+        # Classes are indexed over the whole store, so that every sets share 
+        # the same indexes
+        self.classes = sorted(df_index['label'].unique())
+        self.class_to_idx = {cat: i for i, cat in enumerate(self.classes)}
+
+        df_split = df_index[df_index['split'] == split]
+
+        self.store_dir = store_dir
+        self.transform = data_transforms
+        self.shard_names = df_split['shard'].to_numpy()
+        self.offsets = df_split['offset'].to_numpy()
+        self.heights = df_split['height'].to_numpy()
+        self.widths = df_split['width'].to_numpy()
+        self.targets = [self.class_to_idx[cat] for cat in df_split['label']]
+        self.imgs = list(zip(df_split['path'], self.targets))
+
+        # Shards are opened on first access, by each worker process
+        self.shards = {}
+
+    def __getstate__(self):
+        # Never send the opened shards to the worker processes, as they would 
+        # be copied
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.imgs)
+
+    @property
+    def input_size(self):
+        """
+        The size of the stored images, or None if they are not all square 
+        images of the same size.
+        """
+
+        sizes = np.unique(np.concatenate([self.heights, self.widths]))
+        return int(sizes[0]) if len(sizes) == 1 else None
+
+    def get_array(self, index):
+        """
+        Get an image of the set from its shard, without copy.
+        Parameter:
+            - 'index': int. The index of the image in the set.
+        Return: a numpy array of shape (3, H, W).
+        """
+
+        shard_name = self.shard_names[index]
+
+        # Open the shards copy-on-write, so that the tensors sharing their 
+        # memory are writable
+        if shard_name not in self.shards:
+            self.shards[shard_name] = np.memmap(f'{self.store_dir}/{shard_name}', dtype=np.uint8, mode='c')
+
+        start, height, width = self.offsets[index], self.heights[index], self.widths[index]
+        return self.shards[shard_name][start:start + 3*height*width].reshape(3, height, width)
+
+    def load_image(self, index):
+        """
+        Load an image of the set as a PIL image.
+        Parameter:
+            - 'index': int. The index of the image in the set.
+        Return: the RGB PIL image.
+        """
+
+        return Image.fromarray(np.ascontiguousarray(self.get_array(index).transpose(1, 2, 0)))
+
+    def __getitem__(self, index):
+        img = torch.from_numpy(self.get_array(index))
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        return img, self.targets[index]
+
+class FeatureCacheDataset(torch.utils.data.Dataset):
+    def __init__(self, cache_dir, split):
+        """
+        Initialize instance. A dataset reading the features cached by 
+        'cache_features' by batch: an item is a batch of features and labels 
+        selected by a list of indexes, so it has to be used with a 
+        torch.utils.data.BatchSampler.
+        Parameters:
+            - 'cache_dir': a string or pathlib.Path object. The directory of 
+                           the cache ;
+            - 'split': string. The set to read, 'train', 'val' or 'test'.
+        Return: None
+        """
+
+        self.features = np.load(f'{cache_dir}/{split}_features.npy', mmap_mode='r')
+        self.targets = np.load(f'{cache_dir}/{split}_labels.npy')
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, indexes):
+        # Sorted indexes read the memory-mapped file sequentially
+        indexes = np.sort(np.asarray(indexes))
+
+        features = torch.from_numpy(self.features[indexes].astype(np.float32))
+        labels = torch.from_numpy(self.targets[indexes])
+
+        return features, labels
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Functions
 
@@ -165,7 +401,172 @@ def save_model(dir, model, name, history=None):
         history_name = Path(f'{target_dir}/history.csv')
         pd.DataFrame(history).to_csv(history_name, index=False)
 
-def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=DEVICE, is_inception=False):
+def mixed_precision_context(device, mixed_precision=False):
+    """
+    Function giving the context in which to run a model in mixed precision: 
+    under autocast, the operations which support it run in bfloat16, the 
+    others in float32. As bfloat16 has the same exponent range as float32, 
+    the gradients don't underflow and the loss doesn't need to be scaled.
+    Parameters:
+        - 'device': string or torch.device. The device the model is on ;
+        - 'mixed_precision': boolean, optional. Whether to enable mixed 
+                             precision. Default to False.
+    Return: the autocast context manager.
+    """
+
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16, enabled=mixed_precision)
+
+def train_step(model, inputs, labels, criterion, optimizer, phase, is_inception=False, mixed_precision=False):
+    """
+    Function processing a batch of images during training: forward pass, and 
+    backward pass and optimization in the training phase.
+    Parameters:
+        - 'model': torch.Model object. The model to train ;
+        - 'inputs': torch.Tensor. The batch of images, on the model device ;
+        - 'labels': torch.Tensor. The labels of the images, on the model 
+                    device ;
+        - 'criterion': function. The loss function to use during the 
+                       training ;
+        - 'optimizer': function. The optimization function to use during the
+                       training ;
+        - 'phase': string. 'train' or 'val' ;
+        - 'is_inception': boolean. Flag indicating if the model is Inception 
+                          v3. Default to False ;
+        - 'mixed_precision': boolean, optional. Whether to run the model in 
+                             bfloat16 under autocast, the backward pass 
+                             running out of it. Default to False.
+    Return: the mean loss and the number of correct predictions of the batch, 
+            as tensors on the model device, so that the host doesn't wait for 
+            the device at each batch.
+    """
+
+    # zero the parameter gradients, releasing them rather than filling them 
+    # with zeros
+    optimizer.zero_grad(set_to_none=True)
+
+    # forward
+    # track history if only in train
+    with torch.set_grad_enabled(phase == 'train'):
+        # Get model outputs and calculate loss
+        # Special case for inception because in training it has an auxiliary output. In train
+        #   mode we calculate the loss by summing the final output and the auxiliary output
+        #   but in testing we only consider the final output.
+        with mixed_precision_context(inputs.device, mixed_precision):
+            if is_inception and (phase == 'train'):
+                # From https://discuss.pytorch.org/t/how-to-optimize-inception-model-with-auxiliary-classifiers/7958
+                outputs, aux_outputs = model(inputs)
+                loss1 = criterion(outputs, labels)
+                loss2 = criterion(aux_outputs, labels)
+                loss = loss1 + 0.4*loss2
+            else:
+                outputs = model(inputs)
+                loss = criterion(outputs, labels)
+
+        _, preds = torch.max(outputs, 1)
+
+        # backward + optimize only if in training phase
+        if phase == 'train':
+            loss.backward()
+            optimizer.step()
+
+    return loss.detach(), torch.sum(preds == labels)
+
+def allocate_state_buffers(model):
+    """
+    Function allocating buffers holding a copy of the state of a model, to be 
+    updated in place by 'copy_state' rather than deep copied.
+    Parameter:
+        - 'model': torch.Model object. The model whose state to copy.
+    Return: a dictionary of tensors, the copy of the model state dictionary.
+    """
+
+    return {name: tensor.detach().clone() for name, tensor in model.state_dict().items()}
+
+def copy_state(model, buffers):
+    """
+    Function copying the current state of a model into buffers allocated by 
+    'allocate_state_buffers'.
+    Parameters:
+        - 'model': torch.Model object. The model whose state to copy ;
+        - 'buffers': dictionary of tensors. The buffers to update.
+    Return: None
+    """
+
+    with torch.no_grad():
+        for name, tensor in model.state_dict().items():
+            buffers[name].copy_(tensor)
+
+def save_checkpoint(path, model, optimizer, epoch, history, best_model_wts, best_acc, best_score, wait):
+    """
+    Function saving the state of a training in progress, so that it can be 
+    resumed with 'resume_training'. The file is written to a temporary file 
+    first, so that an interrupted save never corrupts the last checkpoint.
+    Parameters:
+        - 'path': a string or pathlib.Path object. The path to the checkpoint 
+                  file ;
+        - 'model': torch.Model object. The model being trained ;
+        - 'optimizer': function. The optimization function of the model ;
+        - 'epoch': int. The number of epochs already completed ;
+        - 'history': a list of lists. The training history so far ;
+        - 'best_model_wts': dictionary. The best weights of the model so far ;
+        - 'best_acc': float. The best validation accuracy so far ;
+        - 'best_score': float. The best value of the monitored metric so far ;
+        - 'wait': int. The number of epochs since the monitored metric last 
+                  improved.
+    Return: None
+    """
+
+    checkpoint = {
+        'epoch': epoch,
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'history': history,
+        'best_model_wts': best_model_wts,
+        'best_acc': best_acc,
+        'best_score': best_score,
+        'wait': wait,
+        'rng': {
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy': np.random.get_state(),
+            'python': random.getstate(),
+        },
+    }
+
+    torch.save(checkpoint, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+
+def load_checkpoint(path, model, optimizer, device=DEVICE):
+    """
+    Function restoring a model, its optimizer and the random generators from 
+    a checkpoint saved by 'save_checkpoint'.
+    Parameters:
+        - 'path': a string or pathlib.Path object. The path to the checkpoint 
+                  file ;
+        - 'model': torch.Model object. The model to restore, on 'device' ;
+        - 'optimizer': function. The optimization function to restore ;
+        - 'device': string, optional. The device the model is on. Default to 
+                    the device detected by the script.
+    Return: the checkpoint dictionary, without the model and optimizer 
+            states.
+    """
+
+    # The random generators states are not tensors only
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+
+    model.load_state_dict(checkpoint.pop('model'))
+    optimizer.load_state_dict(checkpoint.pop('optimizer'))
+
+    rng = checkpoint.pop('rng')
+    torch.set_rng_state(rng['torch'].cpu())
+    if rng['cuda'] is not None and torch.cuda.is_available(): torch.cuda.set_rng_state_all([state.cpu() for state in rng['cuda']])
+    np.random.set_state(rng['numpy'])
+    random.setstate(rng['python'])
+
+    return checkpoint
+
+def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=DEVICE, is_inception=False, 
+                checkpoint_path=None, checkpoint_every=1, resume=False, patience=None, monitor='val_loss', compile_model=False, mixed_precision=False):
     """
     Function used to train pretrained based model in Pytorch
     Parameters:
@@ -181,10 +582,30 @@ def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=
                     train the model. Default to the device detected by the 
                     script ;
         - 'is_inception': boolean. Flag indicating if the model is Inception 
-                          v3. Default to False.
+                          v3. Default to False ;
+        - 'checkpoint_path': a string or pathlib.Path object, optional. The 
+                             file where to save the state of the training. If 
+                             None, no checkpoint is saved. Default to None ;
+        - 'checkpoint_every': int, optional. The number of epochs between two 
+                              checkpoints. Default to 1 ;
+        - 'resume': boolean, optional. Whether to resume the training from 
+                    'checkpoint_path' when it exists. Default to False ;
+        - 'patience': int, optional. The number of epochs without improvement 
+                      of the monitored metric after which the training stops. 
+                      If None, all the epochs are run. Default to None ;
+        - 'monitor': string, optional. The metric monitored for early 
+                     stopping, 'val_loss' or 'val_acc'. Default to 'val_loss' ;
+        - 'compile_model': boolean, optional. Whether to run the batches 
+                           through the model compiled by 'torch.compile'. 
+                           Default to False ;
+        - 'mixed_precision': boolean, optional. Whether to run the model in 
+                             bfloat16 under autocast. Default to False.
     Return: trained model and training history.
     """
 
+    if monitor not in ['val_loss', 'val_acc']:
+        raise AttributeError(f"'monitor' must be 'val_loss' or 'val_acc', here {monitor}")
+
     model = model.to(device)
 
     train_loss_history = []
@@ -192,12 +613,35 @@ def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=
     val_loss_history = []
     val_acc_history = []
 
-    best_model_wts = copy.deepcopy(model.state_dict())
+    # The compiled model shares its parameters with the model
+    step_model = torch.compile(model) if compile_model else model
+
+    best_model_wts = allocate_state_buffers(model)
     best_acc = 0.0
 
+    # Early stopping state: the best monitored value and the number of epochs 
+    # since it was reached
+    best_score = float('inf') if monitor == 'val_loss' else 0.0
+    wait = 0
+    start_epoch = 0
+
+    if resume and checkpoint_path is not None and Path(checkpoint_path).exists():
+        checkpoint = load_checkpoint(checkpoint_path, model, optimizer, device)
+        start_epoch = checkpoint['epoch']
+        train_loss_history, val_loss_history, train_acc_history, val_acc_history = checkpoint['history']
+        for name, tensor in checkpoint['best_model_wts'].items(): best_model_wts[name].copy_(tensor)
+        best_acc = checkpoint['best_acc']
+        best_score = checkpoint['best_score']
+        wait = checkpoint['wait']
+        print(f'Resuming from epoch {start_epoch+1}')
+
     since = time.time()
 
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
+        if patience is not None and wait >= patience:
+            print(f'Early stopping: no improvement of {monitor} for {patience} epochs')
+            break
+
         print(f'Epoch {epoch+1}/{num_epochs}')
         # Each epoch has a training and validation phase
         for phase in ['train', 'val']:
@@ -206,52 +650,29 @@ def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=
             else:
                 model.eval()   # Set model to evaluate mode
 
-            running_loss = 0.0
-            running_corrects = 0
+            # Statistics are accumulated on the device, and read once per 
+            # epoch
+            running_loss = torch.zeros((), device=device)
+            running_corrects = torch.zeros((), dtype=torch.long, device=device)
 
             # Iterate over data.
             for inputs, labels in dataloaders[phase]:
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-
-                # zero the parameter gradients
-                optimizer.zero_grad()
-
-                # forward
-                # track history if only in train
-                with torch.set_grad_enabled(phase == 'train'):
-                    # Get model outputs and calculate loss
-                    # Special case for inception because in training it has an auxiliary output. In train
-                    #   mode we calculate the loss by summing the final output and the auxiliary output
-                    #   but in testing we only consider the final output.
-                    if is_inception and (phase == 'train'):
-                        # From https://discuss.pytorch.org/t/how-to-optimize-inception-model-with-auxiliary-classifiers/7958
-                        outputs, aux_outputs = model(inputs)
-                        loss1 = criterion(outputs, labels)
-                        loss2 = criterion(aux_outputs, labels)
-                        loss = loss1 + 0.4*loss2
-                    else:
-                        outputs = model(inputs)
-                        loss = criterion(outputs, labels)
-
-                    _, preds = torch.max(outputs, 1)
-
-                    # backward + optimize only if in training phase
-                    if phase == 'train':
-                        loss.backward()
-                        optimizer.step()
+                inputs = inputs.to(device, non_blocking=True)
+                labels = labels.to(device, non_blocking=True)
+
+                loss, corrects = train_step(step_model, inputs, labels, criterion, optimizer, phase, is_inception, mixed_precision)
 
                 # statistics
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                running_loss += loss * inputs.size(0)
+                running_corrects += corrects
 
-            epoch_loss = float(running_loss / len(dataloaders[phase].dataset))
-            epoch_acc = float(running_corrects.double() / len(dataloaders[phase].dataset))
+            epoch_loss = running_loss.item() / len(dataloaders[phase].dataset)
+            epoch_acc = running_corrects.item() / len(dataloaders[phase].dataset)
 
-            # deep copy the model
+            # copy the model in the preallocated buffers
             if phase == 'val' and epoch_acc > best_acc:
                 best_acc = epoch_acc
-                best_model_wts = copy.deepcopy(model.state_dict())
+                copy_state(model, best_model_wts)
             
             if phase == 'train':
                 train_loss_history.append(epoch_loss)
@@ -259,7 +680,20 @@ def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=
             else:
                 val_loss_history.append(epoch_loss)
                 val_acc_history.append(epoch_acc)
-        
+
+                score = epoch_loss if monitor == 'val_loss' else epoch_acc
+                improved = score < best_score if monitor == 'val_loss' else score > best_score
+                if improved:
+                    best_score = score
+                    wait = 0
+                else:
+                    wait += 1
+
+        # Also checkpoint the last epoch run, before stopping early
+        stopping = patience is not None and wait >= patience
+        if checkpoint_path is not None and ((epoch + 1) % checkpoint_every == 0 or epoch + 1 == num_epochs or stopping):
+            history = [train_loss_history, val_loss_history, train_acc_history, val_acc_history]
+            save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, history, best_model_wts, best_acc, best_score, wait)
 
     time_elapsed = time.time() - since
     print('Training complete in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
@@ -269,6 +703,165 @@ def train_model(model, dataloaders, criterion, optimizer, num_epochs=30, device=
     model.load_state_dict(best_model_wts)
     return model, [train_loss_history, val_loss_history, train_acc_history, val_acc_history]
 
+def resume_training(model, dataloaders, criterion, optimizer, checkpoint_path, num_epochs=30, device=DEVICE, is_inception=False, 
+                    checkpoint_every=1, patience=None, monitor='val_loss', mixed_precision=False):
+    """
+    Function resuming an interrupted training of 'train_model' from its last 
+    checkpoint: the model, the optimizer, the random generators, the history 
+    and the early stopping state are restored, and the remaining epochs are 
+    run. If the checkpoint doesn't exist, the training starts from scratch.
+    Parameters:
+        - 'checkpoint_path': a string or pathlib.Path object. The checkpoint 
+                             file of the interrupted training ;
+        - the other parameters are the ones of 'train_model', and must be the 
+          ones of the interrupted training.
+    Return: trained model and training history.
+    """
+
+    return train_model(model, dataloaders, criterion, optimizer, num_epochs, device, is_inception, 
+                       checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every, resume=True, patience=patience, monitor=monitor, 
+                       mixed_precision=mixed_precision)
+
+def train_models(models, dataloaders, criterion, optimizers, num_epochs=30, device=DEVICE, is_inception=None, mixed_precision=False):
+    """
+    Function used to train several pretrained based models in Pytorch at 
+    once: each batch is loaded once and supplied to every model in turn.
+    Parameters:
+        - 'models': list of torch.Model objects. The models to train. They 
+                    must accept the same input size ;
+        - 'dataloaders': torch.utils.data.DataLoader. The Dataloader providing
+                         train and validation data ;
+        - 'criterion': function. The loss function to use during the 
+                       training ;
+        - 'optimizers': list of functions. The optimization function of each 
+                        model ;
+        - 'num_epochs': int, optional. The number of epochs. Default to 30 ;
+        - 'device': string, optional. The device (cuda or cpu) on which to 
+                    train the models. Default to the device detected by the 
+                    script ;
+        - 'is_inception': list of booleans, optional. Flags indicating which 
+                          models are Inception v3. If None, none of them. 
+                          Default to None ;
+        - 'mixed_precision': boolean, optional. Whether to run the models in 
+                             bfloat16 under autocast. Default to False.
+    Return: the list of the trained models and the list of their training 
+            histories.
+    """
+
+    if is_inception is None: is_inception = [False] * len(models)
+
+    models = [model.to(device) for model in models]
+
+    histories = [[[], [], [], []] for _ in models]
+
+    best_models_wts = [allocate_state_buffers(model) for model in models]
+    best_accs = [0.0] * len(models)
+
+    since = time.time()
+
+    for epoch in range(num_epochs):
+        print(f'Epoch {epoch+1}/{num_epochs}')
+        # Each epoch has a training and validation phase
+        for phase in ['train', 'val']:
+            for model in models:
+                if phase == 'train': model.train()
+                else: model.eval()
+
+            running_losses = [torch.zeros((), device=device) for _ in models]
+            running_corrects = [torch.zeros((), dtype=torch.long, device=device) for _ in models]
+
+            # Iterate over data, each batch being shared by the models
+            for inputs, labels in dataloaders[phase]:
+                inputs = inputs.to(device, non_blocking=True)
+                labels = labels.to(device, non_blocking=True)
+
+                for i, model in enumerate(models):
+                    loss, corrects = train_step(model, inputs, labels, criterion, optimizers[i], phase, is_inception[i], mixed_precision)
+
+                    running_losses[i] += loss * inputs.size(0)
+                    running_corrects[i] += corrects
+
+            num_images = len(dataloaders[phase].dataset)
+
+            for i, model in enumerate(models):
+                epoch_loss = running_losses[i].item() / num_images
+                epoch_acc = running_corrects[i].item() / num_images
+
+                # copy the model in the preallocated buffers
+                if phase == 'val' and epoch_acc > best_accs[i]:
+                    best_accs[i] = epoch_acc
+                    copy_state(model, best_models_wts[i])
+
+                # [train_loss, val_loss, train_accuracy, val_accuracy]
+                histories[i][0 if phase == 'train' else 1].append(epoch_loss)
+                histories[i][2 if phase == 'train' else 3].append(epoch_acc)
+
+    time_elapsed = time.time() - since
+    print('Training complete in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
+    print('Best val Acc: ' + ', '.join('{:4f}'.format(acc) for acc in best_accs))
+
+    # load best models weights
+    for model, best_model_wts in zip(models, best_models_wts):
+        model.load_state_dict(best_model_wts)
+
+    return models, histories
+
+def benchmark_train_steps(model, input_size, num_classes, batch_size=32, n_steps=20, device=DEVICE, compile_model=False, is_inception=False, mixed_precision=False, 
+                          sync_every_step=False):
+    """
+    Function measuring the training throughput of a model on random batches, 
+    with the same step as 'train_model'. It only measures the throughput of 
+    the given settings: comparing the steps per second of two runs, e.g. with 
+    and without 'sync_every_step', gives the effect of a setting.
+    Parameters:
+        - 'model': torch.Model object. The model to benchmark ;
+        - 'input_size': int. The size of the input images ;
+        - 'num_classes': int. The number of classes of the model ;
+        - 'batch_size': int, optional. The number of images per batch. Default 
+                        to 32 ;
+        - 'n_steps': int, optional. The number of timed steps. Default to 20 ;
+        - 'device': string, optional. The device on which to run the model. 
+                    Default to the device detected by the script ;
+        - 'compile_model': boolean, optional. Whether to run the model 
+                           compiled by 'torch.compile'. Default to False ;
+        - 'is_inception': boolean. Flag indicating if the model is Inception 
+                          v3. Default to False ;
+        - 'mixed_precision': boolean, optional. Whether to run the model in 
+                             bfloat16 under autocast. Default to False ;
+        - 'sync_every_step': boolean, optional. Whether to read the loss on 
+                             the host after every step, waiting for the 
+                             device each time, as the training loops did 
+                             before accumulating their statistics on the 
+                             device. Default to False.
+    Return: the number of training steps per second.
+    """
+
+    model = model.to(device)
+    model.train()
+    step_model = torch.compile(model) if compile_model else model
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9)
+
+    inputs = torch.randn(batch_size, 3, input_size, input_size, device=device)
+    labels = torch.randint(num_classes, (batch_size,), device=device)
+
+    # Warm up, compiling the model if needed
+    for _ in range(2):
+        train_step(step_model, inputs, labels, criterion, optimizer, 'train', is_inception, mixed_precision)
+
+    running_loss = torch.zeros((), device=device)
+    since = time.time()
+    for _ in range(n_steps):
+        loss, _ = train_step(step_model, inputs, labels, criterion, optimizer, 'train', is_inception, mixed_precision)
+        if sync_every_step: loss.item()
+        running_loss += loss
+    
+    # Wait for the device once, as 'train_model' does per epoch
+    running_loss.item()
+
+    return n_steps / (time.time() - since)
+
 def set_parameter_requires_grad(model, trainable):
     """
     Function used to change the trainability of the layers of a model.
@@ -360,7 +953,161 @@ def initialize_model(model_name, num_classes, trainable=False):
 
     return model_ft, input_size
 
-def create_dataloader(dir, data_transforms, batch_size=32):
+def get_head(model_name, model):
+    """
+    Function splitting a model created by 'initialize_model' between its 
+    frozen trunk and its classification head.
+    Parameters:
+        - 'model_name': string. The name of the model ;
+        - 'model': torch.Model object. The model to split.
+    Return: the layer whose input is the penultimate features, and the head, 
+            a torch.Model object computing the outputs of the model from 
+            these features. The head shares its parameters with the model.
+    """
+
+    if model_name in ["resnet", "inception"]:
+        return model.fc, model.fc
+
+    elif model_name in ["alexnet", "vgg"]:
+        return model.classifier[6], model.classifier[6]
+
+    elif model_name == "squeezenet":
+        # The outputs of the classifier are flatten in the model forward pass
+        return model.classifier, nn.Sequential(model.classifier, nn.Flatten())
+
+    elif model_name == "densenet":
+        return model.classifier, model.classifier
+
+    else:
+        raise ValueError(f'Invalid model name: {model_name}')
+
+def get_dataset_fingerprint(dataset):
+    """
+    Function computing a hash of the images of a dataset: their paths, 
+    labels and, for a manifest, their augmentation recipe.
+    Parameter:
+        - 'dataset': a datasets.ImageFolder, ManifestDataset or 
+                     TensorStoreDataset object. The dataset.
+    Return: the hexadecimal digest of the hash.
+    """
+
+    fingerprint = hashlib.sha1()
+    for path, target in dataset.imgs:
+        fingerprint.update(f'{path}\t{target}\n'.encode())
+
+    if isinstance(dataset, ManifestDataset):
+        fingerprint.update(dataset.aug_seeds.tobytes())
+        fingerprint.update(dataset.aug_indexes.tobytes())
+
+    return fingerprint.hexdigest()
+
+def cache_features(model, model_name, dataloader, cache_dir, split, device=DEVICE):
+    """
+    Function running the frozen trunk of a model once over a set, and caching 
+    the penultimate features in a float16 memory-mapped '.npy' file, with the 
+    labels. The fingerprint of the dataset, computed by 
+    'get_dataset_fingerprint', is written last in '{split}_index.txt', so 
+    that an outdated or incomplete cache can be detected.
+    Parameters:
+        - 'model': torch.Model object. The model whose features to cache ;
+        - 'model_name': string. The name of the model ;
+        - 'dataloader': torch.utils.data.DataLoader. The dataloader providing 
+                        the images of the set, with fixed transformations ;
+        - 'cache_dir': a string or pathlib.Path object. The directory where to 
+                       save the cache ;
+        - 'split': string. The name of the set ;
+        - 'device': string, optional. The device (cuda or cpu) on which to 
+                    run the model. Default to the device detected by the 
+                    script.
+    Return: the path to the features file.
+    """
+
+    num_images = len(dataloader.dataset)
+    if num_images == 0: raise ValueError(f"The '{split}' set has no image to cache")
+
+    # The cache is invalid until it is complete
+    if Path(f'{cache_dir}/{split}_index.txt').exists(): os.remove(f'{cache_dir}/{split}_index.txt')
+
+    layer, _ = get_head(model_name, model)
+
+    features = None
+    labels = np.empty(num_images, dtype=np.int64)
+    batch_features = []
+
+    # Catch the input of the head
+    hook = layer.register_forward_pre_hook(lambda module, inputs: batch_features.append(inputs[0]))
+
+    model = model.to(device)
+    model.eval()
+
+    start = 0
+    with torch.no_grad():
+        for inputs, targets in dataloader:
+            model(inputs.to(device))
+            batch = batch_features.pop().cpu().numpy()
+            stop = start + len(batch)
+
+            if features is None:
+                features = np.lib.format.open_memmap(f'{cache_dir}/{split}_features.npy', mode='w+', dtype=np.float16, shape=(num_images,) + batch.shape[1:])
+
+            features[start:stop] = batch
+            labels[start:stop] = targets.numpy()
+            start = stop
+
+    hook.remove()
+
+    features.flush()
+    del features
+    np.save(f'{cache_dir}/{split}_labels.npy', labels)
+
+    with open(f'{cache_dir}/{split}_index.txt', 'w') as f:
+        f.write(get_dataset_fingerprint(dataloader.dataset))
+
+    return f'{cache_dir}/{split}_features.npy'
+
+def create_feature_dataloaders(model, model_name, datasets_dict, cache_dir, batch_size=32, device=DEVICE):
+    """
+    Function creating the train and validation dataloaders of the cached 
+    features of a frozen model, caching them if it isn't done yet, or if the 
+    cache was made from other images than the ones of the datasets.
+    The features are extracted with the validation transformations for both 
+    sets, so that they don't change between epochs.
+    Parameters:
+        - 'model': torch.Model object. The frozen model ;
+        - 'model_name': string. The name of the model ;
+        - 'datasets_dict': a dictionnary of datasets, as returned by 
+                           'create_dataloaders' ;
+        - 'cache_dir': a string or pathlib.Path object. The directory where to 
+                       save the cache ;
+        - 'batch_size': int, optional. The number of features by batch to 
+                        provide to the head. Default to 32 ;
+        - 'device': string, optional. The device (cuda or cpu) on which to 
+                    run the model. Default to the device detected by the 
+                    script.
+    Return: a dictionnary of dataloaders, and the head of the model to train.
+    """
+
+    if not Path(cache_dir).exists(): os.makedirs(cache_dir)
+
+    dataloaders_dict = {}
+
+    for x in ['train', 'val']:
+        index_path = Path(f'{cache_dir}/{x}_index.txt')
+        if not index_path.exists() or index_path.read_text() != get_dataset_fingerprint(datasets_dict[x]):
+            dataset = copy.copy(datasets_dict[x])
+            dataset.transform = datasets_dict['val'].transform
+            dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=4)
+            cache_features(model, model_name, dataloader, cache_dir, x, device)
+
+        features_dataset = FeatureCacheDataset(cache_dir, x)
+        sampler = torch.utils.data.BatchSampler(torch.utils.data.RandomSampler(features_dataset), batch_size, drop_last=False)
+        dataloaders_dict[x] = torch.utils.data.DataLoader(features_dataset, batch_size=None, sampler=sampler)
+
+    _, head = get_head(model_name, model)
+
+    return dataloaders_dict, head
+
+def create_dataloader(dir, data_transforms, batch_size=32, manifest=None, split=None, store=False, shuffle=True):
     """
     Function used to create a Pytorch image dataset and dataloader.
     Parameters:
@@ -370,18 +1117,32 @@ def create_dataloader(dir, data_transforms, batch_size=32):
                              torchvision.tansforms.Compose object. The 
                              transformations to apply ;
         - 'batch_size': int, optional. The number of images by batch to 
-                        provide to the model. Default to 32.
+                        provide to the model. Default to 32 ;
+        - 'manifest': a string, pathlib.Path object or DataFrame, optional. 
+                      A manifest describing the sets. If given, 'dir' is the 
+                      directory the paths of the manifest are relative to. 
+                      Default to None ;
+        - 'split': string, optional. The set of the manifest or of the store 
+                   to read. Default to None ;
+        - 'store': boolean, optional. Whether 'dir' is a tensor store created 
+                   by 'create_tensor_store'. Default to False ;
+        - 'shuffle': boolean, optional. Whether to shuffle the images at each 
+                     epoch. If False, the images are supplied in the order of 
+                     the dataset, so that predictions are aligned with its 
+                     'targets'. Default to True.
     Return: the dataloader and the image dataset.
     """
 
     # Create datasets
-    images_dataset = datasets.ImageFolder(dir, data_transforms)
+    if store: images_dataset = TensorStoreDataset(dir, split, data_transforms)
+    elif manifest is None: images_dataset = datasets.ImageFolder(dir, data_transforms)
+    else: images_dataset = ManifestDataset(manifest, split, data_transforms, dir)
 
     # Create dataloaders
-    dataloader = torch.utils.data.DataLoader(images_dataset, batch_size=batch_size, shuffle=True, num_workers=4)
+    dataloader = torch.utils.data.DataLoader(images_dataset, batch_size=batch_size, shuffle=shuffle, num_workers=4)
     return dataloader, images_dataset
 
-def create_dataloaders(root_dir, input_size, batch_size=32):
+def create_dataloaders(root_dir, input_size, batch_size=32, manifest=None, store=False):
     """
     Function used to create the train, test, and validation dataloaders and 
     datasets.
@@ -390,10 +1151,22 @@ def create_dataloaders(root_dir, input_size, batch_size=32):
                       find the sets ;
         - 'input_size': int. The size to which to resize the images ;
         - 'batch_size': int, optional. The number of images by batch to 
-                        provide to the model. Default to 32.
-    Return: a dictionnary of dataloaders and a dictionnary of datasets.
+                        provide to the model. Default to 32 ;
+        - 'manifest': a string or pathlib.Path object, optional. The path to 
+                      a manifest created by 'create_dataset'. If given, the 
+                      sets are read from the manifest, and 'root_dir' is the 
+                      directory its paths are relative to. Default to None ;
+        - 'store': boolean, optional. Whether 'root_dir' is a tensor store 
+                   created by 'create_tensor_store' with the same 
+                   'input_size'. Default to False.
+    Return: a dictionnary of dataloaders and a dictionnary of datasets. Only 
+            the train set is shuffled: the validation and test sets are 
+            supplied in the order of their datasets.
     """
 
+    if store:
+        return create_store_dataloaders(root_dir, input_size, batch_size)
+
     # Data augmentation and normalization for training
     # Just normalization for validation
     data_transforms = {
@@ -420,8 +1193,150 @@ def create_dataloaders(root_dir, input_size, batch_size=32):
     dataloaders_dict = {}
     datasets_dict = {}
 
+    if manifest is not None:
+        # Read the manifest once for all the sets
+        df_manifest = pd.read_csv(manifest, dtype={'aug_seed': np.uint64})
+
     for x in ['train', 'val', 'test']:
-        dataloaders_dict[x], datasets_dict[x] = create_dataloader(f'{root_dir}/{x}', data_transforms[x], batch_size)
+        if manifest is None:
+            dataloaders_dict[x], datasets_dict[x] = create_dataloader(f'{root_dir}/{x}', data_transforms[x], batch_size, shuffle=(x == 'train'))
+        elif (df_manifest['split'] == x).any():
+            dataloaders_dict[x], datasets_dict[x] = create_dataloader(root_dir, data_transforms[x], batch_size, df_manifest, x, shuffle=(x == 'train'))
+
+    return dataloaders_dict, datasets_dict
+
+def create_tensor_store(root_dir, save_dir, input_size, manifest=None, shard_size=4096, n_jobs=4, train_size=None):
+    """
+    Function decoding the images of the train, validation and test sets once, 
+    and saving them as uint8 arrays of shape (3, H, W) in raw '.bin' shards, 
+    read as memory maps, so that training doesn't need to decode the images 
+    anymore.
+    The validation and test images are resized and center cropped to 
+    'input_size', as in 'create_dataloaders'. The train images are not 
+    cropped, so that 'RandomResizedCrop' crops them from the whole image, as 
+    in 'create_dataloaders'. An 'index.csv' file gives the set, the shard, 
+    the offset in the shard, the height and width, the original path and the 
+    label of each image.
+    Parameters:
+        - 'root_dir': a string or pathlib.Path object. The directory where to 
+                      find the sets, or the directory the paths of the 
+                      manifest are relative to ;
+        - 'save_dir': a string or pathlib.Path object. The directory where to 
+                      save the store ;
+        - 'input_size': int. The size to which to resize the images ;
+        - 'manifest': a string or pathlib.Path object, optional. The path to 
+                      a manifest created by 'create_dataset'. Default to 
+                      None ;
+        - 'shard_size': int, optional. The maximum number of images per 
+                        shard. Default to 4096 ;
+        - 'n_jobs': int, optional. The number of threads used to decode the 
+                    images. Default to 4 ;
+        - 'train_size': int, optional. The size to which to resize the 
+                        shorter side of the train images. It should be larger 
+                        than 'input_size'. If None, the train images are 
+                        stored at their original resolution. Default to None.
+    Return: the path to the store directory.
+    """
+
+    resizes = {
+        'train': transforms.Resize(train_size) if train_size is not None else None,
+        'val': transforms.Compose([transforms.Resize(input_size), transforms.CenterCrop(input_size)]),
+        'test': transforms.Compose([transforms.Resize(input_size), transforms.CenterCrop(input_size)]),
+    }
+
+    if manifest is not None:
+        df_manifest = pd.read_csv(manifest, dtype={'aug_seed': np.uint64})
+
+    if not Path(save_dir).exists(): os.makedirs(save_dir)
+
+    index = []
+    since = time.time()
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for split in SPLITS:
+            if manifest is None:
+                if not Path(f'{root_dir}/{split}').exists(): continue
+                dataset = datasets.ImageFolder(f'{root_dir}/{split}')
+            else:
+                if not (df_manifest['split'] == split).any(): continue
+                dataset = ManifestDataset(df_manifest, split, root_dir=root_dir)
+
+            def decode(i, resize=resizes[split]):
+                img = load_image(dataset, i)
+                if resize is not None: img = resize(img)
+                return np.asarray(img).transpose(2, 0, 1)
+
+            for shard_id, start in enumerate(range(0, len(dataset), shard_size)):
+                stop = min(start + shard_size, len(dataset))
+                shard_name = f'{split}_{shard_id:05d}.bin'
+
+                # Images are written one after the other, as their sizes may 
+                # differ
+                offset = 0
+                with open(f'{save_dir}/{shard_name}', 'wb') as f:
+                    for (path, target), img in zip(dataset.imgs[start:stop], executor.map(decode, range(start, stop))):
+                        f.write(img.tobytes())
+                        index.append((split, shard_name, offset, img.shape[1], img.shape[2], path, dataset.classes[target]))
+                        offset += img.size
+
+    df_index = pd.DataFrame(index, columns=['split', 'shard', 'offset', 'height', 'width', 'path', 'label'])
+    df_index.to_csv(f'{save_dir}/index.csv', index=False)
+
+    time_elapsed = time.time() - since
+    throughput = len(df_index) / time_elapsed if time_elapsed > 0 else 0.0
+    print(f'stored = {len(df_index)} ({throughput:.1f} images/s)')
+
+    return save_dir
+
+def create_store_dataloaders(store_dir, input_size, batch_size=32):
+    """
+    Function used to create the train, test, and validation dataloaders and 
+    datasets from a tensor store created by 'create_tensor_store'. The 
+    transformations are the ones of 'create_dataloaders', applied to uint8 
+    tensors: the train images are randomly cropped from the stored images, 
+    while the validation and test images are stored already resized and 
+    center cropped. If the store was created with a 'train_size', the train 
+    crops are taken from images resized to that size rather than from the 
+    original ones.
+    Parameters:
+        - 'store_dir': a sting or pathlib.Path object. The directory of the 
+                       store ;
+        - 'input_size': int. The size of the images supplied to the model ;
+        - 'batch_size': int, optional. The number of images by batch to 
+                        provide to the model. Default to 32.
+    Return: a dictionnary of dataloaders and a dictionnary of datasets.
+    """
+
+    # Validation and test images are already resized and center cropped
+    data_transforms = {
+        'train': transforms.Compose([
+            transforms.RandomResizedCrop(input_size, antialias=True),
+            transforms.RandomHorizontalFlip(),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+        'val': transforms.Compose([
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+        'test': transforms.Compose([
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+    }
+
+    splits = pd.read_csv(f'{store_dir}/index.csv', usecols=['split'])['split'].unique()
+
+    dataloaders_dict = {}
+    datasets_dict = {}
+
+    for x in ['train', 'val', 'test']:
+        if x not in splits: continue
+
+        dataloaders_dict[x], datasets_dict[x] = create_dataloader(store_dir, data_transforms[x], batch_size, split=x, store=True, shuffle=(x == 'train'))
+
+        if x != 'train' and datasets_dict[x].input_size != input_size:
+            raise ValueError(f'{store_dir} stores images of size {datasets_dict[x].input_size}, {input_size} expected')
 
     return dataloaders_dict, datasets_dict
 
@@ -536,7 +1451,7 @@ def plot_report(cr, cm, categories, report_name=None, cmap='Blues', save_path=No
     if display_report:
         plt.show();
 
-def model_report(model, test_dataloader, test_dataset, model_name, ds_name, save_dir=None, device=DEVICE, display_report=True):
+def model_report(model, test_dataloader, test_dataset, model_name, ds_name, save_dir=None, device=DEVICE, display_report=True, mixed_precision=False):
     """
     Function creating the performance report of a trained model.
     Parameters:
@@ -557,13 +1472,16 @@ def model_report(model, test_dataloader, test_dataset, model_name, ds_name, save
                     predict labels. Default to the device detected by the 
                     script ;
         - 'display_report': a boolean, optional. Whether to display or not the 
-                            report. Default to True.
-    Return: None.
+                            report. Default to True ;
+        - 'mixed_precision': boolean, optional. Whether to run the model in 
+                             bfloat16 under autocast. Default to False.
+    Return: the arrays of the true and predicted labels, as returned by 
+            'predict'.
     """
 
     categories = test_dataset.class_to_idx
 
-    y_test, y_pred = predict(model, test_dataloader, device)
+    y_test, y_pred = predict(model, test_dataloader, device, mixed_precision)
 
     # Plot the report
     cr = classification_report(y_test, y_pred, target_names=categories, output_dict=True, zero_division=0)
@@ -576,6 +1494,65 @@ def model_report(model, test_dataloader, test_dataset, model_name, ds_name, save
         save_path = f'{save_dir}/{model_name}-{ds_name.replace("/", "_")}.png'
     plot_report(cr, cm, categories, report_name, save_path=save_path, display_report=display_report)
 
+    return y_test, y_pred
+
+def precision_parity_report(model, test_dataloader, device=DEVICE):
+    """
+    Function comparing the predictions of a model in float32 and in mixed 
+    precision on the test set, to check that mixed precision can be used 
+    without loss of accuracy.
+    Parameters:
+        - 'model': a torch.Model object. The model to check ;
+        - 'test_dataloader': a torch.utils.data.Dataloader object. The 
+                             dataloader supplying test images to the model ;
+        - 'device': string, optional. The device (cuda or cpu) to use to 
+                    predict labels. Default to the device detected by the 
+                    script.
+    Return: a dictionary with the accuracies in float32 and in mixed 
+            precision, their difference, and the rate of images predicted the 
+            same way in both.
+    """
+
+    num_images = len(test_dataloader.dataset)
+    y_test = np.empty(num_images, dtype=np.int64)
+    y_pred_fp32 = np.empty(num_images, dtype=np.int64)
+    y_pred_bf16 = np.empty(num_images, dtype=np.int64)
+
+    model = model.to(device)
+    was_training = model.training
+    model.eval()
+
+    # Both precisions predict the same batch, so that the predictions of an 
+    # image are compared together, whatever the order of the dataloader
+    start = 0
+    try:
+        with torch.inference_mode():
+            for X, Y in test_dataloader:
+                X = X.to(device, non_blocking=True)
+                stop = start + len(Y)
+
+                for y_pred, mixed_precision in [(y_pred_fp32, False), (y_pred_bf16, True)]:
+                    with mixed_precision_context(device, mixed_precision):
+                        pred = model(X)
+                    if not isinstance(pred, torch.Tensor): pred = pred.logits
+                    y_pred[start:stop] = pred.float().argmax(dim=1).cpu().numpy()
+
+                y_test[start:stop] = Y.numpy()
+                start = stop
+    finally:
+        model.train(was_training)
+
+    report = {
+        'fp32_accuracy': float((y_pred_fp32 == y_test).mean()),
+        'bf16_accuracy': float((y_pred_bf16 == y_test).mean()),
+        'agreement': float((y_pred_fp32 == y_pred_bf16).mean()),
+    }
+    report['accuracy_delta'] = report['bf16_accuracy'] - report['fp32_accuracy']
+
+    print(*[f'{k} = {v:.4f}' for k, v in report.items()], sep='\t')
+
+    return report
+
 def get_target_layers(model_name, model):
     """
     Function returning the layer to target for a gradCAM analysis.
@@ -644,17 +1621,102 @@ def gradCAM(model, target_layers, img):
 
     # Create an input tensor image for the model
     input_tensor = torch.tensor(rgb_img).unsqueeze(0).float()
-    print(input_tensor.shape)
     model = model.to('cpu')
 
     with GradCAM(model=model, target_layers=target_layers, use_cuda=False) as cam:
         grayscale_cam = cam(input_tensor=input_tensor)
 
     grayscale_cam = grayscale_cam[0, :]
-    print(grayscale_cam.shape)
 
     return show_cam_on_image(rgb_img, grayscale_cam, use_rgb=True)
 
+def batch_gradCAMs(model, target_layer, dataset, indexes, class_indexes, batch_size=32, device=DEVICE):
+    """
+    Function computing the gradCAMs of images of a dataset by batches, on the 
+    model device. The activations of the target layer are detached from the 
+    rest of the network, so that the gradients are computed down to this 
+    layer only, without changing the trainable parameters of the model.
+    Parameters:
+        - 'model': a torch.Model object. The model to analyze ;
+        - 'target_layer': a torch.nn.Module. The layer to consider for the 
+                          analysis, as returned by 'get_target_layers' ;
+        - 'dataset': a torch.utils.data.Dataset object. The dataset containing 
+                     the images, with their test transformations ;
+        - 'indexes': a list of int. The indexes of the images to analyze ;
+        - 'class_indexes': a list of int. The class to explain for each image, 
+                           usually its predicted class ;
+        - 'batch_size': int, optional. The number of images per batch. Default 
+                        to 32 ;
+        - 'device': string, optional. The device (cuda or cpu) on which to 
+                    run the model. Default to the device detected by the 
+                    script.
+    Return: the list of the gradCAMs, as numpy arrays of the size of the 
+            model input, normalized between 0 and 1.
+    """
+
+    activations = []
+
+    def hook(module, inputs, output):
+        """
+        Catch the activations of the target layer, as a leaf of the graph.
+        Return: a copy of the activations, so that the in-place operations of 
+                the next layers don't modify them.
+        """
+
+        leaf = output.detach().requires_grad_()
+        activations.append(leaf)
+        return leaf.clone()
+
+    handle = target_layer.register_forward_hook(hook)
+
+    model = model.to(device)
+    was_training = model.training
+    model.eval()
+
+    cams = []
+    try:
+        for start in range(0, len(indexes), batch_size):
+            inputs = torch.stack([dataset[i][0] for i in indexes[start:start+batch_size]]).to(device)
+            targets = torch.as_tensor(np.asarray(class_indexes[start:start+batch_size]), dtype=torch.long, device=device)
+
+            with torch.enable_grad():
+                outputs = model(inputs)
+                if not isinstance(outputs, torch.Tensor): outputs = outputs.logits
+                score = outputs.gather(1, targets.unsqueeze(1)).sum()
+                acts = activations.pop()
+                grads, = torch.autograd.grad(score, acts)
+
+            # Weight each activation map by its mean gradient
+            weights = grads.mean(dim=(2, 3))
+            cam = torch.relu(torch.einsum('nchw,nc->nhw', acts.detach(), weights))
+            cam = nn.functional.interpolate(cam.unsqueeze(1), size=inputs.shape[-2:], mode='bilinear', align_corners=False).squeeze(1)
+
+            # Max min normalization, per image
+            cam_min = cam.amin(dim=(1, 2), keepdim=True)
+            cam_max = cam.amax(dim=(1, 2), keepdim=True)
+            cam = (cam - cam_min) / (cam_max - cam_min).clamp_min(1e-7)
+
+            cams.extend(cam.cpu().numpy())
+    finally:
+        handle.remove()
+        model.train(was_training)
+
+    return cams
+
+def overlay_gradCAM(img, cam):
+    """
+    Function surimpressing a gradCAM heatmap on its image.
+    Parameters:
+        - 'img': a PIL image. The original image ;
+        - 'cam': a numpy array. The gradCAM, as returned by 'batch_gradCAMs'.
+    Return: the original image resized to the gradCAM size and the 
+            surimpressed image, as uint8 numpy arrays.
+    """
+
+    rgb_img = np.asarray(img.resize((cam.shape[1], cam.shape[0])), dtype=np.float32) / 255
+
+    return np.uint8(rgb_img * 255), show_cam_on_image(rgb_img, cam, use_rgb=True)
+
 def plot_images_couples(imgs1, imgs2, ncols=3, labels=None, title=None, save_path=None, display_img=True):
     """
     Function displaying couples of images, side by side on the same figure.
@@ -706,10 +1768,26 @@ def plot_images_couples(imgs1, imgs2, ncols=3, labels=None, title=None, save_pat
     
     if display_img: plt.show();
 
-def proceed_gradCAMs(model, test_dataloader, test_dataset, model_name, ds_name, device=DEVICE, save_dir=None, display_img=True):  
+def load_image(dataset, index):
+    """
+    Function loading an image of a dataset, before any transformation.
+    Parameters:
+        - 'dataset': a datasets.ImageFolder, ManifestDataset or 
+                     TensorStoreDataset object. The dataset containing the 
+                     image ;
+        - 'index': int. The index of the image in the dataset.
+    Return: the RGB PIL image.
+    """
+
+    if isinstance(dataset, (ManifestDataset, TensorStoreDataset)): return dataset.load_image(index)
+
+    return Image.open(dataset.imgs[index][0]).convert('RGB')
+
+def proceed_gradCAMs(model, test_dataloader, test_dataset, model_name, ds_name, device=DEVICE, save_dir=None, display_img=True, y_pred=None, batch_size=32, n_jobs=4):  
     """
     Function performings gradCAM analysis on all the classes of the given 
-    dataset.
+    dataset: one correctly and one wrongly classified image per class are 
+    explained, all of them in batches.
     Parameters:
         - 'model': a torch.Model object. The model to analyze ;
         - 'test_dataloader': a torch.utils.data.Dataloader object. The 
@@ -724,10 +1802,19 @@ def proceed_gradCAMs(model, test_dataloader, test_dataset, model_name, ds_name,
                     predict labels. Default to the device detected by the 
                     script ;
         - 'save_dir': a string or pathlib.Path object, optional. The directory 
-                      in which to save the report. If None, the report won't 
-                      be saved. Default to None ;
+                      in which to save the report and the gallery of the 
+                      explained images. If None, they won't be saved. Default 
+                      to None ;
         - 'display_img': a boolean, optional. Whether to display or not the 
-                         resulting figure. Default to True.
+                         resulting figure. Default to True ;
+        - 'y_pred': array-like, optional. The predictions of the model on the 
+                    test set, as returned by 'predict', in the order of 
+                    'test_dataset'. If None, they are computed. Default to 
+                    None ;
+        - 'batch_size': int, optional. The number of images explained at once. 
+                        Default to 32 ;
+        - 'n_jobs': int, optional. The number of threads loading the images 
+                    and writing the gallery. Default to 4.
     Return: None.
     """
 
@@ -738,73 +1825,244 @@ def proceed_gradCAMs(model, test_dataloader, test_dataset, model_name, ds_name,
     # Get real labels
     y_test = np.array(test_dataset.targets)
 
-    _, y_pred = predict(model, test_dataloader, device)
-
-
-    # Training must be enabled to process gradCAM
-    model = set_parameter_requires_grad(model, trainable=True)
-
-    target_layers = get_target_layers(model_name, model)
-
-    # Select randomly 1 correctly labeled image per category
-    correct_id = []
-    
-    for cat in class_idx:
-        condition = ((y_pred == y_test) & (y_test == cat))
-        if condition.sum() > 0:
-            rnd_id = np.random.choice(np.argwhere(condition). reshape(-1,))
-            correct_id.append(int(rnd_id))
-        else:
-            correct_id.append(None)
-    
-    images = [None if i is None else Image.open(test_dataset.imgs[i][0]).convert('RGB') for i in correct_id]
-
-    # Get gradCAM for each images
-    gradCAM_images = []
-    for img in images:
-        if img is None: gradCAM_images.append(None)
-        else: gradCAM_images.append(gradCAM(model, target_layers, img))
+    # Reuse the predictions of the performance report when available
+    if y_pred is None: _, y_pred = predict(model, test_dataloader, device)
+    y_pred = np.asarray(y_pred)
+
+    target_layer = get_target_layers(model_name, model)[0]
+
+    def select_ids(correct):
+        """
+        Select randomly 1 correctly or wrongly labeled image per category.
+        Parameter:
+            - 'correct': a boolean. Whether to select correctly labeled images.
+        Return: the list of the selected indexes, None for the categories 
+                without such image.
+        """
+
+        ids = []
+        for cat in class_idx:
+            condition = ((y_pred == y_test) == correct) & (y_test == cat)
+            if condition.sum() > 0:
+                ids.append(int(np.random.choice(np.argwhere(condition).reshape(-1,))))
+            else:
+                ids.append(None)
+        return ids
+
+    correct_id = select_ids(True)
+    wrong_id = select_ids(False)
+
+    # Explain the predicted class of every selected images at once
+    selected = [i for i in correct_id + wrong_id if i is not None]
+    cams = batch_gradCAMs(model, target_layer, test_dataset, selected, y_pred[selected], batch_size, device)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        images = list(executor.map(lambda i: load_image(test_dataset, i), selected))
+        couples = dict(zip(selected, executor.map(overlay_gradCAM, images, cams)))
+
+        if save_dir:
+            # Write the gallery of the explained images
+            gallery_dir = f'{save_dir}/{model_name}-{ds_name.replace("/", "_")}-gallery'
+            os.makedirs(gallery_dir, exist_ok=True)
+
+            def save_couple(i):
+                """
+                Save an image and its gradCAM side by side.
+                Parameter:
+                    - 'i': int. The index of the image in the test set.
+                Return: None
+                """
+
+                status = 'ok' if y_pred[i] == y_test[i] else 'nok'
+                file_name = f'{status}-{idx_to_class[y_test[i]]}-{idx_to_class[y_pred[i]]}-{i}.png'
+                Image.fromarray(np.concatenate(couples[i], axis=1)).save(f'{gallery_dir}/{file_name}')
+
+            list(executor.map(save_couple, selected))
+
+    def get_couples(ids):
+        """
+        Get the images and gradCAMs of the selected indexes.
+        Parameter:
+            - 'ids': a list. The selected indexes, as returned by 'select_ids'.
+        Return: the list of the images and the list of the gradCAMs.
+        """
+
+        images = [None if i is None else couples[i][0] for i in ids]
+        gradCAM_images = [None if i is None else couples[i][1] for i in ids]
+        return images, gradCAM_images
 
     # Display the original images and the modified images
+    images, gradCAM_images = get_couples(correct_id)
     images_labels = [i for i in idx_to_class.values()]
     save_path = f'{save_dir}/{model_name}-{ds_name.replace("/", "_")}-ok-gradCAM.png' if save_dir else None
     plot_images_couples(images, gradCAM_images, labels=images_labels, title=f'{model_name} - {ds_name}: correctly classed images', save_path=save_path, display_img=display_img)
 
-    # Select random 1 wrongly labeled image per category
-    wrong_id = []
-
-    for cat in class_idx:
-        condition = ((y_pred != y_test) & (y_test == cat))
-        if condition.sum() > 0:
-            rnd_id = np.random.choice(np.argwhere(condition). reshape(-1,))
-            wrong_id.append(int(rnd_id))
-        else:
-            wrong_id.append(None)
-
-    images = [None if i is None else Image.open(test_dataset.imgs[i][0]).convert('RGB') for i in wrong_id]
-
-    # Get gradCAM for each images
-    gradCAM_images = []
-    for img in images:
-        if img is None: gradCAM_images.append(None)
-        else: gradCAM_images.append(gradCAM(model, target_layers, img))
-    
     # Display the original images and the modified images
+    images, gradCAM_images = get_couples(wrong_id)
     real_labels = [i for i in idx_to_class.values()]
     predicted_labels = [None if i is None else idx_to_class[y_pred[i]] for i in wrong_id]
     images_labels = [f'{r} - {p}' for r, p in zip(real_labels, predicted_labels)]
     save_path = f'{save_dir}/{model_name}-{ds_name.replace("/", "_")}-nok-gradCAM.png' if save_dir else None
     plot_images_couples(images, gradCAM_images, labels=images_labels, title=f'{model_name} - {ds_name}: wrongly classed images', save_path=save_path, display_img=display_img)
 
+def get_ds_name(ds_dir):
+    """
+    Function converting a dataset name to the name used in the files names.
+    Parameter:
+        - 'ds_dir': a string. The dataset name, a directory or a manifest 
+                    relative to the images directory.
+    Return: the file name of the dataset.
+    """
+
+    return ds_dir.removesuffix('.csv').replace("/", "_")
+
+def get_data_dir(images_dir, ds_dir):
+    """
+    Function locating the images of a dataset.
+    Parameters:
+        - 'images_dir': a string or pathlib.Path object. The directory where 
+                        to find the images ;
+        - 'ds_dir': a string. The dataset name, a directory or a manifest 
+                    relative to the images directory.
+    Return: the directory to supply to 'create_dataloaders' and the path to 
+            the manifest, or None.
+    """
+
+    data_dir = f'{images_dir}/{ds_dir}'
+
+    # A dataset can be described by a manifest, whose paths are relative to 
+    # its directory
+    if not data_dir.endswith('.csv'): return data_dir, None
+
+    return str(Path(data_dir).parent), data_dir
+
+def report_model(model, model_name, ds_dir, dataloaders_dict, datasets_dict, model_dir, class_report=True, gradCAM_analysis=False, device=DEVICE, display_reports=True, 
+                 class_reports_dir=CLASS_REPORTS_DIR, gradCAM_dir=GRADCAM_DIR, mixed_precision=False):
+    """
+    Function saving a model trained by 'discriminate', and performing its 
+    performance and gradCAM analysis.
+    Parameters:
+        - 'model': a torch.Model object. The trained model ;
+        - 'model_name': a string. The name of the model ;
+        - 'ds_dir': a string. The name of the dataset used to train the 
+                    model ;
+        - 'dataloaders_dict': a dictionnary of dataloaders, as returned by 
+                              'create_dataloaders' ;
+        - 'datasets_dict': a dictionnary of datasets, as returned by 
+                           'create_dataloaders' ;
+        - 'model_dir': a string or pathlib.Path object. The directory where 
+                       to save the model ;
+        - 'class_report': boolean, optional. Whether to compute classification 
+                          report or not. Default to True ;
+        - 'gradCAM_analysis': boolean, optional. Whether or not to proceed 
+                              gradCAM analysis or not. Default to False ;
+        - 'device': string, optional. The device (cuda or cpu) to use to 
+                    predict labels. Default to the device detected by the 
+                    script ;
+        - 'display_reports': a boolean. Whether to display the performance and 
+                             gradCAM reports or not. Default to True ;
+        - 'class_reports_dir': a string or pathlib.Path object, optional. The 
+                               directory where to save the performance reports. 
+                               Default to CLASS_REPORTS_DIR ;
+        - 'gradCAM_dir': a string or pathlib.Path object, optional. The 
+                         directory where to save the gradCAMs analysis. 
+                         Default to GRADCAM_DIR ;
+        - 'mixed_precision': boolean, optional. Whether to predict the labels 
+                             of the classification report in bfloat16 under 
+                             autocast. Default to False.
+    Return: None
+    """
+
+    # Save the model
+    save_name = f'{model_name}-{get_ds_name(ds_dir)}.pth'
+    save_path = f'{model_dir}/{save_name}'
+
+    torch.save(model.state_dict(), save_path)
+    print(f'Saved PyTorch Model State to: {save_path}')
+
+    ds_dir = ds_dir.removesuffix('.csv')
+
+    # Predictions of the test set, shared by the reports
+    y_pred = None
+
+    if class_report:
+        print('Classification report creation ...', end=' ')
+        # Evaluate the model on the tests set and save the evaluation report
+        _, y_pred = model_report(model, dataloaders_dict['test'], datasets_dict['test'], model_name, ds_dir, class_reports_dir, device, display_reports, mixed_precision)
+        print('done')
+
+    if gradCAM_analysis:
+        print('gradCAMs explainability ...', end=' ')
+        # gradCAMs
+        proceed_gradCAMs(model, dataloaders_dict['test'], datasets_dict['test'], model_name, ds_dir, device, gradCAM_dir, display_reports, y_pred)
+        print('done')
+
+def discriminate_couple(model_name, ds_dir, num_classes, num_epochs=30, batch_size=32, class_report=True, gradCAM_analysis=False, device=DEVICE, display_reports=True, 
+                        models_save_dir=MODELS_SAVE_DIR, images_dir=IMAGES_DIR, class_reports_dir=CLASS_REPORTS_DIR, gradCAM_dir=GRADCAM_DIR, feature_cache=False, features_dir=FEATURES_DIR, 
+                        mixed_precision=False):
+    """
+    Function training a couple model/dataset, and performing its performance 
+    and gradCAM analysis. The parameters are the ones of 'discriminate', for 
+    a single model and dataset.
+    Return: the training history of the model.
+    """
+
+    # Create model directory
+    model_dir = f'{models_save_dir}/{model_name}'
+    if not Path(model_dir).exists(): os.makedirs(model_dir, exist_ok=True)
+
+    # Setup the loss fxn
+    criterion = nn.CrossEntropyLoss()
+
+    print('~ ' * 10)
+    print(f'Dataset: {ds_dir}')
+    data_dir, manifest = get_data_dir(images_dir, ds_dir)
+
+    print('Model initialization ...', end=' ')
+    # Initialize the model
+    model, input_size = initialize_model(model_name, num_classes, False)
+    print(f'done')
+
+    print('Dataloader creation ...', end=' ')
+    # Create training and validation dataloaders
+    dataloaders_dict, datasets_dict = create_dataloaders(data_dir, input_size, batch_size, manifest)
+    print('done')
+
+    if feature_cache:
+        print('Features caching ...', end=' ')
+        ds_name = get_ds_name(ds_dir)
+        features_dataloaders, head = create_feature_dataloaders(model, model_name, datasets_dict, f'{features_dir}/{model_name}-{ds_name}', batch_size, device)
+        print('done')
+
+        # Only the head is trained, sharing its parameters with the model
+        optimizer = optim.SGD(head.parameters(), lr=0.001, momentum=0.9)
+
+        print('Training ...')
+        _, hist = train_model(head, features_dataloaders, criterion, optimizer, num_epochs=num_epochs, device=device, mixed_precision=mixed_precision)
+        model = model.to(device)
+    else:
+        # Observe that all parameters are being optimized
+        optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9)
+
+        print('Training ...')
+        # Train and evaluate
+        model, hist = train_model(model, dataloaders_dict, criterion, optimizer, num_epochs=num_epochs, is_inception=(model_name=="inception"), device=device, mixed_precision=mixed_precision)
+
+    report_model(model, model_name, ds_dir, dataloaders_dict, datasets_dict, model_dir, class_report, gradCAM_analysis, device, display_reports, class_reports_dir, gradCAM_dir, mixed_precision)
+
+    return hist
+
 def discriminate(models_names, ds_dirs, num_classes, num_epochs=30, batch_size=32, class_report=True, gradCAM_analysis=False, device=DEVICE, display_reports=True, 
-                 models_save_dir=MODELS_SAVE_DIR, images_dir=IMAGES_DIR, class_reports_dir=CLASS_REPORTS_DIR, gradCAM_dir=GRADCAM_DIR):
+                 models_save_dir=MODELS_SAVE_DIR, images_dir=IMAGES_DIR, class_reports_dir=CLASS_REPORTS_DIR, gradCAM_dir=GRADCAM_DIR, feature_cache=False, features_dir=FEATURES_DIR, sweep=False, 
+                 mixed_precision=False):
     """
     Function taining couples model/dataset, performing performance and 
     gradCAM analysis and collecting training histories per model.
     Parameters:
         - 'model_names': a list. The list of the models names to train ;
         - 'ds_dirs': a list. The list of the datasets names to use for 
-                     training ;
+                     training. A name ending with '.csv' is read as a 
+                     manifest created by 'create_dataset' ;
         - 'num_classes': int. The number of class to identify ;
         - 'num_epochs': int, optional. The number of epochs to train the 
                         models. Default to 30 ;
@@ -830,10 +2088,73 @@ def discriminate(models_names, ds_dirs, num_classes, num_epochs=30, batch_size=3
                                Default to CLASS_REPORTS_DIR ;
         - 'gradCAM_dir': a string or pathlib.Path object, optional. The 
                          directory where to save the gradCAMs analysis. 
-                         Default to GRADCAM_DIR.
+                         Default to GRADCAM_DIR ;
+        - 'feature_cache': a boolean, optional. Whether to run the frozen 
+                           trunk of the models only once per dataset, caching 
+                           its features, and to train only the heads from the 
+                           cache. Images are then not augmented, and the 
+                           auxiliary head of inception is not trained. Default 
+                           to False ;
+        - 'features_dir': a string or pathlib.Path object, optional. The 
+                          directory where to cache the features. Default to 
+                          FEATURES_DIR ;
+        - 'sweep': a boolean, optional. Whether to train the models accepting 
+                   the same input size together on each dataset, each batch 
+                   being loaded once for all of them. Ignored with 
+                   'feature_cache'. Default to False ;
+        - 'mixed_precision': boolean, optional. Whether to train the models 
+                             and predict the labels of the classification 
+                             reports in bfloat16 under autocast. Default to 
+                             False.
     Retturn: None
     """
     
+    # Setup the loss fxn
+    criterion = nn.CrossEntropyLoss()
+
+    if sweep and not feature_cache:
+        hists = {model_name: [] for model_name in models_names}
+
+        for ds_dir in ds_dirs:
+            print('~ ' * 10)
+            print(f'Dataset: {ds_dir}')
+            data_dir, manifest = get_data_dir(images_dir, ds_dir)
+
+            print('Models initialization ...', end=' ')
+            # Group the models by input size, to share their dataloaders
+            groups = {}
+            for model_name in models_names:
+                model, input_size = initialize_model(model_name, num_classes, False)
+                groups.setdefault(input_size, []).append((model_name, model))
+            print('done')
+
+            for input_size, group in groups.items():
+                group_names = [model_name for model_name, _ in group]
+                print(f'Models: {", ".join(group_names)}')
+
+                print('Dataloader creation ...', end=' ')
+                dataloaders_dict, datasets_dict = create_dataloaders(data_dir, input_size, batch_size, manifest)
+                print('done')
+
+                models_list = [model for _, model in group]
+                optimizers = [optim.SGD(model.parameters(), lr=0.001, momentum=0.9) for model in models_list]
+
+                print('Training ...')
+                models_list, group_hists = train_models(models_list, dataloaders_dict, criterion, optimizers, num_epochs=num_epochs, device=device, is_inception=[model_name == "inception" for model_name in group_names], mixed_precision=mixed_precision)
+
+                for model_name, model, hist in zip(group_names, models_list, group_hists):
+                    model_dir = f'{models_save_dir}/{model_name}'
+                    if not Path(model_dir).exists(): os.mkdir(model_dir)
+
+                    report_model(model, model_name, ds_dir, dataloaders_dict, datasets_dict, model_dir, class_report, gradCAM_analysis, device, display_reports, class_reports_dir, gradCAM_dir, mixed_precision)
+                    hists[model_name] += hist
+
+        # Save the histories
+        for model_name in models_names:
+            save_hists(hists[model_name], f'{models_save_dir}/{model_name}/hists.csv')
+
+        return
+
     for model_name in models_names:
         print('\n' + '- ' * 10)
         print(f'Model {model_name}')
@@ -844,58 +2165,157 @@ def discriminate(models_names, ds_dirs, num_classes, num_epochs=30, batch_size=3
         if not Path(model_dir).exists(): os.mkdir(model_dir)
 
         for ds_dir in ds_dirs:
-            print('~ ' * 10)
-            print(f'Dataset: {ds_dir}')
-            data_dir = f'{images_dir}/{ds_dir}'
+            hist = discriminate_couple(model_name, ds_dir, num_classes, num_epochs, batch_size, class_report, gradCAM_analysis, device, display_reports, 
+                                       models_save_dir, images_dir, class_reports_dir, gradCAM_dir, feature_cache, features_dir, mixed_precision)
 
-            print('Model initialization ...', end=' ')
-            # Initialize the model
-            model, input_size = initialize_model(model_name, num_classes, False)
-            print(f'done')
+            hists += hist
+        
+        # Save the histories
+        save_hists(hists, f'{model_dir}/hists.csv')
 
-            print('Dataloader creation ...', end=' ')
-            # Create training and validation dataloaders
-            dataloaders_dict, datasets_dict = create_dataloaders(data_dir, input_size, batch_size)
-            print('done')
+def get_job_hists_path(models_save_dir, model_name, ds_dir):
+    """
+    Function giving the path where a job of 'schedule_discriminate' saves the 
+    training history of a couple model/dataset.
+    Parameters:
+        - 'models_save_dir': a string or pathlib.Path object. The directory 
+                             where the trained models are saved ;
+        - 'model_name': a string. The name of the model ;
+        - 'ds_dir': a string. The name of the dataset.
+    Return: the path to the history file.
+    """
 
-            # Observe that all parameters are being optimized
-            optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9)
+    return f'{models_save_dir}/{model_name}/{model_name}-{get_ds_name(ds_dir)}-hists.csv'
 
-            # Setup the loss fxn
-            criterion = nn.CrossEntropyLoss()
+def run_discriminate_job(model_name, ds_dir, num_threads, **kwargs):
+    """
+    Function running a job of 'schedule_discriminate' in a worker process: 
+    train a couple model/dataset with a fixed number of threads, and save its 
+    training history. The history is written last, so that it marks the job 
+    as done.
+    Parameters:
+        - 'model_name': a string. The name of the model ;
+        - 'ds_dir': a string. The name of the dataset ;
+        - 'num_threads': int. The number of threads used by Pytorch ;
+        - other keyword arguments are passed to 'discriminate_couple'.
+    Return: the path to the history file.
+    """
 
-            print('Training ...')
-            # Train and evaluate
-            model, hist = train_model(model, dataloaders_dict, criterion, optimizer, num_epochs=num_epochs, is_inception=(model_name=="inception"), device=device)
+    torch.set_num_threads(num_threads)
 
-            # Save the model
-            ds_name = ds_dir.replace("/", "_")
-            save_name = f'{model_name}-{ds_name}.pth'
-            save_path = f'{model_dir}/{save_name}'
+    hist = discriminate_couple(model_name, ds_dir, **kwargs)
 
-            torch.save(model.state_dict(), save_path)
-            print(f'Saved PyTorch Model State to: {save_path}')
+    # Write to a temporary file first, so that an interrupted job is never 
+    # taken as done
+    hists_path = get_job_hists_path(kwargs['models_save_dir'], model_name, ds_dir)
+    save_hists(hist, f'{hists_path}.tmp')
+    os.replace(f'{hists_path}.tmp', hists_path)
 
-            if class_report:
-                print('Classification report creation ...', end=' ')
-                # Evaluate the model on the tests set and save the evaluation report
-                model_report(model, dataloaders_dict['test'], datasets_dict['test'], model_name, ds_dir, class_reports_dir, device, display_reports)
-                print('done')
+    return hists_path
 
-            if gradCAM_analysis:
-                print('gradCAMs explainability ...', end=' ')
-                # gradCAMs
-                proceed_gradCAMs(model, dataloaders_dict['test'], datasets_dict['test'], model_name, ds_dir, device, gradCAM_dir, display_reports)
-                print('done')
+def schedule_discriminate(models_names, ds_dirs, num_classes, n_jobs=2, num_threads=None, num_epochs=30, batch_size=32, class_report=True, gradCAM_analysis=False, device=DEVICE, 
+                          models_save_dir=MODELS_SAVE_DIR, images_dir=IMAGES_DIR, class_reports_dir=CLASS_REPORTS_DIR, gradCAM_dir=GRADCAM_DIR, feature_cache=False, features_dir=FEATURES_DIR, 
+                          mixed_precision=False):
+    """
+    Function training the couples model/dataset like 'discriminate', but 
+    spreading them across worker processes, each one using a fixed number of 
+    threads. The histories of the couples already trained are kept, so that 
+    running the function again after a crash only trains the remaining ones.
+    Once every datasets of a model are trained, its histories are collected 
+    in its 'hists.csv' file, as 'discriminate' does.
+    Parameters:
+        - 'model_names': a list. The list of the models names to train ;
+        - 'ds_dirs': a list. The list of the datasets names to use for 
+                     training ;
+        - 'num_classes': int. The number of class to identify ;
+        - 'n_jobs': int, optional. The number of worker processes. Default to 
+                    2 ;
+        - 'num_threads': int, optional. The number of threads used by each 
+                         worker. If None, the CPUs are shared between the 
+                         workers. Default to None ;
+        - the other parameters are the ones of 'discriminate'. The reports 
+          are never displayed.
+    Return: None.
+    """
 
-            hists += hist
-        
-        # Save the histories
-        save_hists(hists, f'{model_dir}/hists.csv')
+    if num_threads is None: num_threads = max(1, os.cpu_count() // n_jobs)
+
+    kwargs = {
+        'num_classes': num_classes,
+        'num_epochs': num_epochs,
+        'batch_size': batch_size,
+        'class_report': class_report,
+        'gradCAM_analysis': gradCAM_analysis,
+        'device': device,
+        'display_reports': False,
+        'models_save_dir': models_save_dir,
+        'images_dir': images_dir,
+        'class_reports_dir': class_reports_dir,
+        'gradCAM_dir': gradCAM_dir,
+        'feature_cache': feature_cache,
+        'features_dir': features_dir,
+        'mixed_precision': mixed_precision,
+    }
+
+    # Only run the jobs whose history is missing
+    jobs = [(model_name, ds_dir) for model_name in models_names for ds_dir in ds_dirs]
+    todo = [job for job in jobs if not Path(get_job_hists_path(models_save_dir, *job)).exists()]
+
+    print(f'jobs = {len(jobs)}', f'done = {len(jobs) - len(todo)}', f'workers = {n_jobs}', f'threads = {num_threads}', sep='\t')
+
+    # Spawn the workers, as forking a process using Pytorch threads may hang
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(run_discriminate_job, model_name, ds_dir, num_threads, **kwargs): (model_name, ds_dir) for model_name, ds_dir in todo}
 
-def predict(model, dataloader, device=DEVICE):
+        for future in as_completed(futures):
+            model_name, ds_dir = futures[future]
+            try:
+                future.result()
+                print(f'{model_name} - {ds_dir}: done')
+            except Exception as e:
+                print(f'{model_name} - {ds_dir}: failed ({e!r})')
+
+    # Collect the histories of the models, in the order of the datasets
+    for model_name in models_names:
+        hists_paths = [get_job_hists_path(models_save_dir, model_name, ds_dir) for ds_dir in ds_dirs]
+
+        if all(Path(hists_path).exists() for hists_path in hists_paths):
+            hists = [hist for hists_path in hists_paths for hist in load_hists(hists_path)]
+            save_hists(hists, f'{models_save_dir}/{model_name}/hists.csv')
+
+def sequential_dataloader(dataloader):
+    """
+    Function giving a dataloader supplying the images of 'dataloader' in the 
+    order of its dataset, instead of in a random order.
+    Parameter:
+        - 'dataloader': a torch.utils.data.Dataloader object. The dataloader, 
+                        as created by 'create_dataloader' or 
+                        'create_feature_dataloaders'.
+    Return: the dataloader itself if it doesn't shuffle, else a new 
+            dataloader with the same dataset and batch size.
     """
-    Function which use a model to predict labels.
+
+    sampler = dataloader.sampler
+
+    # Batches sampled by a BatchSampler, as in 'create_feature_dataloaders'
+    if isinstance(sampler, torch.utils.data.BatchSampler) and isinstance(sampler.sampler, torch.utils.data.RandomSampler):
+        sampler = torch.utils.data.BatchSampler(torch.utils.data.SequentialSampler(dataloader.dataset), sampler.batch_size, sampler.drop_last)
+        return torch.utils.data.DataLoader(dataloader.dataset, batch_size=None, sampler=sampler, num_workers=dataloader.num_workers, 
+                                           collate_fn=dataloader.collate_fn, pin_memory=dataloader.pin_memory)
+
+    if isinstance(sampler, torch.utils.data.RandomSampler):
+        return torch.utils.data.DataLoader(dataloader.dataset, batch_size=dataloader.batch_size, shuffle=False, num_workers=dataloader.num_workers, 
+                                           collate_fn=dataloader.collate_fn, pin_memory=dataloader.pin_memory, drop_last=dataloader.drop_last)
+
+    return dataloader
+
+def predict(model, dataloader, device=DEVICE, mixed_precision=False, return_probs=False, save_dir=None):
+    """
+    Function which use a model to predict labels. The model is run in 
+    evaluation mode under inference mode, and the results are written batch 
+    per batch into arrays allocated once. The images are predicted in the 
+    order of the dataset, even if 'dataloader' shuffles them, so that the 
+    i-th result is the one of the i-th image of the dataset.
     Parameters:
         - 'model': a troch.Model object. The model to use to make predictions ;
         - 'dataloader': a torch.utils.data.Dataloader object. The dataloader 
@@ -903,32 +2323,79 @@ def predict(model, dataloader, device=DEVICE):
         - 'device': string, optional. The device (cuda or cpu) to use to 
                     train the model. Default to the device detected by the 
                     script ;
-    Return: the list of the true labels and the list of the predicted ones.
+        - 'mixed_precision': boolean, optional. Whether to run the model in 
+                             bfloat16 under autocast. Default to False ;
+        - 'return_probs': boolean, optional. Whether to also return the 
+                          probabilities of the classes. Default to False ;
+        - 'save_dir': a string or pathlib.Path object, optional. The directory 
+                      where to stream the results, as memory-mapped 'y_true', 
+                      'y_pred' and 'probs' '.npy' files, so that they don't 
+                      need to fit in memory. The paths of the images, when 
+                      the dataset has them, are written in 'paths.csv', in 
+                      the same order. If None, the results are kept in 
+                      memory. Default to None.
+    Return: the array of the true labels and the array of the predicted ones, 
+            and the array of the probabilities if 'return_probs'.
     """
 
-    preds = []
-    y_test = []
+    dataloader = sequential_dataloader(dataloader)
+    num_images = len(dataloader.dataset)
 
-    model = model.to(device)
+    def allocate(name, dtype, shape):
+        """
+        Allocate an array of results, in memory or in a memory-mapped file.
+        Parameters:
+            - 'name': string. The name of the results ;
+            - 'dtype': numpy dtype. The type of the results ;
+            - 'shape': tuple. The shape of the array.
+        Return: the array.
+        """
 
-    # Make predictions on test set
-    for X, Y in dataloader:
-        X_test = X.to(device)
-        y_test.append(Y)
-        with torch.set_grad_enabled(False):
-            pred = model(X_test)
-        if isinstance(pred, torch.Tensor): preds.append(pred)
-        else: preds.append(pred.logits)
+        if save_dir is None: return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(f'{save_dir}/{name}.npy', mode='w+', dtype=dtype, shape=shape)
 
-    y_test = torch.cat(y_test, dim=0)
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
 
-    preds = torch.cat(preds, dim=0)
-    _, y_pred = torch.max(preds, 1)
+        # Identify the rows of the results
+        if hasattr(dataloader.dataset, 'imgs'):
+            df_paths = pd.DataFrame([str(path) for path, _ in dataloader.dataset.imgs], columns=['path'])
+            df_paths.to_csv(f'{save_dir}/paths.csv', index_label='index')
 
-    # Convert lists of tensors to list of integers
-    y_test = [int(y.cpu().numpy()) for y in y_test]
-    y_pred = [int(y.cpu().numpy()) for y in y_pred]
+    y_test = allocate('y_true', np.int64, (num_images,))
+    y_pred = allocate('y_pred', np.int64, (num_images,))
+    # The number of classes is known at the first batch
+    probs = None
 
+    model = model.to(device)
+    was_training = model.training
+    model.eval()
+
+    # Make predictions on test set
+    start = 0
+    try:
+        with torch.inference_mode(), mixed_precision_context(device, mixed_precision):
+            for X, Y in dataloader:
+                pred = model(X.to(device, non_blocking=True))
+                if not isinstance(pred, torch.Tensor): pred = pred.logits
+
+                batch_probs = torch.softmax(pred.float(), dim=1)
+                stop = start + len(Y)
+
+                if probs is None: probs = allocate('probs', np.float32, (num_images, batch_probs.shape[1]))
+
+                probs[start:stop] = batch_probs.cpu().numpy()
+                y_pred[start:stop] = batch_probs.argmax(dim=1).cpu().numpy()
+                y_test[start:stop] = Y.numpy()
+                start = stop
+    finally:
+        model.train(was_training)
+
+    if save_dir is not None:
+        for array in [y_test, y_pred, probs]:
+            if array is not None: array.flush()
+
+    if return_probs: return y_test, y_pred, probs
     return y_test, y_pred
 
 def plot_histories(model_names, ds_dirs, root_dir=DATA_DIR, save_dir=None, display_img=True):
@@ -0,0 +1,374 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# The MIT License (MIT)
+# Copyright (c) 2023 Thomas DUMAZERT
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
+# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+# OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# ----------------------------------------------
+# | script: score_images.py                    |
+# | author: Thomas DUMAZERT                    |
+# | creation: 10/18/2026                       |
+# | last modified: 10/18/2026                  |
+# ----------------------------------------------
+
+# This module is intended to score a whole directory tree of images, or the
+# images of a manifest, with a trained model, from the command line. Images
+# are decoded by a pool of threads and supplied to the model by batches, and
+# the top-k probabilities of each image are written to a csv file.
+# An interrupted run is resumed by running the same command again.
+#
+# Usage:
+#   python score_images.py SOURCE OUTPUT.csv --framework torch --model-name vgg
+#          --weights vgg-balanced.pth --num-classes 10
+#   python score_images.py SOURCE OUTPUT.csv --framework keras --model-name FTvgg16
+#          --weights VGG16_model_weights_18MAR23-1_FT.h5
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# External libraries
+
+import argparse
+import numpy as np
+import pandas as pd
+import os
+from pathlib import Path
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+# Import custom scripts
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from scripts.bcc_utilities import file_is_a
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Constants
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp']
+
+# Keras fine-tuned models of the Streamlit app, and the module handling them
+KERAS_MODELS = {
+    'FTvgg16': 'FTvgg16_utils',
+    'FTmobilenetV2': 'FTmobilenetV2_utils',
+}
+STREAMLIT_UTILS_DIR = Path(__file__).resolve().parents[1] / 'streamlit_app'
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Class
+
+class TorchScorer:
+    def __init__(self, model_name, weights_path, num_classes, device=None):
+        """
+        Initialize instance. A scorer running a model trained by
+        'dl_utilities.discriminate', loaded with 'dl_utilities.load_model'.
+        Parameters:
+            - 'model_name': string. The name of the model, as in
+                            'dl_utilities.initialize_model' ;
+            - 'weights_path': a string or pathlib.Path object. The path to the
+                              saved state of the model ;
+            - 'num_classes': int. The number of classes of the model ;
+            - 'device': string, optional. The device on which to run the
+                        model. If None, the device detected by
+                        'dl_utilities'. Default to None.
+        Return: None
+        """
+
+        import torch
+        from torchvision import transforms
+        from scripts import dl_utilities as dlu
+
+        self.torch = torch
+        self.device = dlu.DEVICE if device is None else torch.device(device)
+
+        self.model, input_size = dlu.load_model(model_name, weights_path, num_classes)
+        self.model = self.model.to(self.device)
+        self.model.eval()
+
+        # Same transformations as the test set of 'create_dataloaders'
+        self.transform = transforms.Compose([
+            transforms.Resize(input_size),
+            transforms.CenterCrop(input_size),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+
+    def load(self, path):
+        """
+        Decode an image and transform it to the input of the model.
+        Parameter:
+            - 'path': string. The path to the image.
+        Return: the transformed image, as a tensor.
+        """
+
+        return self.transform(Image.open(path).convert('RGB'))
+
+    def score(self, images):
+        """
+        Compute the probabilities of the classes of a batch of images.
+        Parameter:
+            - 'images': list. The images returned by 'load'.
+        Return: the probabilities, as an array of shape (n_images, n_classes).
+        """
+
+        with self.torch.inference_mode():
+            outputs = self.model(self.torch.stack(images).to(self.device))
+            return self.torch.softmax(outputs.float(), dim=1).cpu().numpy()
+
+class KerasScorer:
+    def __init__(self, model_name, weights_path=None):
+        """
+        Initialize instance. A scorer running one of the fine-tuned Keras
+        models of the Streamlit app, with the same preprocessing as the demo.
+        Parameters:
+            - 'model_name': string. The name of the model, one of
+                            KERAS_MODELS ;
+            - 'weights_path': a string or pathlib.Path object, optional. The
+                              path to the weights of the model. Required by
+                              FTvgg16, ignored by FTmobilenetV2, whose model
+                              file is fixed by the app. Default to None.
+        Return: None
+        """
+
+        if model_name not in KERAS_MODELS:
+            raise AttributeError(f"'model_name' must be one of {list(KERAS_MODELS)}, here {model_name}")
+
+        import importlib
+        sys.path.append(str(STREAMLIT_UTILS_DIR))
+        self.utils = importlib.import_module(f'utils.{KERAS_MODELS[model_name]}')
+
+        if model_name == 'FTvgg16':
+            if weights_path is None: raise AttributeError("'weights_path' is required by FTvgg16")
+            self.model = self.utils.load_ft_vgg16(str(weights_path))
+        else:
+            self.model = self.utils.load_model()
+
+        self.size = (self.utils.img_height, self.utils.img_width)
+        self.classes = self.utils.classes
+
+    def load(self, path):
+        """
+        Decode an image and resize it to the input of the model.
+        Parameter:
+            - 'path': string. The path to the image.
+        Return: the resized image, as an array.
+        """
+
+        return np.asarray(Image.open(path).convert('RGB').resize(self.size), dtype=np.float32)
+
+    def score(self, images):
+        """
+        Compute the probabilities of the classes of a batch of images.
+        Parameter:
+            - 'images': list. The images returned by 'load'.
+        Return: the probabilities, as an array of shape (n_images, n_classes).
+        """
+
+        batch = self.utils.preprocess_input(np.stack(images))
+        # Calling the model avoids the per call overhead of 'predict'
+        return np.asarray(self.model(batch, training=False))
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Functions
+
+def list_images(source, split=None):
+    """
+    Function listing the images to score.
+    Parameters:
+        - 'source': a string or pathlib.Path object. A directory, whose tree
+                    is walked, or a csv manifest with a 'path' column,
+                    relative to the manifest directory, like the ones created
+                    by 'create_dataset'. The augmented images of a manifest
+                    are skipped ;
+        - 'split': string, optional. The set of the manifest to score. If
+                   None, all of them. Default to None.
+    Return: the sorted list of the paths of the images.
+    """
+
+    source = Path(source)
+
+    if source.is_dir():
+        return sorted(str(Path(root) / f) for root, _, files in os.walk(source) for f in files if file_is_a(f.lower(), IMAGE_EXTENSIONS))
+
+    df_manifest = pd.read_csv(source)
+    if split is not None: df_manifest = df_manifest[df_manifest['split'] == split]
+    if 'aug_index' in df_manifest.columns: df_manifest = df_manifest[df_manifest['aug_index'] == 0]
+
+    return sorted({str(source.parent / p) for p in df_manifest['path']})
+
+def manifest_classes(source):
+    """
+    Function giving the classes of a manifest, indexed like
+    'dl_utilities.ManifestDataset' does.
+    Parameter:
+        - 'source': a string or pathlib.Path object. The directory or manifest
+                    to score.
+    Return: the list of the classes names, or None if 'source' is not a
+            manifest with labels.
+    """
+
+    if Path(source).is_dir(): return None
+
+    df_manifest = pd.read_csv(source)
+    if 'label' not in df_manifest.columns: return None
+
+    return sorted(df_manifest['label'].unique())
+
+def check_output(output):
+    """
+    Function checking that the results can be written to the output file,
+    before any image is scored. Only csv is supported, so that no parquet
+    engine is required.
+    Parameter:
+        - 'output': a string or pathlib.Path object. The output file.
+    Return: None
+    """
+
+    if not str(output).endswith('.csv'):
+        raise AttributeError(f"'output' must be a csv file, here {output}")
+
+def load_done(output):
+    """
+    Function listing the images already scored by an interrupted run. A line
+    partially written when the run was interrupted is removed.
+    Parameter:
+        - 'output': a string or pathlib.Path object. The csv file of the
+                    interrupted run.
+    Return: the set of the paths of the images already scored.
+    """
+
+    if not Path(output).exists(): return set()
+
+    with open(output, 'rb+') as f:
+        content = f.read()
+        f.truncate(content.rfind(b'\n') + 1)
+
+    if Path(output).stat().st_size == 0: return set()
+
+    return set(pd.read_csv(output, usecols=['path'])['path'])
+
+def score_images(scorer, paths, output, classes, top_k=3, batch_size=32, n_jobs=8):
+    """
+    Function scoring images by batches, and writing the top-k probabilities
+    of each image. The results of each batch are appended and flushed to the
+    output, so that an interrupted run can be resumed: the images already
+    scored are skipped.
+    Parameters:
+        - 'scorer': a TorchScorer or KerasScorer object. The model to use ;
+        - 'paths': list of strings. The paths to the images to score ;
+        - 'output': a string or pathlib.Path object. The csv output file ;
+        - 'classes': list of strings. The names of the classes of the model ;
+        - 'top_k': int, optional. The number of most probable classes to
+                   write per image. Default to 3 ;
+        - 'batch_size': int, optional. The number of images supplied to the
+                        model at once. Default to 32 ;
+        - 'n_jobs': int, optional. The number of threads decoding the images.
+                    Default to 8.
+    Return: the path to the output file.
+    """
+
+    check_output(output)
+    done = load_done(output)
+    todo = [p for p in paths if p not in done]
+
+    print(f'images = {len(paths)}', f'done = {len(done)}', f'todo = {len(todo)}', sep='\t')
+
+    columns = ['path'] + [f'{c}_{k}' for k in range(1, top_k+1) for c in ['class', 'prob']]
+    write_header = len(done) == 0
+    classes = np.asarray(classes)
+
+    with open(output, 'w' if write_header else 'a') as f, ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        if write_header: f.write(','.join(columns) + '\n')
+
+        batches = [todo[i:i+batch_size] for i in range(0, len(todo), batch_size)]
+        # Decode the next batch while the model scores the current one
+        next_images = executor.map(scorer.load, batches[0]) if batches else None
+
+        for i, batch in enumerate(batches):
+            images = list(next_images)
+            if i + 1 < len(batches): next_images = executor.map(scorer.load, batches[i+1])
+
+            probs = scorer.score(images)
+            top = np.argsort(-probs, axis=1)[:, :top_k]
+            top_probs = np.take_along_axis(probs, top, axis=1)
+
+            df_batch = pd.DataFrame({'path': batch})
+            for k in range(top.shape[1]):
+                df_batch[f'class_{k+1}'] = classes[top[:, k]]
+                df_batch[f'prob_{k+1}'] = top_probs[:, k]
+
+            df_batch.to_csv(f, header=False, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+            print(f'{min((i+1) * batch_size, len(todo))}/{len(todo)}', end='\r')
+
+    return output
+
+def parse_args(args=None):
+    """
+    Function parsing the command line arguments.
+    Parameter:
+        - 'args': list of strings, optional. The arguments. If None, the ones
+                  of the command line. Default to None.
+    Return: the parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Score a directory tree or a manifest of images with a trained model.')
+    parser.add_argument('source', help='directory to walk, or csv manifest with a "path" column')
+    parser.add_argument('output', help='csv file where to write the results')
+    parser.add_argument('--framework', choices=['torch', 'keras'], required=True)
+    parser.add_argument('--model-name', required=True, help=f'torchvision model name of dl_utilities, or one of {list(KERAS_MODELS)}')
+    parser.add_argument('--weights', help='path to the weights of the model')
+    parser.add_argument('--num-classes', type=int, default=10, help='number of classes of a torch model')
+    parser.add_argument('--classes', help='comma separated names of the classes, in the order of the model outputs')
+    parser.add_argument('--split', help='set of the manifest to score')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n-jobs', type=int, default=8, help='number of decoding threads')
+    parser.add_argument('--device', help='device of a torch model')
+
+    return parser.parse_args(args)
+
+def main(args=None):
+    """
+    Function scoring images from the command line.
+    Parameter:
+        - 'args': list of strings, optional. The arguments. If None, the ones
+                  of the command line. Default to None.
+    Return: None
+    """
+
+    args = parse_args(args)
+    check_output(args.output)
+
+    if args.framework == 'torch':
+        if args.weights is None: raise AttributeError("'--weights' is required by torch models")
+        scorer = TorchScorer(args.model_name, args.weights, args.num_classes, args.device)
+        classes = manifest_classes(args.source) or [str(i) for i in range(args.num_classes)]
+    else:
+        scorer = KerasScorer(args.model_name, args.weights)
+        classes = scorer.classes
+
+    if args.classes is not None: classes = args.classes.split(',')
+
+    paths = list_images(args.source, args.split)
+    score_images(scorer, paths, args.output, classes, args.top_k, args.batch_size, args.n_jobs)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Main
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ import config
 
 # TODO : you can (and should) rename and add tabs in the ./tabs folder, and import them here.
 from tabs import intro, eda, model, results, demo, conclu, gallery
+from utils import model_registry
 
 
 st.set_page_config(
@@ -66,6 +67,10 @@ def run():
     for member in config.TEAM_MEMBERS:
         st.sidebar.markdown(member.sidebar_markdown(), unsafe_allow_html=True)
 
+    # Charge et préchauffe les modèles une fois par processus, au démarrage
+    with st.spinner("Chargement des modèles ..."):
+        model_registry.warm_up_models()
+
     tab = TABS[tab_name]
 
     tab.run()
@@ -13,6 +13,7 @@ from utils import utils_demo
 #from utils import Conv2Net_utils
 from utils import FTvgg16_utils
 from utils import FTmobilenetV2_utils
+from utils import model_registry
 
 title = "Démonstration"
 sidebar_name = "Démonstration"
@@ -88,9 +89,9 @@ def run():
     #    p2 = Conv2Net_utils.print_proba(sorted_preds[2])
         
     if model_choice == "Fine-tuned VGG16":
-        # Importe le modèle (en cache)
+        # Importe le modèle (chargé une fois par processus)
         #model = FTvgg16_utils.load_model()
-        model = FTvgg16_utils.load_ft_vgg16('streamlit_app/data/models/FTvgg16/VGG16_model_weights_18MAR23-1_FT.h5')
+        model, model_stats = model_registry.get_model(model_choice)
         # Prédiction + Grad-CAM
         fig, sorted_classes, sorted_preds = FTvgg16_utils.FTvgg16_prediction(model, img_file)
         p0 = FTvgg16_utils.print_proba(sorted_preds[0])
@@ -98,8 +99,8 @@ def run():
         p2 = FTvgg16_utils.print_proba(sorted_preds[2])
 
     if model_choice == "Fine-tuned MobileNet V2":
-        # Importe le modèle (en cache)
-        model = FTmobilenetV2_utils.load_model()
+        # Importe le modèle (chargé une fois par processus)
+        model, model_stats = model_registry.get_model(model_choice)
         # Prédiction + Grad-CAM
         fig, sorted_classes, sorted_preds = FTmobilenetV2_utils.FTmobilenetV2_prediction(model, img_file)
         p0 = FTmobilenetV2_utils.print_proba(sorted_preds[0])
@@ -131,4 +132,7 @@ def run():
             st.subheader(sorted_classes[0] +' (%s)'%(p0))
             st.pyplot(fig)
 
+    st.caption('Modèle chargé en %.1f s (préchauffage %.1f s), %.0f Mo, %d paramètres' % (
+        model_stats['load_time_s'], model_stats['warmup_time_s'], model_stats['memory_mb'], model_stats['params']))
+
 
@@ -24,6 +24,8 @@ from PIL import Image
 
 from time import time
 
+from utils.gradcam_utils import make_heatmap, predict_and_explain
+
 ## PARAMETERS
 
 batch_size = 32
@@ -37,41 +39,19 @@ label_map = {'Artefact': 0, 'Basophil': 1, 'Eosinophil': 2, 'Erythrocyte': 3, 'I
 
 
 # Load model :
-@st.cache_resource()
-def load_model():
+def build_model():
+    """
+    Charge le MobileNet V2 fine-tuné. Sans cache : utiliser load_model ou le 
+    registre des modèles (model_registry).
+    """
     model = tf.keras.models.load_model('streamlit_app/data/models/FTmobilenet/MobileNetV2_model_20MAR23-1_FT.h5')
     model.summary()
     return model
 
-
-def make_heatmap(img_array, model, last_conv_layer, class_index):
-
-    # Désactive softmax :
-    model.layers[-1].activation = None
-    
-    t_temp = time()
-    grad_model = tf.keras.models.Model([model.inputs], [last_conv_layer.output, model.output])
-    with tf.GradientTape() as tape:
-        last_conv_layer_output, preds = grad_model(img_array)
-        class_channel = preds[:, class_index]
-    print("makeheatmap - prediction :",time()-t_temp)
-    
-    t_temp = time()
-    grads = tape.gradient(class_channel, last_conv_layer_output)
-    pooled_grads = tf.reduce_mean(grads, axis = (0, 1, 2))
-    print("makeheatmap - tapegradient :", time()-t_temp)
-    
-    heatmap_tmp = last_conv_layer_output[0].numpy()
-
-    # Multiplie chaque carte d'activation par le gradient, puis moyenne
-    for i in range(last_conv_layer_output.shape[3]):
-        heatmap_tmp[:,:,i] *= pooled_grads[i]
-    heatmap = np.mean(heatmap_tmp, axis=-1)
-    
-    # Réactive softmax :
-    model.layers[-1].activation = tf.keras.activations.softmax
-    
-    return heatmap
+# Un seul chargement par processus, partagé entre les sessions
+@st.cache_resource()
+def load_model():
+    return build_model()
 
 
 def gradcam(model, img, img_orig, last_conv_layer,
@@ -141,37 +121,33 @@ def print_proba(proba):
     
     return str(np.round(proba*100, 2))+'%'
 
-def FTmobilenetV2_prediction(model,img_file):
-    
+def FTmobilenetV2_predict_explain(model, img_file, top_k=3):
+    """
+    Prédiction et Grad-CAM de la classe la plus probable, en une seule passe 
+    avant. Renvoie le dictionnaire de gradcam_utils.predict_and_explain, 
+    complété de l'image d'origine ('img_orig'), sans affichage.
+    """
+
     # Preprocessing de l'image
     img, img_orig = preprocessing(img_file, size = (img_height, img_width))
 
-    # Prediction :
-    preds = model.predict(img)[0]
-    
-    sorted_indexes = np.flip(np.argsort(preds))
-    sorted_preds = [preds[i] for i in sorted_indexes]
-    sorted_classes = [classes[i] for i in sorted_indexes]
-    
-    print("Sorted Indexes :",sorted_indexes[:3])
-    print("Shape :", len(sorted_indexes[:3]))
-    print("Type :", type(sorted_indexes[:3]))
+    result = predict_and_explain(model, img, classes, top_k)
+    result['img_orig'] = img_orig
+
+    return result
+
+def FTmobilenetV2_prediction(model,img_file):
     
-    # Détecte la dernière couche de convolution du modèle :
-    for layer in reversed(model.layers):
-        if 'conv' in layer.name:
-            last_conv_layer = model.get_layer(layer.name)
-            break     
+    # Prediction + Grad-CAM (une seule passe avant) :
+    result = FTmobilenetV2_predict_explain(model, img_file, top_k = len(classes))
+    sorted_classes = result['top_classes']
+    sorted_preds = list(result['top_probs'])
     
     # Grad-CAM :
     fig = plt.figure(figsize = (5,5))
        
-    ## Calcul de la heatmap:
-    heatmap = gradcam(model, img, img_orig, last_conv_layer,
-                      img_height, img_width, 
-                      class_index = sorted_indexes[0], alpha = 0.8)
     ## Traitement de la heatmap:
-    superimposed_img = print_gradcam(heatmap, img_orig, alpha = 0.8)
+    superimposed_img = print_gradcam(result['heatmap'], result['img_orig'], alpha = 0.8)
     
     ## Plot
     plt.imshow(superimposed_img)
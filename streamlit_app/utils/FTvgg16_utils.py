@@ -26,6 +26,8 @@ import matplotlib.cm as cm
 from PIL import Image
 
 from time import time
+
+from utils.gradcam_utils import make_heatmap, predict_and_explain
 import requests
 
 #python3 quickstart.py
@@ -66,14 +68,18 @@ label_map = {'Artefact': 0, 'Basophil': 1, 'Eosinophil': 2, 'Erythrocyte': 3, 'I
 #content = read_file(bucket_name, file_path)
 
 # Load model :
-@st.cache_resource()
+#@st.cache_resource()
 #def load_model():
 #    model = tf.keras.models.load_model('streamlit_app/data/models/FTvgg16/VGG16_model_18MAR23-1_FT.hdf5') #le fichier du modèle est trop lourd pour le github, il sera hébergé sur le GoogleDrive
 #    model.summary()
 #    return model
 
-@st.cache_resource()
-def load_ft_vgg16(saved_weights_path):
+def build_ft_vgg16(saved_weights_path):
+    """
+    Construit le VGG16 fine-tuné et charge ses poids. Sans cache : utiliser 
+    load_ft_vgg16 ou le registre des modèles (model_registry).
+    """
+
     height = 256
     width = 256
     height_crop = 180
@@ -110,43 +116,10 @@ def load_ft_vgg16(saved_weights_path):
 
     return model
 
-#taken from this StackOverflow answer: https://stackoverflow.com/a/39225039
+# Un seul chargement par processus, partagé entre les sessions
+@st.cache_resource()
 def load_ft_vgg16(saved_weights_path):
-    height = 256
-    width = 256
-    height_crop = 180
-    width_crop = 180
-    num_cat=10
-
-    data_preprocessing = Sequential(
-        [
-            layers.Resizing(height=height, width=width, interpolation='nearest', crop_to_aspect_ratio=False), # redimensionne un lot d'images à une taille cible.
-            layers.CenterCrop(height=height_crop, width=width_crop), #retourne une culture centrale d'un lot d'images
-            layers.Rescaling(scale=1./255), # remet à l' échelle et les décalages des valeurs d'un lot d'images 
-        ]
-    )
-
-    inputs = layers.Input(shape = (height, width, 3))
-    x = data_preprocessing(inputs)
-    base_model = VGG16(include_top = False,
-                        weights = 'imagenet',
-                        input_tensor = inputs,
-                        input_shape = (height_crop, width_crop, 3))
-    x = base_model.output
-    x = layers.GlobalAveragePooling2D()(x)
-    x = layers.Dense(1024, activation='relu')(x)
-    x = layers.Dropout(0.2)(x)
-    x = layers.Dense(256, activation='relu')(x)
-    outputs = layers.Dense(num_cat, activation='softmax')(x)
-    model = Model(inputs, outputs)
-
-    for layer in base_model.layers: 
-        layer.trainable = False
-    base_model.trainable = False
-
-    model.load_weights(saved_weights_path)
-
-    return model
+    return build_ft_vgg16(saved_weights_path)
 
 # @st.cache
 # def load_model():
@@ -166,36 +139,6 @@ def load_ft_vgg16(saved_weights_path):
 #    return model
 
 
-def make_heatmap(img_array, model, last_conv_layer, class_index):
-
-    # Désactive softmax :
-    model.layers[-1].activation = None
-    
-    t_temp = time()
-    grad_model = tf.keras.models.Model([model.inputs], [last_conv_layer.output, model.output])
-    with tf.GradientTape() as tape:
-        last_conv_layer_output, preds = grad_model(img_array)
-        class_channel = preds[:, class_index]
-    print("makeheatmap - prediction :",time()-t_temp)
-    
-    t_temp = time()
-    grads = tape.gradient(class_channel, last_conv_layer_output)
-    pooled_grads = tf.reduce_mean(grads, axis = (0, 1, 2))
-    print("makeheatmap - tapegradient :", time()-t_temp)
-    
-    heatmap_tmp = last_conv_layer_output[0].numpy()
-
-    # Multiplie chaque carte d'activation par le gradient, puis moyenne
-    for i in range(last_conv_layer_output.shape[3]):
-        heatmap_tmp[:,:,i] *= pooled_grads[i]
-    heatmap = np.mean(heatmap_tmp, axis=-1)
-    
-    # Réactive softmax :
-    model.layers[-1].activation = tf.keras.activations.softmax
-    
-    return heatmap
-
-
 def gradcam(model, img, img_orig, last_conv_layer,
             img_height, img_width, class_index, 
             alpha = 0.5):
@@ -263,37 +206,33 @@ def print_proba(proba):
     
     return str(np.round(proba*100, 2))+'%'
 
-def FTvgg16_prediction(model,img_file):
-    
+def FTvgg16_predict_explain(model, img_file, top_k=3):
+    """
+    Prédiction et Grad-CAM de la classe la plus probable, en une seule passe 
+    avant. Renvoie le dictionnaire de gradcam_utils.predict_and_explain, 
+    complété de l'image d'origine ('img_orig'), sans affichage.
+    """
+
     # Preprocessing de l'image
     img, img_orig = preprocessing(img_file, size = (img_height, img_width))
 
-    # Prediction :
-    preds = model.predict(img)[0]
-    
-    sorted_indexes = np.flip(np.argsort(preds))
-    sorted_preds = [preds[i] for i in sorted_indexes]
-    sorted_classes = [classes[i] for i in sorted_indexes]
-    
-    print("Sorted Indexes :",sorted_indexes[:3])
-    print("Shape :", len(sorted_indexes[:3]))
-    print("Type :", type(sorted_indexes[:3]))
+    result = predict_and_explain(model, img, classes, top_k)
+    result['img_orig'] = img_orig
+
+    return result
+
+def FTvgg16_prediction(model,img_file):
     
-    # Détecte la dernière couche de convolution du modèle :
-    for layer in reversed(model.layers):
-        if 'conv' in layer.name:
-            last_conv_layer = model.get_layer(layer.name)
-            break     
+    # Prediction + Grad-CAM (une seule passe avant) :
+    result = FTvgg16_predict_explain(model, img_file, top_k = len(classes))
+    sorted_classes = result['top_classes']
+    sorted_preds = list(result['top_probs'])
     
     # Grad-CAM :
     fig = plt.figure(figsize = (5,5))
        
-    ## Calcul de la heatmap:
-    heatmap = gradcam(model, img, img_orig, last_conv_layer,
-                      img_height, img_width, 
-                      class_index = sorted_indexes[0], alpha = 0.8)
     ## Traitement de la heatmap:
-    superimposed_img = print_gradcam(heatmap, img_orig, alpha = 0.8)
+    superimposed_img = print_gradcam(result['heatmap'], result['img_orig'], alpha = 0.8)
     
     ## Plot
     plt.imshow(superimposed_img)
@@ -0,0 +1,268 @@
+# Authors:
+# Hajer Souaifi-Amara
+# Creation date: 18OCT2026
+# Modification date: 18OCT2026
+
+import threading
+import weakref
+
+import numpy as np
+
+import tensorflow as tf
+
+
+def find_last_conv_layer(model):
+    """
+    Détecte la dernière couche de convolution du modèle.
+    """
+
+    for layer in reversed(model.layers):
+        if 'conv' in layer.name:
+            return model.get_layer(layer.name)
+
+    raise ValueError(f"Aucune couche de convolution dans le modèle {model.name}")
+
+
+class GradCAMExplainer:
+    """
+    Grad-CAM d'un modèle Keras, créé une fois par modèle chargé :
+        - la dernière couche de convolution est détectée une seule fois
+        - le sous-modèle, qui renvoie la sortie de la dernière couche de
+          convolution et les logits, est construit une seule fois, et son
+          calcul est compilé par tf.function
+        - les logits sont calculés à partir des poids de la dernière couche
+          Dense, sans désactiver softmax sur le modèle : l'explainer ne modifie
+          pas le modèle et peut être appelé par plusieurs sessions en même
+          temps
+        - l'explainer ne garde qu'une référence faible au modèle, pour ne pas
+          le maintenir en mémoire
+    """
+
+    def __init__(self, model, last_conv_layer=None):
+
+        self._model = weakref.ref(model)
+        self.last_conv_layer = find_last_conv_layer(model) if last_conv_layer is None else last_conv_layer
+
+        # Logits = entrée de la dernière couche Dense x ses poids ; sinon, la
+        # sortie du modèle est utilisée telle quelle
+        head = model.layers[-1]
+        self.head = head if isinstance(head, tf.keras.layers.Dense) else None
+        head_input = head.input if self.head is not None else model.output
+
+        self.grad_model = tf.keras.models.Model([model.inputs], [self.last_conv_layer.output, head_input])
+        self._heatmaps = tf.function(self._make_heatmaps, reduce_retracing=True)
+        self._predict_and_explain = tf.function(self._make_predictions_heatmaps, reduce_retracing=True)
+        self._image_heatmaps = tf.function(self._make_image_heatmaps, reduce_retracing=True)
+
+    @property
+    def model(self):
+        """
+        Modèle expliqué, ou None s'il a été libéré.
+        """
+
+        return self._model()
+
+    def logits(self, head_input):
+        """
+        Applique la dernière couche Dense sans son activation.
+        """
+
+        if self.head is None:
+            return head_input
+
+        logits = tf.matmul(head_input, self.head.kernel)
+        if self.head.use_bias:
+            logits = logits + self.head.bias
+        return logits
+
+    def _make_heatmaps(self, img_array, class_indexes):
+        """
+        Calcule les logits et les CAM de N images pour K classes :
+            - une seule passe avant (GradientTape) pour le lot d'images
+            - les gradients des K classes sont calculés ensemble (jacobien
+              vectorisé)
+            - la pondération des cartes d'activation par les gradients moyens
+              est une seule contraction (einsum)
+        """
+
+        with tf.GradientTape() as tape:
+            last_conv_layer_output, head_input = self.grad_model(img_array, training=False)
+            logits = self.logits(head_input)
+            # Les images du lot sont indépendantes : le gradient de la somme
+            # sur le lot donne le gradient de chaque image
+            class_channels = tf.reduce_sum(tf.gather(logits, class_indexes, axis=1), axis=0)
+
+        # (K, N, h, w, C)
+        grads = tape.jacobian(class_channels, last_conv_layer_output)
+        # (K, N, C)
+        pooled_grads = tf.reduce_mean(grads, axis=(2, 3))
+
+        # Multiplie chaque carte d'activation par son gradient moyen, puis
+        # moyenne sur les canaux
+        num_channels = tf.cast(tf.shape(last_conv_layer_output)[-1], last_conv_layer_output.dtype)
+        heatmaps = tf.einsum('nhwc,knc->nkhw', last_conv_layer_output, pooled_grads) / num_channels
+
+        return heatmaps, logits
+
+    def _make_image_heatmaps(self, img_array, class_indexes=None):
+        """
+        Calcule, en une seule passe avant (GradientTape), les probabilités de
+        N images et la CAM d'une classe par image : class_indexes[i] pour
+        l'image i, ou, sans class_indexes, sa classe la plus probable.
+        """
+
+        with tf.GradientTape() as tape:
+            last_conv_layer_output, head_input = self.grad_model(img_array, training=False)
+            logits = self.logits(head_input)
+            if class_indexes is None:
+                class_indexes = tf.argmax(logits, axis=1, output_type=tf.int32)
+            class_channels = tf.reduce_sum(tf.gather(logits, class_indexes, axis=1, batch_dims=1))
+
+        # Sortie du modèle : activation de la dernière couche sur les logits
+        probs = self.head.activation(logits) if self.head is not None else logits
+
+        # (N, h, w, C) -> (N, C)
+        grads = tape.gradient(class_channels, last_conv_layer_output)
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+
+        num_channels = tf.cast(tf.shape(last_conv_layer_output)[-1], last_conv_layer_output.dtype)
+        heatmaps = tf.einsum('nhwc,nc->nhw', last_conv_layer_output, pooled_grads) / num_channels
+
+        return probs, heatmaps
+
+    def _make_predictions_heatmaps(self, img_array):
+        """
+        Probabilités et CAM de la classe la plus probable de chaque image.
+        """
+
+        return self._make_image_heatmaps(img_array)
+
+    def predict_and_explain(self, img_array, top_k=3):
+        """
+        Prédiction et Grad-CAM de la classe la plus probable, en une seule
+        passe avant pour le lot d'images.
+        img_array : lot d'images preprocessées, de forme (N, H, W, 3)
+        top_k : nombre de classes les plus probables à renvoyer
+        Retourne un dictionnaire de tableaux numpy :
+            - 'probs' : probabilités des classes, (N, nb_classes)
+            - 'top_indexes' : indices des top_k classes, (N, top_k)
+            - 'top_probs' : probabilités des top_k classes, (N, top_k)
+            - 'heatmaps' : CAM de la classe la plus probable, (N, h, w)
+        """
+
+        probs, heatmaps = self._predict_and_explain(tf.convert_to_tensor(img_array, dtype=tf.float32))
+        probs = probs.numpy()
+
+        top_indexes = np.argsort(-probs, axis=1)[:, :top_k]
+
+        return {
+            'probs': probs,
+            'top_indexes': top_indexes,
+            'top_probs': np.take_along_axis(probs, top_indexes, axis=1),
+            'heatmaps': heatmaps.numpy(),
+        }
+
+    def explain_images(self, img_array, class_indexes):
+        """
+        CAM d'une classe par image, par exemple la classe prédite déjà
+        calculée, en une seule passe avant pour le lot d'images.
+        img_array : lot d'images preprocessées, de forme (N, H, W, 3)
+        class_indexes : liste des N indices de classes, un par image
+        Retourne les heatmaps, tableau numpy de forme (N, h, w).
+        """
+
+        img_array = tf.convert_to_tensor(img_array, dtype=tf.float32)
+        class_indexes = tf.convert_to_tensor(class_indexes, dtype=tf.int32)
+
+        _, heatmaps = self._image_heatmaps(img_array, class_indexes)
+        return heatmaps.numpy()
+
+    def explain(self, img_array, class_indexes):
+        """
+        img_array : lot d'images preprocessées, de forme (N, H, W, 3)
+        class_indexes : liste des K indices de classes
+        Retourne les heatmaps, tenseur de forme (N, K, h, w), h et w étant la
+        taille de la dernière couche de convolution.
+        """
+
+        img_array = tf.convert_to_tensor(img_array, dtype=tf.float32)
+        class_indexes = tf.convert_to_tensor(class_indexes, dtype=tf.int32)
+
+        heatmaps, _ = self._heatmaps(img_array, class_indexes)
+        return heatmaps
+
+
+# Explainers des modèles chargés : par modèle, puis par couche de convolution.
+# Les modèles sont des clés faibles : leurs explainers sont libérés avec eux
+_explainers = weakref.WeakKeyDictionary()
+_explainers_lock = threading.Lock()
+
+
+def get_explainer(model, last_conv_layer=None):
+    """
+    Renvoie l'explainer du modèle, créé au premier appel puis partagé. Sans
+    "last_conv_layer", la dernière couche de convolution détectée est
+    utilisée.
+    """
+
+    with _explainers_lock:
+        model_explainers = _explainers.setdefault(model, {})
+
+        if last_conv_layer is None:
+            if None not in model_explainers:
+                explainer = GradCAMExplainer(model)
+                model_explainers[None] = model_explainers[explainer.last_conv_layer.name] = explainer
+            return model_explainers[None]
+
+        if last_conv_layer.name not in model_explainers:
+            model_explainers[last_conv_layer.name] = GradCAMExplainer(model, last_conv_layer)
+        return model_explainers[last_conv_layer.name]
+
+
+def make_heatmaps(img_array, model, last_conv_layer, class_indexes):
+    """
+    Calcule les CAM (Class Activation Maps) de N images pour K classes en un
+    seul appel, avec l'explainer en cache du modèle.
+    img_array : lot d'images preprocessées, de forme (N, H, W, 3)
+    class_indexes : liste des K indices de classes
+    Retourne un tenseur de forme (N, K, h, w), h et w étant la taille de la
+    dernière couche de convolution.
+    """
+
+    return get_explainer(model, last_conv_layer).explain(img_array, class_indexes)
+
+
+def make_heatmap(img_array, model, last_conv_layer, class_index):
+    """
+    Calcule la CAM correspondant au label d'indice "class_index" pour l'image
+    "img_array" (lot d'une image).
+    Retourne la heatmap, tableau numpy de forme (h, w).
+    """
+
+    return make_heatmaps(img_array, model, last_conv_layer, [class_index])[0, 0].numpy()
+
+
+def predict_and_explain(model, img_array, classes, top_k=3):
+    """
+    Prédiction et Grad-CAM de la classe la plus probable d'une image (lot
+    d'une image), en une seule passe avant, avec l'explainer en cache du
+    modèle. L'affichage est laissé à l'appelant.
+    classes : noms des classes, dans l'ordre des sorties du modèle
+    Retourne un dictionnaire :
+        - 'probs' : probabilités des classes
+        - 'top_indexes', 'top_classes', 'top_probs' : indices, noms et
+          probabilités des top_k classes, par probabilité décroissante
+        - 'heatmap' : CAM de la classe la plus probable, tableau (h, w)
+    """
+
+    result = get_explainer(model).predict_and_explain(img_array, top_k)
+
+    top_indexes = result['top_indexes'][0]
+
+    return {
+        'probs': result['probs'][0],
+        'top_indexes': top_indexes,
+        'top_classes': [classes[i] for i in top_indexes],
+        'top_probs': result['top_probs'][0],
+        'heatmap': result['heatmaps'][0],
+    }
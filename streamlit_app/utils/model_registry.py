@@ -0,0 +1,101 @@
+# Authors:
+# Hajer Souaifi-Amara
+# Creation date: 18OCT2026
+# Modification date: 18OCT2026
+
+"""
+
+Registre des modèles de l'application Streamlit : chaque modèle est chargé une
+seule fois par processus, partagé entre les sessions, et préchauffé avec un
+lot factice (tracé des graphes TensorFlow, y compris celui du Grad-CAM) avant
+la première prédiction.
+
+"""
+
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import FTvgg16_utils
+from utils import FTmobilenetV2_utils
+from utils.gradcam_utils import get_explainer
+
+
+# Modèles de la démonstration : fonction de chargement (sans cache) et taille
+# des images en entrée
+MODELS = {
+    "Fine-tuned MobileNet V2": {
+        'build': FTmobilenetV2_utils.build_model,
+        'input_shape': (FTmobilenetV2_utils.img_height, FTmobilenetV2_utils.img_width, 3),
+    },
+    "Fine-tuned VGG16": {
+        'build': lambda: FTvgg16_utils.build_ft_vgg16('streamlit_app/data/models/FTvgg16/VGG16_model_weights_18MAR23-1_FT.h5'),
+        'input_shape': (FTvgg16_utils.img_height, FTvgg16_utils.img_width, 3),
+    },
+}
+
+
+def get_memory_usage():
+    """
+    Mémoire résidente du processus, en octets (0 si indisponible).
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+@st.cache_resource(show_spinner=False)
+def get_model(name):
+    """
+    Charge le modèle "name" de MODELS, une seule fois par processus, et le
+    préchauffe avec un lot factice.
+    Retourne le modèle et ses statistiques de chargement.
+    """
+
+    entry = MODELS[name]
+    memory_before = get_memory_usage()
+
+    t_temp = time()
+    model = entry['build']()
+    load_time = time() - t_temp
+
+    # Préchauffage : prédiction et Grad-CAM sur un lot factice
+    t_temp = time()
+    dummy = np.zeros((1,) + entry['input_shape'], dtype=np.float32)
+    model(dummy, training=False)
+    get_explainer(model).predict_and_explain(dummy)
+    warmup_time = time() - t_temp
+
+    stats = {
+        'model': name,
+        'load_time_s': load_time,
+        'warmup_time_s': warmup_time,
+        'memory_mb': (get_memory_usage() - memory_before) / 2**20,
+        'params': model.count_params(),
+    }
+
+    return model, stats
+
+
+def warm_up_models():
+    """
+    Charge et préchauffe tous les modèles (au démarrage de l'application).
+    """
+
+    for name in MODELS:
+        get_model(name)
+
+
+def get_models_stats():
+    """
+    Statistiques de chargement des modèles : temps de chargement et de
+    préchauffage, mémoire et nombre de paramètres.
+    """
+
+    return pd.DataFrame([get_model(name)[1] for name in MODELS])